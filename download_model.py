@@ -1,13 +1,11 @@
-from transformers import AutoModelForCausalLM, BitsAndBytesConfig
+import os
+import torch
+from src.model_artifact import export_artifact, get_artifact_dir
 
-nf4_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-)
+# تنزيل النموذج وحفظه محلياً (safetensors + tokenizer.json) ليُربط بالذاكرة
+# عند التشغيل وتتشارك العمليات صفحات الأوزان نفسها
+model_name = os.getenv('MODEL_NAME', "bigcode/starcoderbase-350m")
+dtype = torch.bfloat16 if os.getenv('ARTIFACT_DTYPE', 'fp32') == 'bf16' else torch.float32
 
-model = AutoModelForCausalLM.from_pretrained(
-    "bigcode/starcoderbase-350m",
-    quantization_config=nf4_config
-)
-
-model.save_pretrained("./local_model")
+result = export_artifact(model_name, get_artifact_dir(), dtype=dtype)
+print(f"تم حفظ النموذج في {result['path']} ({result['weights_mb']}MB) خلال {result['seconds']} ثانية")
@@ -0,0 +1,189 @@
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+import torch
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# أقل ميزانية لذاكرة KV حتى عندما تستهلك الأوزان معظم حد الذاكرة
+MIN_KV_BUDGET_MB = 32
+
+# رمز الخطأ في استجابات الخدمات عند رفض القبول
+ADMISSION_ERROR_CODE = "memory_admission"
+
+
+class AdmissionRejected(MemoryError):
+    """رفض طلب لأن ذاكرته التقديرية لا تتسع في الميزانية"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def admission_error_fields(error: Exception) -> Dict[str, Any]:
+    """حقول الخطأ الإضافية في استجابة الخدمة عند رفض القبول"""
+    if not isinstance(error, AdmissionRejected):
+        return {}
+    return {"error_code": ADMISSION_ERROR_CODE, "retry_after": error.retry_after}
+
+
+class KVMemoryModel:
+    """تقدير ذاكرة الطلب من أبعاد النموذج
+
+    ذاكرة KV لكل رمز في كل صف = 2 × الطبقات × رؤوس KV × بعد الرأس × حجم القيمة
+    (رؤوس KV تساوي 1 في نماذج multi-query مثل StarCoder). تُضاف ذاكرة عابرة
+    للترميز الأولي: القيم اللوغاريتمية لكل رموز الإدخال والتنشيطات.
+    """
+
+    def __init__(self, config, dtype=torch.float32):
+        layers = getattr(config, 'num_hidden_layers', None) or getattr(config, 'n_layer', 1)
+        hidden = getattr(config, 'hidden_size', None) or getattr(config, 'n_embd', 1)
+        heads = getattr(config, 'num_attention_heads', None) or getattr(config, 'n_head', 1)
+        if getattr(config, 'multi_query', False):
+            kv_heads = 1
+        else:
+            kv_heads = getattr(config, 'num_key_value_heads', None) or heads
+
+        self.value_bytes = torch.finfo(dtype).bits // 8 if dtype.is_floating_point else 4
+        self.kv_bytes_per_token = 2 * layers * kv_heads * (hidden // heads) * self.value_bytes
+        # القيم اللوغاريتمية تُعالج بدقة float32، والتنشيطات بعدة أضعاف البعد المخفي
+        self.prefill_bytes_per_token = getattr(config, 'vocab_size', 0) * 4 + 4 * hidden * self.value_bytes
+
+    def kv_bytes(self, rows: int, length: int) -> int:
+        """ذاكرة KV لعدد من الصفوف بطول واحد (الدفعة مبطنة إلى أطول تسلسل)"""
+        return rows * length * self.kv_bytes_per_token
+
+    def transient_bytes(self, input_tokens: int, rows: int) -> int:
+        """الذاكرة العابرة للترميز الأولي وخطوات فك الترميز"""
+        return input_tokens * self.prefill_bytes_per_token + rows * self.prefill_bytes_per_token
+
+
+class AdmissionController:
+    """التحكم في قبول طلبات التوليد حسب ميزانية ذاكرة KV
+
+    يُحجز لكل طلب تقدير ذاكرته قبل بدء التوليد ويُحرر بعد انتهائه. الدفعة
+    مبطنة إلى أطول تسلسل فيها، فالذاكرة المحجوزة = مجموع الصفوف × أطول طول +
+    الذاكرة العابرة. الطلب الذي لا يتسع ينتظر تحرير ذاكرة حتى مهلة محددة ثم
+    يُرفض، والطلب الأكبر من الميزانية كلها يُرفض فوراً.
+    """
+
+    def __init__(self, budget_mb: Optional[float] = None, wait_ms: int = 2000):
+        self.configured_budget_mb = budget_mb
+        self.budget_bytes = 0
+        self.wait_seconds = wait_ms / 1000
+        self.memory_model: Optional[KVMemoryModel] = None
+
+        self.condition = threading.Condition()
+        self.reservations: Dict[int, tuple] = {}
+        self.next_id = 0
+
+        # إحصائيات
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.peak_reserved_bytes = 0
+
+    def configure(self, config, dtype, headroom_mb: float):
+        """ضبط نموذج التقدير والميزانية بعد تحميل النموذج"""
+        budget_mb = self.configured_budget_mb
+        if budget_mb is None:
+            budget_mb = headroom_mb
+            if budget_mb < MIN_KV_BUDGET_MB:
+                logger.warning(
+                    f"المساحة المتبقية لذاكرة KV ({headroom_mb:.0f}MB) أقل من الحد الأدنى، استخدام {MIN_KV_BUDGET_MB}MB"
+                )
+                budget_mb = MIN_KV_BUDGET_MB
+        with self.condition:
+            self.memory_model = KVMemoryModel(config, dtype)
+            self.budget_bytes = int(budget_mb * 1024 * 1024)
+            self.condition.notify_all()
+        logger.info(f"ميزانية ذاكرة KV: {budget_mb:.0f}MB")
+
+    def _reserved_bytes(self, extra: Optional[tuple] = None) -> int:
+        """الذاكرة المحجوزة (مع حجز إضافي مقترح) - يُستدعى مع حجز القفل"""
+        entries = list(self.reservations.values()) + ([extra] if extra else [])
+        if not entries or self.memory_model is None:
+            return 0
+        rows = sum(entry[0] for entry in entries)
+        length = max(entry[1] for entry in entries)
+        return self.memory_model.kv_bytes(rows, length) + sum(entry[2] for entry in entries)
+
+    def estimate_bytes(self, input_tokens: int, max_new_tokens: int, rows: int = 1) -> int:
+        """الذاكرة التقديرية لطلب منفرد"""
+        if self.memory_model is None:
+            return 0
+        return (self.memory_model.kv_bytes(rows, input_tokens + max_new_tokens)
+                + self.memory_model.transient_bytes(input_tokens, rows))
+
+    @contextmanager
+    def reserve(self, input_tokens: int, max_new_tokens: int, rows: int = 1, deadline=None):
+        """حجز ذاكرة الطلب طوال مدة توليده"""
+        if self.memory_model is None:
+            yield
+            return
+
+        entry = (rows, input_tokens + max_new_tokens, self.memory_model.transient_bytes(input_tokens, rows))
+        needed = self.estimate_bytes(input_tokens, max_new_tokens, rows)
+        if needed > self.budget_bytes:
+            with self.condition:
+                self.rejected += 1
+            raise AdmissionRejected(
+                f"الطلب يحتاج {needed / 1024 / 1024:.1f}MB تقديرياً ويتجاوز ميزانية الذاكرة "
+                f"({self.budget_bytes / 1024 / 1024:.1f}MB)؛ قلل طول الإدخال أو max_tokens"
+            )
+
+        arrival = time.time()
+        wait_until = arrival + self.wait_seconds
+        if deadline is not None:
+            wait_until = min(wait_until, deadline.expires_at)
+
+        with self.condition:
+            waited = False
+            while self._reserved_bytes(entry) > self.budget_bytes:
+                remaining = wait_until - time.time()
+                if remaining <= 0:
+                    self.rejected += 1
+                    raise AdmissionRejected(
+                        "الذاكرة المتاحة للتوليد ممتلئة حالياً، يرجى المحاولة لاحقاً",
+                        retry_after=max(1.0, self.wait_seconds)
+                    )
+                if not waited:
+                    waited = True
+                    self.queued += 1
+                self.condition.wait(remaining)
+
+            reservation_id = self.next_id
+            self.next_id += 1
+            self.reservations[reservation_id] = entry
+            self.admitted += 1
+            self.total_wait += time.time() - arrival
+            self.peak_reserved_bytes = max(self.peak_reserved_bytes, self._reserved_bytes())
+
+        try:
+            yield
+        finally:
+            with self.condition:
+                del self.reservations[reservation_id]
+                self.condition.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """الحصول على إحصائيات القبول"""
+        with self.condition:
+            reserved = self._reserved_bytes()
+            return {
+                "budget_mb": round(self.budget_bytes / 1024 / 1024, 1),
+                "reserved_mb": round(reserved / 1024 / 1024, 2),
+                "peak_reserved_mb": round(self.peak_reserved_bytes / 1024 / 1024, 2),
+                "active_reservations": len(self.reservations),
+                "kv_bytes_per_token": self.memory_model.kv_bytes_per_token if self.memory_model else None,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 2) if self.admitted else 0
+            }
@@ -79,6 +79,10 @@ class RateLimiter:
             if not self.requests[api_key]:
                 del self.requests[api_key]
 
+# مستويات المفاتيح حسب حد الطلبات: (أقل حد، اسم المستوى، الأولوية في الطابور؛ الأصغر أولاً،
+# ووزن حصة المفتاح في الطابور العادل ما لم يحدد المفتاح وزنه)
+KEY_TIERS = [(100, "premium", 0, 4.0), (30, "standard", 1, 2.0), (0, "free", 2, 1.0)]
+
 class APIKeyManager:
     """مدير مفاتيح API"""
     
@@ -95,7 +99,7 @@ class APIKeyManager:
         
         if api_keys_env:
             try:
-                # تنسيق: key1:user1:10,key2:user2:5
+                # تنسيق: key1:user1:10,key2:user2:5 مع وزن اختياري في الطابور key3:user3:20:3
                 for key_info in api_keys_env.split(','):
                     parts = key_info.strip().split(':')
                     if len(parts) >= 3:
@@ -103,6 +107,7 @@ class APIKeyManager:
                         self.api_keys[key] = {
                             'user': user,
                             'rate_limit': rate_limit,
+                            'weight': float(parts[3]) if len(parts) >= 4 else None,
                             'created_at': datetime.now(),
                             'last_used': None,
                             'total_requests': 0,
@@ -173,6 +178,17 @@ class APIKeyManager:
         # التحقق من النقطة المحددة
         return endpoint in allowed_endpoints
     
+    def get_tier(self, api_key: Optional[str]) -> Dict[str, Any]:
+        """مستوى المفتاح وأولويته ووزنه في الطابور (المفتاح غير المعروف يُعامل كمستوى مجاني)"""
+        key_info = self.api_keys.get(api_key) if api_key else None
+        rate_limit = key_info['rate_limit'] if key_info else 0
+        _, tier, priority, weight = next(
+            (entry for entry in KEY_TIERS if rate_limit >= entry[0]), KEY_TIERS[-1]
+        )
+        if key_info and key_info.get('weight'):
+            weight = key_info['weight']
+        return {"tier": tier, "priority": priority, "weight": weight}
+    
     def get_api_key_stats(self, api_key: str) -> Optional[Dict[str, Any]]:
         """الحصول على إحصائيات مفتاح API"""
         key_info = self.api_keys.get(api_key)
@@ -183,6 +199,8 @@ class APIKeyManager:
             "api_key": api_key[:8] + "...",  # إخفاء جزء من المفتاح
             "user": key_info['user'],
             "rate_limit": key_info['rate_limit'],
+            "tier": self.get_tier(api_key)["tier"],
+            "queue_weight": self.get_tier(api_key)["weight"],
             "total_requests": key_info['total_requests'],
             "created_at": key_info['created_at'].isoformat(),
             "last_used": key_info['last_used'].isoformat() if key_info['last_used'] else None,
@@ -0,0 +1,640 @@
+import time
+import queue
+import threading
+import logging
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+import torch
+
+from src.prefix_cache import map_cache
+from src.stopping import BATCH_WINDOW_MS, DeadlineExceeded, GenerationCancelled
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _first_tensor(past):
+    """الحصول على أول موتر في ذاكرة KV"""
+    while not isinstance(past, torch.Tensor):
+        past = past[0]
+    return past
+
+
+def process_logits(logits: torch.Tensor, contexts: List[List[int]], temperatures: List[float],
+                   penalties: List[float], top_k: int) -> torch.Tensor:
+    """تطبيق عقوبة التكرار ودرجة الحرارة و top-k على صفوف القيم اللوغاريتمية"""
+    logits = logits.float().clone()
+
+    for row, (context, penalty) in enumerate(zip(contexts, penalties)):
+        if penalty != 1.0 and context:
+            seen = torch.tensor(context, dtype=torch.long)
+            scores = logits[row].gather(0, seen)
+            scores = torch.where(scores < 0, scores * penalty, scores / penalty)
+            logits[row].scatter_(0, seen, scores)
+
+    logits = logits / torch.tensor(
+        [max(t, 1e-5) for t in temperatures], dtype=logits.dtype
+    ).unsqueeze(-1)
+
+    if top_k and top_k < logits.shape[-1]:
+        threshold = torch.topk(logits, top_k, dim=-1).values[:, -1:]
+        logits = logits.masked_fill(logits < threshold, float('-inf'))
+
+    return logits
+
+
+class GenerationRequest:
+    """طلب توليد واحد داخل الدفعة"""
+
+    def __init__(self, input_ids: List[int], max_new_tokens: int, temperature: float,
+                 repetition_penalty: float, stream: bool = False, do_sample: bool = True,
+                 endpoint: Optional[str] = None, stopping=None, deadline=None):
+        self.input_ids = input_ids
+        self.endpoint = endpoint or "default"
+        # معايير إيقاف مبكر اختيارية خاصة بالخدمة (StoppingCriteria)
+        self.stopping = stopping
+        # موعد نهائي اختياري (Deadline)؛ truncated يعني أن التوليد أوقف عنده
+        self.deadline = deadline
+        self.truncated = False
+        # يُضبط عند انقطاع العميل فيخرج التسلسل من الدفعة في الخطوة التالية
+        self.cancelled = False
+        # عينات إضافية تشارك الطلب الـ prompt نفسه وتُرمز معه مرة واحدة
+        self.forks: List['GenerationRequest'] = []
+        # مجموع لوغاريتم احتمالات الرموز المولدة (لترتيب العينات)
+        self.track_logprobs = False
+        self.logprob_sum = 0.0
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.repetition_penalty = repetition_penalty
+        self.do_sample = do_sample
+        self.generated_ids: List[int] = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+        # طابور الرموز للبث أثناء التوليد (None يعني نهاية التسلسل)
+        self.token_queue = queue.Queue() if stream else None
+
+    def fork(self, stopping=None) -> 'GenerationRequest':
+        """إضافة عينة أخرى بنفس المعاملات تشارك هذا الطلب مرحلة الترميز الأولي"""
+        sibling = GenerationRequest(
+            self.input_ids, self.max_new_tokens, self.temperature, self.repetition_penalty,
+            stream=False, do_sample=self.do_sample, endpoint=self.endpoint,
+            stopping=stopping, deadline=self.deadline
+        )
+        sibling.track_logprobs = self.track_logprobs
+        self.forks.append(sibling)
+        return sibling
+
+    def group(self) -> List['GenerationRequest']:
+        """الطلب مع عيناته الإضافية"""
+        return [self] + self.forks
+
+    def append_token(self, token: int):
+        """إضافة رمز مولد وبثه إن كان البث مفعلاً"""
+        self.generated_ids.append(token)
+        if self.token_queue is not None:
+            self.token_queue.put(token)
+
+    def cancel(self):
+        """إلغاء الطلب وعيناته (يُفحص في المجدول بعد كل خطوة)"""
+        for member in self.group():
+            member.cancelled = True
+
+    def finish(self, error: Optional[Exception] = None):
+        """إنهاء الطلب وإيقاظ المنتظر"""
+        self.error = error
+        self.finished_at = time.time()
+        self.done.set()
+        if self.token_queue is not None:
+            self.token_queue.put(None)
+
+
+class BatchScheduler:
+    """مجدول الدفعات المستمرة للتوليد
+
+    يجمع الطلبات المتزامنة في دفعة واحدة مبطنة من اليسار، وينفذ خطوة فك
+    ترميز واحدة لكل الدفعة. تغادر التسلسلات المكتملة الدفعة وتنضم الطلبات
+    الجديدة عند حدود خطوات فك الترميز.
+    """
+
+    def __init__(self, model_manager, max_batch_size=4, batch_window_ms=BATCH_WINDOW_MS, top_k=50):
+        self.model_manager = model_manager
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window_ms / 1000
+        self.top_k = top_k
+
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.worker_thread = None
+        self.running = False
+
+        # دالة اختيارية تُنفذ داخل خيط الجدولة عند بدئه (مثل تثبيت الأنوية)
+        self.worker_init = None
+
+        # سياق تعطيل التدرج (no_grad أو inference_mode حسب وضع التحسين)
+        self.grad_context = torch.no_grad
+
+        # حالة الدفعة النشطة
+        self.active: List[GenerationRequest] = []
+        self.past_key_values = None
+        self.attention_mask = None
+        self.next_tokens = None
+        self.kv_seq_dim = None
+
+        # فك الترميز التخميني يُستخدم لطلب منفرد عند توفر نموذج مسودة
+        self.speculative = None
+        self.speculative_state = None
+
+        # إحصائيات
+        self.total_requests = 0
+        self.expired_requests = 0
+        self.cancelled_requests = 0
+        self.total_tokens = 0
+        self.total_steps = 0
+        self.total_batch_rows = 0
+        self.busy_time = 0.0
+        self.max_observed_batch = 0
+        self.single_step_time = 0.0
+
+    def start(self):
+        """بدء خيط الجدولة"""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+            self.worker_thread = threading.Thread(target=self._worker_loop, daemon=True)
+            self.worker_thread.start()
+        logger.info("تم بدء مجدول الدفعات")
+
+    def stop(self):
+        """إيقاف خيط الجدولة وإلغاء الطلبات المعلقة"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.worker_thread:
+            self.worker_thread.join(timeout=5)
+        self._fail_all(RuntimeError("تم إيقاف مجدول الدفعات"))
+        logger.info("تم إيقاف مجدول الدفعات")
+
+    def submit(self, request: GenerationRequest) -> GenerationRequest:
+        """إضافة طلب إلى المجدول"""
+        if not self.running:
+            self.start()
+
+        with self.condition:
+            self.pending.append(request)
+            self.total_requests += 1
+            self.condition.notify_all()
+        return request
+
+    def _worker_loop(self):
+        """حلقة الجدولة الرئيسية"""
+        if self.worker_init is not None:
+            try:
+                self.worker_init()
+            except Exception as e:
+                logger.error(f"خطأ في تهيئة خيط الجدولة: {str(e)}")
+
+        while True:
+            with self.condition:
+                while self.running and not self.pending and not self._has_work():
+                    self.condition.wait()
+                if not self.running:
+                    return
+
+                # عند الخمول ننتظر نافذة قصيرة لتجميع طلبات متزامنة
+                if not self._has_work():
+                    window_end = time.time() + self.batch_window
+                    while self.running and len(self.pending) < self.max_batch_size:
+                        remaining = window_end - time.time()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+
+                occupied = len(self.active) + (1 if self.speculative_state else 0)
+                free_slots = self.max_batch_size - occupied
+                joining = []
+                slots = 0
+                while self.pending:
+                    request = self.pending[0]
+                    size = len(request.forks) + 1
+                    # مجموعة العينات تنضم كاملة، والمجموعة الأكبر من الدفعة تنضم إلى دفعة فارغة
+                    if slots + size > free_slots and (slots or occupied):
+                        break
+                    self.pending.popleft()
+                    # إسقاط الطلبات التي انقضت مهلتها أثناء الانتظار قبل أن تستخدم النموذج
+                    if request.deadline is not None and request.deadline.expired():
+                        self.expired_requests += 1
+                        for member in request.group():
+                            member.finish(DeadlineExceeded("انقضت مهلة الطلب أثناء الانتظار"))
+                        continue
+                    if request.cancelled:
+                        self.cancelled_requests += 1
+                        for member in request.group():
+                            member.finish(GenerationCancelled("أُلغي الطلب أثناء الانتظار"))
+                        continue
+                    joining.append(request)
+                    slots += size
+
+            step_start = time.time()
+            try:
+                with self.model_manager.model_lock:
+                    if self.model_manager.model is None:
+                        raise RuntimeError("النموذج غير محمل")
+                    if joining and self.speculative_state is not None:
+                        # وصول طلبات جديدة ينقل التسلسل التخميني إلى الدفعة العادية
+                        self._handoff_speculative()
+
+                    if (joining and not self.active and len(joining) == 1 and not joining[0].forks
+                            and self._can_speculate()):
+                        self.speculative_state = self.speculative.start(joining[0])
+                        self._check_speculative_finished()
+                    elif joining:
+                        self._prefill(joining)
+                    elif self.speculative_state is not None:
+                        self.speculative.step(self.speculative_state)
+                        self._check_speculative_finished()
+                    elif self.active:
+                        self._decode_step()
+            except Exception as e:
+                logger.error(f"خطأ في خطوة الدفعة: {str(e)}")
+                for request in joining:
+                    for member in request.group():
+                        if not member.done.is_set():
+                            member.finish(e)
+                self._fail_active(e)
+            finally:
+                self.busy_time += time.time() - step_start
+
+    def get_load(self) -> int:
+        """عدد الطلبات المعلقة والتسلسلات النشطة (لاختيار النسخة الأقل حملاً)"""
+        with self.condition:
+            pending = sum(len(request.forks) + 1 for request in self.pending)
+            return pending + len(self.active) + (1 if self.speculative_state else 0)
+
+    def _has_work(self) -> bool:
+        """التحقق من وجود تسلسلات قيد التوليد"""
+        return bool(self.active) or self.speculative_state is not None
+
+    def _can_speculate(self) -> bool:
+        """التحقق من توفر فك الترميز التخميني"""
+        return self.speculative is not None and self.model_manager.draft_model is not None
+
+    def _check_speculative_finished(self):
+        """إنهاء الطلب التخميني عند اكتماله"""
+        state = self.speculative_state
+        if state is not None and self._is_finished(state.request):
+            state.request.finish()
+            self.speculative_state = None
+
+    def _handoff_speculative(self):
+        """نقل التسلسل التخميني إلى الدفعة مع ذاكرة KV الخاصة به"""
+        state = self.speculative_state
+        self.speculative_state = None
+
+        # ذاكرة النموذج الرئيسي تغطي جميع الرموز عدا الأخير الذي يصبح الإدخال التالي
+        attention_mask = torch.ones((1, state.target_len), dtype=torch.long)
+        next_tokens = torch.tensor([state.tokens[-1]], dtype=torch.long)
+        self._merge([state.request], state.target_past, attention_mask, next_tokens, append=False)
+
+    def _prefill(self, requests: List[GenerationRequest]):
+        """ترميز الطلبات الجديدة ودمجها في الدفعة النشطة"""
+        prefix_cache = self.model_manager.prefix_cache
+        uncached = []
+
+        for request in requests:
+            prefix_length, prefix_past = (0, None)
+            if self.kv_seq_dim is not None:
+                prefix_length, prefix_past = prefix_cache.lookup(request.input_ids, self.kv_seq_dim)
+
+            if prefix_past is None:
+                uncached.append(request)
+            else:
+                # معالجة اللاحقة فقط فوق ذاكرة KV المخزنة للبادئة
+                self._prefill_with_prefix(request, prefix_length, prefix_past)
+
+        if uncached:
+            self._prefill_batch(uncached)
+
+        self._retire_finished()
+
+    def _prefill_batch(self, requests: List[GenerationRequest]):
+        """ترميز مجموعة طلبات دفعة واحدة مع تبطين من اليسار"""
+        model = self.model_manager.model
+        pad_id = self.model_manager.tokenizer.pad_token_id
+        max_len = max(len(r.input_ids) for r in requests)
+
+        # تبطين من اليسار حتى تنتهي جميع التسلسلات عند نفس الموضع
+        input_ids = torch.full((len(requests), max_len), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(requests), max_len), dtype=torch.long)
+        for row, request in enumerate(requests):
+            length = len(request.input_ids)
+            input_ids[row, max_len - length:] = torch.tensor(request.input_ids, dtype=torch.long)
+            attention_mask[row, max_len - length:] = 1
+
+        position_ids = attention_mask.cumsum(-1) - 1
+        position_ids.masked_fill_(attention_mask == 0, 1)
+
+        with self.grad_context():
+            outputs = model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                use_cache=True
+            )
+
+        past = self._legacy_cache(outputs.past_key_values)
+        if self.kv_seq_dim is None:
+            self.kv_seq_dim = self.detect_seq_dim(past, max_len)
+
+        # تخزين ذاكرة KV لكل prompt لإعادة استخدام بادئته لاحقاً
+        for row, request in enumerate(requests):
+            start = max_len - len(request.input_ids)
+            row_past = map_cache(
+                past,
+                lambda t: t.narrow(0, row, 1).narrow(self.kv_seq_dim, start, t.shape[self.kv_seq_dim] - start)
+            )
+            self.model_manager.prefix_cache.store(request.input_ids, row_past, self.kv_seq_dim)
+
+        requests, past, attention_mask, logits = self._expand_forks(
+            requests, past, attention_mask, outputs.logits[:, -1, :]
+        )
+        next_tokens = self._sample(logits, requests)
+        self._merge(requests, past, attention_mask, next_tokens)
+
+    def _prefill_with_prefix(self, request: GenerationRequest, prefix_length: int, prefix_past):
+        """ترميز طلب واحد بدءاً من ذاكرة KV لبادئته"""
+        logits, past = self.forward_single(
+            self.model_manager.model, request.input_ids[prefix_length:], prefix_past, prefix_length
+        )
+        self.model_manager.prefix_cache.store(request.input_ids, past, self.kv_seq_dim)
+
+        attention_mask = torch.ones((1, len(request.input_ids)), dtype=torch.long)
+        requests, past, attention_mask, logits = self._expand_forks([request], past, attention_mask, logits[-1:])
+        next_tokens = self._sample(logits, requests)
+        self._merge(requests, past, attention_mask, next_tokens)
+
+    def _expand_forks(self, requests: List[GenerationRequest], past, attention_mask: torch.Tensor,
+                      logits: torch.Tensor):
+        """نسخ صف كل طلب لعيناته الإضافية بعد الترميز الأولي المشترك"""
+        if not any(request.forks for request in requests):
+            return requests, past, attention_mask, logits
+
+        rows = []
+        expanded = []
+        for row, request in enumerate(requests):
+            for member in request.group():
+                rows.append(row)
+                expanded.append(member)
+        index = torch.tensor(rows, dtype=torch.long)
+        past = map_cache(past, lambda t: t.index_select(0, index))
+        return expanded, past, attention_mask.index_select(0, index), logits.index_select(0, index)
+
+    def forward_single(self, model, token_ids: List[int], past, start: int):
+        """تمرير تسلسل واحد غير مبطن عبر النموذج بدءاً من الموضع start"""
+        total_length = start + len(token_ids)
+        input_ids = torch.tensor([token_ids], dtype=torch.long)
+        attention_mask = torch.ones((1, total_length), dtype=torch.long)
+        position_ids = torch.arange(start, total_length, dtype=torch.long).unsqueeze(0)
+
+        with self.grad_context():
+            outputs = model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=past,
+                use_cache=True
+            )
+
+        return outputs.logits[0], self._legacy_cache(outputs.past_key_values)
+
+    def detect_seq_dim(self, past, length: int) -> int:
+        """تحديد بعد التسلسل في ذاكرة KV (يختلف حسب بنية النموذج)"""
+        return -2 if _first_tensor(past).shape[-2] == length else 1
+
+    def _legacy_cache(self, past):
+        """تحويل ذاكرة KV إلى صيغة tuple عند الحاجة"""
+        if hasattr(past, 'to_legacy_cache'):
+            return past.to_legacy_cache()
+        return past
+
+    def _decode_step(self):
+        """تنفيذ خطوة فك ترميز واحدة لجميع تسلسلات الدفعة"""
+        model = self.model_manager.model
+        batch_size = len(self.active)
+        step_start = time.time()
+
+        self.attention_mask = torch.cat(
+            [self.attention_mask, torch.ones((batch_size, 1), dtype=torch.long)], dim=-1
+        )
+        position_ids = self.attention_mask.sum(-1, keepdim=True) - 1
+
+        with self.grad_context():
+            outputs = model(
+                input_ids=self.next_tokens,
+                attention_mask=self.attention_mask,
+                position_ids=position_ids,
+                past_key_values=self.past_key_values,
+                use_cache=True
+            )
+
+        self.past_key_values = self._legacy_cache(outputs.past_key_values)
+
+        next_tokens = self._sample(outputs.logits[:, -1, :], self.active)
+        self.next_tokens = next_tokens.unsqueeze(-1)
+        for request, token in zip(self.active, next_tokens.tolist()):
+            request.append_token(token)
+
+        if batch_size == 1:
+            # زمن الخطوة لتسلسل منفرد يُستخدم كأساس لقياس تسريع فك الترميز التخميني
+            step_time = time.time() - step_start
+            self.single_step_time = step_time if not self.single_step_time else 0.9 * self.single_step_time + 0.1 * step_time
+
+        self.total_steps += 1
+        self.total_batch_rows += batch_size
+        self.total_tokens += batch_size
+        self._retire_finished()
+
+    def _sample(self, logits: torch.Tensor, requests: List[GenerationRequest]) -> torch.Tensor:
+        """اختيار الرمز التالي لكل صف بمعاملات الطلب الخاصة به"""
+        raw_logits = logits
+        logits = process_logits(
+            logits,
+            [r.input_ids + r.generated_ids for r in requests],
+            [r.temperature for r in requests],
+            [r.repetition_penalty for r in requests],
+            self.top_k
+        )
+
+        probs = torch.softmax(logits, dim=-1)
+        next_tokens = torch.multinomial(probs, num_samples=1).squeeze(-1)
+
+        # الصفوف الحتمية تستخدم الاختيار الجشع بدلاً من أخذ العينات
+        greedy = torch.tensor([not r.do_sample for r in requests])
+        if greedy.any():
+            next_tokens = torch.where(greedy, logits.argmax(dim=-1), next_tokens)
+
+        # احتمال الرمز المختار تحت توزيع النموذج الأصلي (قبل درجة الحرارة والعقوبة)
+        if any(r.track_logprobs for r in requests):
+            chosen = torch.log_softmax(raw_logits.float(), dim=-1).gather(1, next_tokens.unsqueeze(-1)).squeeze(-1)
+            for request, value in zip(requests, chosen.tolist()):
+                request.logprob_sum += value
+        return next_tokens
+
+    def _merge(self, requests: List[GenerationRequest], past, attention_mask: torch.Tensor,
+               next_tokens: torch.Tensor, append: bool = True):
+        """دمج الطلبات الجديدة مع الدفعة النشطة بمحاذاة أطوال ذاكرة KV"""
+        if append:
+            for request, token in zip(requests, next_tokens.tolist()):
+                request.append_token(token)
+            self.total_tokens += len(requests)
+        next_tokens = next_tokens.unsqueeze(-1)
+
+        if not self.active:
+            self.active = list(requests)
+            self.past_key_values = past
+            self.attention_mask = attention_mask
+            self.next_tokens = next_tokens
+        else:
+            current_len = self.attention_mask.shape[1]
+            new_len = attention_mask.shape[1]
+            target_len = max(current_len, new_len)
+
+            self.past_key_values = self._concat_caches(
+                self._left_pad_cache(self.past_key_values, target_len - current_len),
+                self._left_pad_cache(past, target_len - new_len)
+            )
+            self.attention_mask = torch.cat([
+                self._left_pad_mask(self.attention_mask, target_len - current_len),
+                self._left_pad_mask(attention_mask, target_len - new_len)
+            ], dim=0)
+            self.next_tokens = torch.cat([self.next_tokens, next_tokens], dim=0)
+            self.active.extend(requests)
+
+        self.max_observed_batch = max(self.max_observed_batch, len(self.active))
+
+    def _left_pad_cache(self, past, pad_len: int):
+        """تبطين ذاكرة KV من اليسار على بعد التسلسل"""
+        if pad_len <= 0:
+            return past
+        seq_dim = self.kv_seq_dim
+
+        def pad(tensor):
+            shape = list(tensor.shape)
+            shape[seq_dim] = pad_len
+            return torch.cat([tensor.new_zeros(shape), tensor], dim=seq_dim)
+
+        return map_cache(past, pad)
+
+    def _left_pad_mask(self, mask: torch.Tensor, pad_len: int) -> torch.Tensor:
+        """تبطين قناع الانتباه من اليسار"""
+        if pad_len <= 0:
+            return mask
+        return torch.cat([mask.new_zeros((mask.shape[0], pad_len)), mask], dim=-1)
+
+    def _concat_caches(self, first, second):
+        """ضم ذاكرتي KV على بعد الدفعة"""
+        if isinstance(first, torch.Tensor):
+            return torch.cat([first, second], dim=0)
+        return tuple(self._concat_caches(a, b) for a, b in zip(first, second))
+
+    def _is_finished(self, request: GenerationRequest) -> bool:
+        """التحقق من اكتمال تسلسل"""
+        if request.cancelled:
+            return True
+        if not request.generated_ids:
+            return False
+        if request.generated_ids[-1] == self.model_manager.tokenizer.eos_token_id:
+            return True
+        if len(request.generated_ids) >= request.max_new_tokens:
+            return True
+        # معيار الإيقاف الزمني: إرجاع ما تولد حتى الآن عند انقضاء المهلة
+        if request.deadline is not None and request.deadline.expired():
+            request.truncated = True
+            return True
+        return request.stopping is not None and request.stopping.check(request.generated_ids)
+
+    def _retire_finished(self):
+        """إخراج التسلسلات المكتملة من الدفعة"""
+        keep = []
+        for row, request in enumerate(self.active):
+            if self._is_finished(request):
+                if request.cancelled:
+                    self.cancelled_requests += 1
+                request.finish()
+            else:
+                keep.append(row)
+
+        if len(keep) == len(self.active):
+            return
+
+        if not keep:
+            self._reset_state()
+            return
+
+        index = torch.tensor(keep, dtype=torch.long)
+        self.active = [self.active[row] for row in keep]
+        self.past_key_values = map_cache(self.past_key_values, lambda t: t.index_select(0, index))
+        self.attention_mask = self.attention_mask.index_select(0, index)
+        self.next_tokens = self.next_tokens.index_select(0, index)
+
+        # حذف أعمدة التبطين التي لم تعد مستخدمة من أي صف
+        used_columns = self.attention_mask.any(dim=0).nonzero()
+        start = int(used_columns[0]) if len(used_columns) else 0
+        if start > 0:
+            seq_dim = self.kv_seq_dim
+            self.attention_mask = self.attention_mask[:, start:]
+            self.past_key_values = map_cache(
+                self.past_key_values,
+                lambda t: t.narrow(seq_dim, start, t.shape[seq_dim] - start)
+            )
+
+    def _reset_state(self):
+        """تفريغ حالة الدفعة النشطة"""
+        self.active = []
+        self.past_key_values = None
+        self.attention_mask = None
+        self.next_tokens = None
+
+    def _fail_active(self, error: Exception):
+        """إنهاء جميع طلبات الدفعة النشطة بخطأ"""
+        if self.speculative_state is not None:
+            self.active.append(self.speculative_state.request)
+            self.speculative_state = None
+        for request in self.active:
+            if not request.done.is_set():
+                request.finish(error)
+        self._reset_state()
+
+    def _fail_all(self, error: Exception):
+        """إنهاء جميع الطلبات النشطة والمعلقة بخطأ"""
+        with self.condition:
+            pending = list(self.pending)
+            self.pending.clear()
+        for request in pending:
+            for member in request.group():
+                member.finish(error)
+        self._fail_active(error)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """الحصول على إحصائيات المجدول"""
+        with self.condition:
+            pending = len(self.pending)
+        return {
+            "max_batch_size": self.max_batch_size,
+            "batch_window_ms": round(self.batch_window * 1000, 1),
+            "active_sequences": len(self.active) + (1 if self.speculative_state else 0),
+            "pending_requests": pending,
+            "total_requests": self.total_requests,
+            "expired_requests": self.expired_requests,
+            "cancelled_requests": self.cancelled_requests,
+            "total_tokens": self.total_tokens,
+            "decode_steps": self.total_steps,
+            "avg_batch_size": round(self.total_batch_rows / self.total_steps, 2) if self.total_steps else 0,
+            "max_observed_batch": self.max_observed_batch,
+            "tokens_per_second": round(self.total_tokens / self.busy_time, 2) if self.busy_time else 0,
+            "speculative": self.speculative.get_stats() if self._can_speculate() else None
+        }
@@ -2,13 +2,20 @@ import re
 import json
 import logging
 import autopep8
-from typing import Dict, Any, List, Optional
-from src.model_manager import model_manager
+from typing import Dict, Any, List, Optional, Callable
+from src.model_manager import model_registry
+from src.admission import admission_error_fields
+from src.stopping import Deadline, StoppingCriteria, CODE_FENCE, CODE_STOP_STRINGS
+from src.context_packer import PromptContext
+from src.generation_cache import cache_options, parse_flag
 
 # إعداد نظام السجلات
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# أقصى عدد لعينات الإكمال في طلب واحد
+MAX_COMPLETION_SAMPLES = 8
+
 class CodeServices:
     """خدمات البرمجة المتكاملة"""
     
@@ -35,6 +42,14 @@ class CodeServices:
         """التحقق من دعم اللغة"""
         return lang.lower() in self.supported_languages
     
+    def parse_sample_count(self, data: Dict[str, Any]) -> int:
+        """عدد عينات الإكمال n (عدد صحيح بين 1 و MAX_COMPLETION_SAMPLES)"""
+        n = data.get('n', 1)
+        # القيم المنطقية أعداد صحيحة في Python لكنها ليست عدداً صالحاً في JSON
+        if isinstance(n, bool) or not isinstance(n, int) or not 1 <= n <= MAX_COMPLETION_SAMPLES:
+            raise ValueError(f"n يجب أن يكون عدداً صحيحاً بين 1 و {MAX_COMPLETION_SAMPLES}")
+        return n
+    
     def clean_code(self, code: str) -> str:
         """تنظيف الكود من الرموز غير المرغوبة"""
         # إزالة الرموز الخاصة والمسافات الزائدة
@@ -76,54 +91,110 @@ class CodeServices:
             logger.warning(f"فشل في تنسيق الكود: {str(e)}")
             return code
     
-    def complete_code(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        """إكمال الكود تلقائياً"""
+    def complete_code(self, data: Dict[str, Any], on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """إكمال الكود تلقائياً
+        
+        يقبل code (الإكمال بعد نهايته) أو prefix و suffix للملء في المنتصف عند المؤشر.
+        """
         try:
-            code = data.get('code', '').strip()
+            suffix = data.get('suffix')
+            if suffix is not None:
+                code = data.get('prefix', data.get('code', ''))
+            else:
+                code = data.get('code', '').strip()
             lang = data.get('lang', 'python').lower()
             max_tokens = data.get('max_tokens', 100)
             temperature = data.get('temperature', 0.7)
+            n = self.parse_sample_count(data)
             
-            if not code:
+            if not code and not suffix:
                 raise ValueError("الكود المدخل فارغ")
             
             if not self.validate_language(lang):
                 raise ValueError(f"اللغة {lang} غير مدعومة")
             
-            # إنشاء prompt للإكمال
-            prompt = f"# Complete this {lang} code:\n{code}"
+            # إنشاء prompt للإكمال (يُعبأ حول المؤشر عند تجاوز ميزانية الإدخال)
+            prompt = PromptContext(f"# Complete this {lang} code:\n", code, lang=lang, suffix=suffix)
             
             # توليد الإكمال
-            completion = model_manager.generate_text(
-                prompt=prompt,
-                max_length=max_tokens,
-                temperature=temperature
+            deadline = Deadline.from_data(data)
+            cache_result, deterministic = cache_options(data)
+            usage = {}
+            # إنهاء الإكمال عند اكتمال الكتلة الحالية
+            stopping = StoppingCriteria(
+                stop_strings=CODE_STOP_STRINGS,
+                blank_line_dedent=True,
+                python_code=code if lang == 'python' and suffix is None else None
             )
             
-            # تنظيف وتنسيق النتيجة
-            completion = self.clean_code(completion)
-            if completion:
-                completion = self.format_code(completion, lang)
+            candidates = None
+            if n > 1:
+                # عدة عينات بترميز أولي مشترك في مرور واحد
+                samples = model_registry.generate_samples(
+                    prompt=prompt,
+                    n=n,
+                    max_length=max_tokens,
+                    temperature=temperature,
+                    endpoint='completions',
+                    usage=usage,
+                    deadline=deadline,
+                    stopping=stopping,
+                    dedup=parse_flag(data.get('dedup'), True),
+                    rank=parse_flag(data.get('rank'), True)
+                )
+                candidates = []
+                for sample in samples:
+                    text = self.clean_code(sample["text"])
+                    candidates.append({
+                        "completion": self.format_code(text, lang) if text else text,
+                        "mean_logprob": round(sample["mean_logprob"], 4),
+                        "tokens": sample["tokens"]
+                    })
+                completion = candidates[0]["completion"] if candidates else ""
+            else:
+                completion = model_registry.generate_text(
+                    prompt=prompt,
+                    max_length=max_tokens,
+                    temperature=temperature,
+                    on_token=on_token,
+                    cache_result=cache_result,
+                    deterministic=deterministic,
+                    endpoint='completions',
+                    usage=usage,
+                    deadline=deadline,
+                    stopping=stopping
+                )
+                
+                # تنظيف وتنسيق النتيجة
+                completion = self.clean_code(completion)
+                if completion:
+                    completion = self.format_code(completion, lang)
             
-            return {
+            result = {
                 "success": True,
+                "usage": usage,
+                "truncated": usage["truncated"],
                 "completion": completion,
                 "original_code": code,
                 "language": lang,
-                "tokens_generated": len(completion.split()) if completion else 0
+                "tokens_generated": usage.get("output_tokens", 0)
             }
+            if candidates is not None:
+                result["completions"] = candidates
+            return result
             
         except Exception as e:
             logger.error(f"خطأ في إكمال الكود: {str(e)}")
             return {
                 "success": False,
                 "error": str(e),
+                **admission_error_fields(e),
                 "completion": "",
                 "original_code": data.get('code', ''),
                 "language": data.get('lang', 'python')
             }
     
-    def explain_code(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def explain_code(self, data: Dict[str, Any], on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """شرح الكود بلغة طبيعية"""
         try:
             code = data.get('code', '').strip()
@@ -138,17 +209,33 @@ class CodeServices:
             
             # إنشاء prompt للشرح
             if detail_level == 'basic':
-                prompt = f"Explain this {lang} code briefly in Arabic:\n{code}\nExplanation:"
+                prompt = PromptContext(f"Explain this {lang} code briefly in Arabic:\n", code, "\nExplanation:", lang)
             elif detail_level == 'detailed':
-                prompt = f"Explain this {lang} code in detail in Arabic, including complexity and best practices:\n{code}\nDetailed explanation:"
+                prompt = PromptContext(
+                    f"Explain this {lang} code in detail in Arabic, including complexity and best practices:\n",
+                    code, "\nDetailed explanation:", lang
+                )
             else:
-                prompt = f"Explain this {lang} code in Arabic:\n{code}\nExplanation:"
+                prompt = PromptContext(f"Explain this {lang} code in Arabic:\n", code, "\nExplanation:", lang)
             
             # توليد الشرح
-            explanation = model_manager.generate_text(
+            deadline = Deadline.from_data(data)
+            cache_result, deterministic = cache_options(data)
+            usage = {}
+            explanation = model_registry.generate_text(
                 prompt=prompt,
                 max_length=200,
-                temperature=0.5
+                temperature=0.5,
+                on_token=on_token,
+                cache_result=cache_result,
+                deterministic=deterministic,
+                endpoint='explanations',
+                usage=usage,
+                deadline=deadline,
+                stopping=StoppingCriteria(
+                    stop_strings=["\n\n\n"],
+                    token_budget=80 if detail_level == 'basic' else None
+                )
             )
             
             # تحليل تعقد الكود
@@ -159,6 +246,8 @@ class CodeServices:
             
             return {
                 "success": True,
+                "usage": usage,
+                "truncated": usage["truncated"],
                 "explanation": explanation.strip(),
                 "complexity": complexity,
                 "suggestions": suggestions,
@@ -171,11 +260,12 @@ class CodeServices:
             return {
                 "success": False,
                 "error": str(e),
+                **admission_error_fields(e),
                 "explanation": "",
                 "language": data.get('lang', 'python')
             }
     
-    def convert_language(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def convert_language(self, data: Dict[str, Any], on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """تحويل الكود بين اللغات"""
         try:
             code = data.get('code', '').strip()
@@ -189,13 +279,25 @@ class CodeServices:
                 raise ValueError("إحدى اللغات غير مدعومة")
             
             # إنشاء prompt للتحويل
-            prompt = f"Convert this {from_lang} code to {to_lang}:\n{code}\n{to_lang} equivalent:"
+            prompt = PromptContext(
+                f"Convert this {from_lang} code to {to_lang}:\n", code, f"\n{to_lang} equivalent:", from_lang
+            )
             
             # توليد التحويل
-            converted_code = model_manager.generate_text(
+            deadline = Deadline.from_data(data)
+            cache_result, deterministic = cache_options(data)
+            usage = {}
+            converted_code = model_registry.generate_text(
                 prompt=prompt,
                 max_length=150,
-                temperature=0.3
+                temperature=0.3,
+                on_token=on_token,
+                cache_result=cache_result,
+                deterministic=deterministic,
+                endpoint='conversions',
+                usage=usage,
+                deadline=deadline,
+                stopping=StoppingCriteria(stop_strings=[CODE_FENCE])
             )
             
             # تنظيف وتنسيق النتيجة
@@ -205,6 +307,8 @@ class CodeServices:
             
             return {
                 "success": True,
+                "usage": usage,
+                "truncated": usage["truncated"],
                 "converted_code": converted_code,
                 "original_code": code,
                 "from_language": from_lang,
@@ -217,12 +321,13 @@ class CodeServices:
             return {
                 "success": False,
                 "error": str(e),
+                **admission_error_fields(e),
                 "converted_code": "",
                 "from_language": data.get('from', 'python'),
                 "to_language": data.get('to', 'javascript')
             }
     
-    def refactor_code(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def refactor_code(self, data: Dict[str, Any], on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """إعادة هيكلة الكود"""
         try:
             code = data.get('code', '').strip()
@@ -237,17 +342,27 @@ class CodeServices:
             
             # إنشاء prompt لإعادة الهيكلة
             if refactor_type == 'performance':
-                prompt = f"Refactor this {lang} code for better performance:\n{code}\nOptimized code:"
+                prompt = PromptContext(f"Refactor this {lang} code for better performance:\n", code, "\nOptimized code:", lang)
             elif refactor_type == 'readability':
-                prompt = f"Refactor this {lang} code for better readability:\n{code}\nCleaner code:"
+                prompt = PromptContext(f"Refactor this {lang} code for better readability:\n", code, "\nCleaner code:", lang)
             else:
-                prompt = f"Refactor and improve this {lang} code:\n{code}\nImproved code:"
+                prompt = PromptContext(f"Refactor and improve this {lang} code:\n", code, "\nImproved code:", lang)
             
             # توليد الكود المحسن
-            refactored_code = model_manager.generate_text(
+            deadline = Deadline.from_data(data)
+            cache_result, deterministic = cache_options(data)
+            usage = {}
+            refactored_code = model_registry.generate_text(
                 prompt=prompt,
                 max_length=200,
-                temperature=0.4
+                temperature=0.4,
+                on_token=on_token,
+                cache_result=cache_result,
+                deterministic=deterministic,
+                endpoint='refactors',
+                usage=usage,
+                deadline=deadline,
+                stopping=StoppingCriteria(stop_strings=[CODE_FENCE])
             )
             
             # تنظيف وتنسيق النتيجة
@@ -260,6 +375,8 @@ class CodeServices:
             
             return {
                 "success": True,
+                "usage": usage,
+                "truncated": usage["truncated"],
                 "refactored_code": refactored_code,
                 "original_code": code,
                 "language": lang,
@@ -272,6 +389,7 @@ class CodeServices:
             return {
                 "success": False,
                 "error": str(e),
+                **admission_error_fields(e),
                 "refactored_code": "",
                 "language": data.get('lang', 'python')
             }
@@ -0,0 +1,233 @@
+import re
+import ast
+import logging
+from typing import Callable, List, Optional, Set
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# رموز الملء في المنتصف (FIM) المستخدمة في نماذج StarCoder
+FIM_PREFIX = "<fim_prefix>"
+FIM_SUFFIX = "<fim_suffix>"
+FIM_MIDDLE = "<fim_middle>"
+
+# حصة ذيل الكود (الأقرب إلى المؤشر) من الميزانية قبل إضافة السياق
+TAIL_SHARE = 0.75
+# حصة بداية اللاحقة من ميزانية الكود في طلبات FIM
+SUFFIX_SHARE = 0.25
+
+# أسطر الاستيراد في اللغات الأخرى
+IMPORT_PATTERN = re.compile(r'^\s*(import\s|from\s+\S+\s+import\s|#include\s|using\s|require\(|const\s+\w+\s*=\s*require\()')
+# تعريفات الدوال والأصناف لتحديد النطاقات عند تعذر التحليل
+SCOPE_PATTERN = re.compile(r'^(\s*)(async\s+def|def|class)\s')
+
+ELLIPSIS_LINE = "..."
+
+
+class PromptContext:
+    """أجزاء الـ prompt قبل تعبئتها: بادئة القالب والكود ولاحقة القالب
+
+    الكود ينتهي عند موضع المؤشر، و suffix (اختياري) هو الكود بعد المؤشر في
+    طلبات الملء في المنتصف.
+    """
+
+    def __init__(self, template_prefix: str, code: str, template_suffix: str = "",
+                 lang: str = "python", suffix: Optional[str] = None):
+        self.template_prefix = template_prefix
+        self.code = code
+        self.template_suffix = template_suffix
+        self.lang = lang
+        self.suffix = suffix
+
+    @property
+    def text(self) -> str:
+        """الـ prompt الكامل دون تعبئة (يُستخدم مفتاحاً للذاكرة المؤقتة)"""
+        if self.suffix is not None:
+            return f"{FIM_PREFIX}{self.template_prefix}{self.code}{FIM_SUFFIX}{self.suffix}{FIM_MIDDLE}"
+        return f"{self.template_prefix}{self.code}{self.template_suffix}"
+
+
+class ContextPacker:
+    """تعبئة الـ prompt ضمن ميزانية الرموز مع مراعاة موضع المؤشر
+
+    تُحفظ بادئة القالب ولاحقته كاملتين، ثم ذيل الكود الأقرب إلى المؤشر، ثم
+    أسطر الاستيراد وتواقيع الدوال والأصناف المحيطة بالمؤشر (من ast في Python)
+    حتى تنفد الميزانية، وما تبقى منها يمد الذيل إلى الخلف.
+    """
+
+    def __init__(self, tokenizer, max_tokens: int = 512, encode: Optional[Callable[[str], List[int]]] = None):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        # دالة الترميز (ذاكرة الترميز المؤقتة عادة) لتجنب إعادة ترميز الأسطر المتكررة
+        self.encode = encode or (lambda text: tokenizer.encode(text, add_special_tokens=False))
+
+    def count(self, text: str) -> int:
+        """عدد رموز النص"""
+        return len(self.encode(text)) if text else 0
+
+    def supports_fim(self) -> bool:
+        """التحقق من دعم المحلل اللغوي لرموز الملء في المنتصف"""
+        vocab = self.tokenizer.get_vocab()
+        return all(token in vocab for token in (FIM_PREFIX, FIM_SUFFIX, FIM_MIDDLE))
+
+    def pack(self, context: PromptContext) -> str:
+        """إرجاع نص الـ prompt المعبأ ضمن الميزانية"""
+        if context.suffix is not None and self.supports_fim():
+            return self._pack_fim(context)
+
+        if context.suffix is not None:
+            # بدون رموز FIM يُكمل النموذج ما قبل المؤشر فقط
+            context = PromptContext(context.template_prefix, context.code, context.template_suffix, context.lang)
+
+        full_text = context.text
+        if self.count(full_text) <= self.max_tokens:
+            return full_text
+
+        budget = self.max_tokens - self.count(context.template_prefix) - self.count(context.template_suffix)
+        packed = full_text
+        # عدّ الأسطر منفردة تقريبي عند حدود الأسطر، فيُعاد التعبئة بميزانية أصغر عند التجاوز
+        for _ in range(3):
+            code = self.pack_code(context.code, context.lang, max(0, budget))
+            packed = f"{context.template_prefix}{code}{context.template_suffix}"
+            overflow = self.count(packed) - self.max_tokens
+            if overflow <= 0:
+                break
+            budget -= overflow
+        return packed
+
+    def _pack_fim(self, context: PromptContext) -> str:
+        """تعبئة طلب الملء في المنتصف: ذيل ما قبل المؤشر وبداية ما بعده"""
+        full_text = context.text
+        if self.count(full_text) <= self.max_tokens:
+            return full_text
+
+        fixed = self.count(f"{FIM_PREFIX}{context.template_prefix}{FIM_SUFFIX}{FIM_MIDDLE}")
+        budget = max(0, self.max_tokens - fixed)
+        suffix = self._head_lines(context.suffix, int(budget * SUFFIX_SHARE))
+        code = self.pack_code(context.code, context.lang, budget - self.count(suffix))
+        return f"{FIM_PREFIX}{context.template_prefix}{code}{FIM_SUFFIX}{suffix}{FIM_MIDDLE}"
+
+    def pack_code(self, code: str, lang: str, budget: int) -> str:
+        """اختيار أسطر الكود الأهم ضمن الميزانية مع الحفاظ على ترتيبها"""
+        lines = code.split('\n')
+        costs = [self.count(line + '\n') for line in lines]
+        if sum(costs) <= budget:
+            return code
+
+        # 1. ذيل الكود الأقرب إلى المؤشر
+        tail_start = len(lines)
+        used = 0
+        while tail_start > 0 and used + costs[tail_start - 1] <= budget * TAIL_SHARE:
+            tail_start -= 1
+            used += costs[tail_start]
+
+        # 2. تواقيع النطاقات المحيطة (الأقرب أولاً) ثم أسطر الاستيراد
+        selected: Set[int] = set()
+        gap_cost = self.count(self._gap_marker(lang) + '\n')
+        for group in self._context_lines(lines, lang):
+            group = [i for i in group if i < tail_start and i not in selected]
+            cost = sum(costs[i] for i in group) + gap_cost
+            if group and used + cost <= budget:
+                selected.update(group)
+                used += cost
+
+        # 3. مد الذيل إلى الخلف بما تبقى من الميزانية
+        while tail_start > 0:
+            previous = tail_start - 1
+            if previous not in selected:
+                if used + costs[previous] > budget:
+                    break
+                used += costs[previous]
+            tail_start = previous
+
+        marker = self._gap_marker(lang)
+        packed: List[str] = []
+        previous = -1
+        for i in sorted(selected | set(range(tail_start, len(lines)))):
+            if i != previous + 1:
+                packed.append(marker)
+            packed.append(lines[i])
+            previous = i
+        return '\n'.join(packed)
+
+    @staticmethod
+    def _gap_marker(lang: str) -> str:
+        """سطر يدل على أسطر محذوفة (تعليق في Python ليبقى الكود صالحاً)"""
+        return "# " + ELLIPSIS_LINE if lang == 'python' else ELLIPSIS_LINE
+
+    def _head_lines(self, text: str, budget: int) -> str:
+        """أول أسطر النص ضمن الميزانية"""
+        kept = []
+        used = 0
+        for line in text.split('\n'):
+            cost = self.count(line + '\n')
+            if used + cost > budget:
+                break
+            kept.append(line)
+            used += cost
+        return '\n'.join(kept)
+
+    def _context_lines(self, lines: List[str], lang: str) -> List[List[int]]:
+        """مجموعات أسطر السياق بالأولوية: تواقيع النطاقات المحيطة ثم الاستيرادات"""
+        if lang == 'python':
+            groups = self._python_context(lines)
+            if groups is not None:
+                return groups
+
+        # بديل نصي: أسطر الاستيراد والنطاقات المحيطة حسب المسافة البادئة
+        groups = []
+        indent = None
+        for i in range(len(lines) - 1, -1, -1):
+            match = SCOPE_PATTERN.match(lines[i])
+            stripped = lines[i].strip()
+            if not stripped:
+                continue
+            current = len(lines[i]) - len(lines[i].lstrip())
+            if match and (indent is None or current < indent):
+                groups.append([i])
+            if indent is None or current < indent:
+                indent = current
+        imports = [i for i, line in enumerate(lines) if IMPORT_PATTERN.match(line)]
+        if imports:
+            groups.append(imports)
+        return groups
+
+    def _python_context(self, lines: List[str]) -> Optional[List[List[int]]]:
+        """النطاقات المحيطة بالمؤشر والاستيرادات من شجرة ast
+
+        الكود عند المؤشر غالباً غير مكتمل، فتُحذف الأسطر الأخيرة حتى يصبح
+        قابلاً للتحليل.
+        """
+        tree = None
+        end = len(lines)
+        while end > 0 and len(lines) - end <= 20:
+            try:
+                tree = ast.parse('\n'.join(lines[:end]))
+                break
+            except SyntaxError:
+                end -= 1
+        if tree is None:
+            return None
+
+        groups = []
+        node_list = list(tree.body)
+        # النطاقات المتداخلة التي تمتد حتى آخر سطر قابل للتحليل
+        scopes = []
+        while node_list:
+            node = node_list.pop()
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.end_lineno >= end:
+                scopes.append(node)
+                node_list = list(node.body)
+        for node in reversed(scopes):
+            start = min([d.lineno for d in node.decorator_list] + [node.lineno]) - 1
+            body_start = node.body[0].lineno - 1 if node.body else node.lineno
+            groups.append(list(range(start, max(body_start, node.lineno))))
+
+        imports = []
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                imports.extend(range(node.lineno - 1, node.end_lineno))
+        if imports:
+            groups.append(sorted(set(imports)))
+        return groups
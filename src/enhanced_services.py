@@ -2,8 +2,12 @@ import re
 import json
 import ast
 import logging
-from typing import Dict, Any, List, Optional, Tuple
-from src.model_manager import model_manager
+from typing import Dict, Any, List, Optional, Callable, Tuple
+from src.model_manager import model_registry
+from src.admission import admission_error_fields
+from src.stopping import Deadline, StoppingCriteria, CODE_FENCE
+from src.context_packer import PromptContext
+from src.generation_cache import cache_options
 
 # إعداد نظام السجلات
 logging.basicConfig(level=logging.INFO)
@@ -186,7 +190,7 @@ class EnhancedServices:
                 "documentation": []
             }
     
-    def explain_concept(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def explain_concept(self, data: Dict[str, Any], on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """شرح مفهوم برمجي"""
         try:
             concept = data.get('concept', '').strip()
@@ -205,10 +209,20 @@ class EnhancedServices:
                 prompt = f"Explain the concept of '{concept}' in {lang} programming in Arabic with examples:"
             
             # توليد الشرح
-            explanation = model_manager.generate_text(
+            deadline = Deadline.from_data(data)
+            cache_result, deterministic = cache_options(data)
+            usage = {}
+            explanation = model_registry.generate_text(
                 prompt=prompt,
                 max_length=250,
-                temperature=0.6
+                temperature=0.6,
+                on_token=on_token,
+                cache_result=cache_result,
+                deterministic=deterministic,
+                endpoint='explain_concept',
+                usage=usage,
+                deadline=deadline,
+                stopping=StoppingCriteria(stop_strings=["\n\n\n"])
             )
             
             # إنشاء مثال عملي
@@ -216,6 +230,8 @@ class EnhancedServices:
             
             return {
                 "success": True,
+                "usage": usage,
+                "truncated": usage["truncated"],
                 "concept": concept,
                 "explanation": explanation.strip(),
                 "example": example,
@@ -229,11 +245,12 @@ class EnhancedServices:
             return {
                 "success": False,
                 "error": str(e),
+                **admission_error_fields(e),
                 "explanation": "",
                 "concept": data.get('concept', '')
             }
     
-    def simplify_code(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def simplify_code(self, data: Dict[str, Any], on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """تبسيط الكود المعقد"""
         try:
             code = data.get('code', '').strip()
@@ -243,13 +260,25 @@ class EnhancedServices:
                 raise ValueError("الكود المدخل فارغ")
             
             # إنشاء prompt للتبسيط
-            prompt = f"Simplify this {lang} code to make it easier to understand:\n{code}\nSimplified version:"
+            prompt = PromptContext(
+                f"Simplify this {lang} code to make it easier to understand:\n", code, "\nSimplified version:", lang
+            )
             
             # توليد النسخة المبسطة
-            simplified_code = model_manager.generate_text(
+            deadline = Deadline.from_data(data)
+            cache_result, deterministic = cache_options(data)
+            usage = {}
+            simplified_code = model_registry.generate_text(
                 prompt=prompt,
                 max_length=150,
-                temperature=0.4
+                temperature=0.4,
+                on_token=on_token,
+                cache_result=cache_result,
+                deterministic=deterministic,
+                endpoint='simplify_code',
+                usage=usage,
+                deadline=deadline,
+                stopping=StoppingCriteria(stop_strings=[CODE_FENCE])
             )
             
             # تنظيف النتيجة
@@ -260,6 +289,8 @@ class EnhancedServices:
             
             return {
                 "success": True,
+                "usage": usage,
+                "truncated": usage["truncated"],
                 "simplified_code": simplified_code,
                 "original_code": code,
                 "language": lang,
@@ -272,6 +303,7 @@ class EnhancedServices:
             return {
                 "success": False,
                 "error": str(e),
+                **admission_error_fields(e),
                 "simplified_code": data.get('code', ''),
                 "language": data.get('lang', 'python')
             }
@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# تكلفة تقديرية ثابتة لكل مدخل (المفتاح والقاموس والطوابع الزمنية)
+ENTRY_OVERHEAD_BYTES = 256
+
+# نسبة ميزانية الذاكرة المؤقتة للنتائج من حد ذاكرة النموذج (ما لم تُحدد RESPONSE_CACHE_MB)
+RESPONSE_CACHE_FRACTION = 0.03
+
+
+def response_cache_budget_mb(max_memory_mb: float) -> float:
+    """ميزانية ذاكرة النتائج: RESPONSE_CACHE_MB أو نسبة من حد الذاكرة"""
+    configured = os.getenv('RESPONSE_CACHE_MB')
+    return float(configured) if configured else max_memory_mb * RESPONSE_CACHE_FRACTION
+
+
+def parse_flag(value, default: bool = False) -> bool:
+    """تحويل قيمة JSON إلى قيمة منطقية (النص "false" و"0" تعني False)"""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes', 'on')
+    return bool(value)
+
+
+def cache_options(data: Dict[str, Any]) -> Tuple[bool, bool]:
+    """خيارا cache و deterministic لطلب توليد
+
+    التخزين المؤقت اختياري لكل طلب، وافتراضه يتبع deterministic: نتيجة فك
+    الترميز الحتمي قابلة لإعادة الاستخدام، أما العينات العشوائية فلا تُخزن حتى
+    يحصل العميل الذي يعيد المحاولة على إكمال مختلف.
+    """
+    deterministic = parse_flag(data.get('deterministic'), False)
+    return parse_flag(data.get('cache'), deterministic), deterministic
+
+
+class GenerationCache:
+    """ذاكرة مؤقتة للنتائج المطابقة تماماً لطلبات التوليد
+
+    المفتاح هو الـ prompt مع معاملات التوليد، والإخراج LRU مع مدة صلاحية
+    (TTL) وحد أقصى للحجم بالبايت يُحتسب من ميزانية ذاكرة النموذج.
+    """
+
+    def __init__(self, max_memory_mb=16, ttl_seconds=600, max_entries=1000):
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Tuple, Tuple[str, float, int, Optional[Dict[str, Any]]]]" = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        # إحصائيات
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(prompt: str, max_length: int, temperature: float, repetition_penalty: float,
+                 deterministic: bool, stop: Tuple = None) -> Tuple:
+        """إنشاء مفتاح الذاكرة المؤقتة من الـ prompt ومعاملات التوليد ومعايير الإيقاف"""
+        # درجة الحرارة لا تؤثر على فك الترميز الحتمي
+        if deterministic:
+            temperature = 0.0
+        return (prompt, int(max_length), float(temperature), float(repetition_penalty), deterministic, stop)
+
+    def get(self, key: Tuple, usage: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """البحث عن نتيجة مخزنة (usage يُملأ بعدد الرموز المخزن معها)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            text, expires_at, nbytes, entry_usage = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                self.total_bytes -= nbytes
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if usage is not None and entry_usage:
+                usage.update(entry_usage)
+            return text
+
+    def put(self, key: Tuple, text: str, usage: Optional[Dict[str, Any]] = None):
+        """تخزين نتيجة مع إخراج الأقدم عند تجاوز الحدود"""
+        nbytes = len(key[0].encode('utf-8')) + len(text.encode('utf-8')) + ENTRY_OVERHEAD_BYTES
+        if nbytes > self.max_bytes:
+            return
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous[2]
+
+            self.entries[key] = (text, time.time() + self.ttl_seconds, nbytes, usage)
+            self.total_bytes += nbytes
+
+            self._purge_expired()
+            while self.entries and (self.total_bytes > self.max_bytes or len(self.entries) > self.max_entries):
+                _, (_, _, evicted_bytes, _) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def _purge_expired(self):
+        """حذف المدخلات منتهية الصلاحية"""
+        now = time.time()
+        expired = [key for key, (_, expires_at, _, _) in self.entries.items() if expires_at < now]
+        for key in expired:
+            self.total_bytes -= self.entries.pop(key)[2]
+        self.expirations += len(expired)
+
+    def clear(self):
+        """مسح جميع المدخلات"""
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """الحصول على إحصائيات الذاكرة المؤقتة"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "memory_mb": round(self.total_bytes / 1024 / 1024, 3),
+                "memory_limit_mb": round(self.max_bytes / 1024 / 1024, 2),
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
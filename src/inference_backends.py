@@ -0,0 +1,423 @@
+import os
+import re
+import time
+import inspect
+import logging
+from typing import Dict, Any, List, Optional
+
+import psutil
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM
+from transformers.modeling_outputs import CausalLMOutputWithPast
+
+from src.model_artifact import is_artifact, load_mmap_model
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ONNX Runtime اختياري؛ عند غيابه تُستخدم الواجهة الخلفية لـ PyTorch
+try:
+    import numpy as np
+    import onnxruntime as ort
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+# prompts قياسية لمقارنة الواجهات الخلفية
+BENCHMARK_PROMPTS = [
+    "# Complete this python code:\ndef fibonacci(n):\n",
+    "Explain this python code in Arabic:\nfor i in range(10):\n    print(i)\n",
+    "# Convert this python code to javascript:\ndef add(a, b):\n    return a + b\n"
+]
+
+
+# الدقات المدعومة للواجهة الخلفية PyTorch
+PRECISIONS = ["fp32", "bf16", "int8"]
+
+
+def get_process_memory_mb() -> float:
+    """استخدام ذاكرة العملية الحالية (RSS) بالميجابايت"""
+    return psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024
+
+
+class InferenceBackend:
+    """واجهة الواجهات الخلفية للاستدلال
+
+    كل واجهة خلفية ترجع كائناً يُستدعى مثل نماذج transformers (input_ids،
+    attention_mask، position_ids، past_key_values) ويرجع logits و
+    past_key_values بصيغة tuple، فيعمل معه مجدول الدفعات دون تعديل.
+    """
+
+    name = "base"
+
+    def load_model(self, model_name: str):
+        """تحميل النموذج وإرجاع كائن قابل للاستدعاء"""
+        raise NotImplementedError
+
+
+def apply_precision(model, precision: str):
+    """تحويل نموذج fp32 إلى الدقة المطلوبة"""
+    if precision == "bf16":
+        return model.to(torch.bfloat16)
+    if precision == "fp32":
+        return model.to(torch.float32)
+    if precision == "int8":
+        # التكميم الديناميكي يحول طبقات Linear فقط ويبقي البقية fp32
+        return torch.ao.quantization.quantize_dynamic(model.float(), {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+class TorchBackend(InferenceBackend):
+    """الاستدلال المباشر عبر PyTorch بالدقة المحددة"""
+
+    name = "torch"
+
+    def __init__(self, precision: str = "fp32"):
+        self.precision = precision
+
+    def load_model(self, model_name: str):
+        """تحميل النموذج ثم تحويله إلى الدقة المطلوبة
+
+        النموذج المحلي يُربط بالذاكرة فتتشارك العمليات صفحاته، ويبقى التشارك
+        ما دامت الدقة المطلوبة مطابقة لنوع الأوزان المحفوظة.
+        """
+        if is_artifact(model_name):
+            model = load_mmap_model(model_name)
+        else:
+            model = AutoModelForCausalLM.from_pretrained(
+                model_name,
+                torch_dtype=torch.float32,
+                trust_remote_code=True,
+                low_cpu_mem_usage=True
+            )
+            model.eval()
+        return apply_precision(model, self.precision)
+
+
+class KVLayout:
+    """بنية ذاكرة KV لكل طبقة كما تُرجعها نماذج transformers بصيغة tuple
+
+    النماذج العادية تحفظ لكل طبقة موترين (key, value) بالشكل
+    (الدفعة، رؤوس KV، التسلسل، بعد الرأس). GPTBigCode (StarCoder) يدمجهما في
+    موتر واحد بعد أخير 2 × بعد الرأس، وبلا محور للرؤوس في وضع multi-query.
+    """
+
+    def __init__(self, num_layers: int, fused: bool, head_dims: tuple, tail_dim: int, model_type: str = ""):
+        self.model_type = model_type
+        self.num_layers = num_layers
+        self.fused = fused
+        self.head_dims = head_dims
+        self.tail_dim = tail_dim
+        self.seq_axis = 1 + len(head_dims)
+
+    @classmethod
+    def from_config(cls, config) -> 'KVLayout':
+        """استنتاج البنية من إعدادات النموذج دون تحميل الأوزان"""
+        num_layers = getattr(config, 'num_hidden_layers', None) or getattr(config, 'n_layer', None)
+        heads = getattr(config, 'num_attention_heads', None) or getattr(config, 'n_head', None)
+        hidden = getattr(config, 'hidden_size', None) or getattr(config, 'n_embd', None)
+        if not (num_layers and heads and hidden):
+            raise ValueError(f"تعذر استنتاج أبعاد ذاكرة KV من إعدادات النموذج {config.model_type}")
+        head_dim = hidden // heads
+
+        if config.model_type == 'gpt_bigcode':
+            head_dims = () if getattr(config, 'multi_query', True) else (heads,)
+            return cls(num_layers, fused=True, head_dims=head_dims, tail_dim=2 * head_dim, model_type=config.model_type)
+        kv_heads = getattr(config, 'num_key_value_heads', None) or heads
+        return cls(num_layers, fused=False, head_dims=(kv_heads,), tail_dim=head_dim, model_type=config.model_type)
+
+    def shape(self, batch_size: int, length: int) -> tuple:
+        """شكل موتر KV واحد"""
+        return (batch_size,) + self.head_dims + (length, self.tail_dim)
+
+    def names(self, prefix: str) -> List[str]:
+        """أسماء موترات KV المسطحة في ملف ONNX"""
+        if self.fused:
+            return [f"{prefix}_{i}" for i in range(self.num_layers)]
+        return [f"{prefix}_{i}_{kind}" for i in range(self.num_layers) for kind in ("key", "value")]
+
+    def flatten(self, past) -> List[torch.Tensor]:
+        """تسطيح ذاكرة KV إلى قائمة موترات بترتيب الأسماء"""
+        if self.fused:
+            return list(past)
+        return [tensor for layer in past for tensor in layer]
+
+    def unflatten(self, tensors) -> tuple:
+        """إعادة بناء ذاكرة KV من قائمة موترات مسطحة"""
+        if self.fused:
+            return tuple(tensors)
+        return tuple((tensors[2 * i], tensors[2 * i + 1]) for i in range(self.num_layers))
+
+    def length(self, past) -> int:
+        """طول التسلسل المخزن في ذاكرة KV"""
+        return self.flatten(past)[0].shape[self.seq_axis] if past else 0
+
+    def validate(self, past):
+        """التحقق من أن ذاكرة KV الفعلية تطابق البنية المستنتجة"""
+        tensors = self.flatten(past) if len(past) == self.num_layers else []
+        expected = len(self.names("past"))
+        if len(tensors) != expected or any(
+            not isinstance(t, torch.Tensor) or t.dim() != self.seq_axis + 2 or t.shape[-1] != self.tail_dim
+            for t in tensors
+        ):
+            raise ValueError(f"بنية ذاكرة KV لنماذج {self.model_type} غير مدعومة في تصدير ONNX")
+
+
+class _ExportWrapper(torch.nn.Module):
+    """تغليف النموذج بمدخلات ومخرجات مسطحة لتصديره إلى ONNX"""
+
+    def __init__(self, model, layout: KVLayout):
+        super().__init__()
+        self.model = model
+        self.layout = layout
+
+    def forward(self, input_ids, attention_mask, position_ids, *past_flat):
+        past = self.layout.unflatten(past_flat)
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=past,
+            use_cache=True,
+            return_dict=True
+        )
+        present = outputs.past_key_values
+        if hasattr(present, 'to_legacy_cache'):
+            present = present.to_legacy_cache()
+        return (outputs.logits,) + tuple(self.layout.flatten(present))
+
+
+class OnnxCausalLM:
+    """نموذج سببي يعمل عبر ONNX Runtime بواجهة نماذج transformers
+
+    يستخدم IO binding لربط موترات PyTorch مباشرة بمدخلات ومخرجات الجلسة دون
+    نسخ، وتُعاد ذاكرة KV الناتجة كما هي لتُمرر في خطوة فك الترميز التالية.
+    """
+
+    dtype = torch.float32
+
+    def __init__(self, session, config, layout: KVLayout):
+        self.session = session
+        self.config = config
+        self.layout = layout
+        self.vocab_size = session.get_outputs()[0].shape[-1]
+        if not isinstance(self.vocab_size, int):
+            self.vocab_size = config.vocab_size
+
+    def eval(self):
+        return self
+
+    def _bind_input(self, binding, name: str, tensor: torch.Tensor):
+        """ربط موتر PyTorch كمدخل للجلسة"""
+        element_type = np.int64 if tensor.dtype == torch.long else np.float32
+        binding.bind_input(name, 'cpu', 0, element_type, tuple(tensor.shape), tensor.data_ptr())
+
+    def _bind_output(self, binding, name: str, tensor: torch.Tensor):
+        """ربط موتر PyTorch مخصص مسبقاً كمخرج للجلسة"""
+        binding.bind_output(name, 'cpu', 0, np.float32, tuple(tensor.shape), tensor.data_ptr())
+
+    def __call__(self, input_ids, attention_mask=None, position_ids=None, past_key_values=None,
+                 use_cache=True, **kwargs):
+        layout = self.layout
+        batch_size, seq_length = input_ids.shape
+        past_length = layout.length(past_key_values)
+        total_length = past_length + seq_length
+
+        if attention_mask is None:
+            attention_mask = torch.ones((batch_size, total_length), dtype=torch.long)
+        if position_ids is None:
+            position_ids = (attention_mask.long().cumsum(-1) - 1).clamp(min=0)[:, past_length:]
+        if not past_key_values:
+            empty = torch.zeros(layout.shape(batch_size, 0), dtype=torch.float32)
+            past_key_values = layout.unflatten([empty] * len(layout.names("past")))
+
+        # الموترات يجب أن تبقى متصلة في الذاكرة طوال التنفيذ
+        inputs = {
+            "input_ids": input_ids.long().contiguous(),
+            "attention_mask": attention_mask.long().contiguous(),
+            "position_ids": position_ids.long().contiguous()
+        }
+        for name, tensor in zip(layout.names("past"), layout.flatten(past_key_values)):
+            inputs[name] = tensor.float().contiguous()
+
+        logits = torch.empty((batch_size, seq_length, self.vocab_size), dtype=torch.float32)
+        present_shape = layout.shape(batch_size, total_length)
+        present = [torch.empty(present_shape, dtype=torch.float32) for _ in layout.names("present")]
+
+        binding = self.session.io_binding()
+        for name, tensor in inputs.items():
+            self._bind_input(binding, name, tensor)
+        self._bind_output(binding, "logits", logits)
+        for name, tensor in zip(layout.names("present"), present):
+            self._bind_output(binding, name, tensor)
+        self.session.run_with_iobinding(binding)
+
+        return CausalLMOutputWithPast(logits=logits, past_key_values=layout.unflatten(present))
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """الاستدلال على المعالج عبر ONNX Runtime
+
+    يُصدَّر النموذج مرة واحدة إلى ملف ONNX يُحفظ في مجلد البيانات الدائم،
+    وتُعيد التشغيلات اللاحقة استخدامه مباشرة دون تحميل نموذج PyTorch (تكفي
+    الإعدادات لمعرفة بنية ذاكرة KV).
+    """
+
+    name = "onnx"
+
+    def __init__(self, cache_dir: Optional[str] = None, num_threads: Optional[int] = None):
+        self.cache_dir = cache_dir or os.getenv('ONNX_CACHE_DIR', '/app/data/onnx')
+        self.num_threads = num_threads or int(os.getenv('ONNX_NUM_THREADS', 0))
+
+    def model_path(self, model_name: str) -> str:
+        """مسار ملف ONNX الخاص بالنموذج"""
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)
+        return os.path.join(self.cache_dir, f"{safe_name}.onnx")
+
+    def load_model(self, model_name: str):
+        """تحميل النموذج من ملف ONNX مع تصديره عند عدم وجوده"""
+        if not ONNX_AVAILABLE:
+            raise RuntimeError("مكتبة onnxruntime غير مثبتة")
+
+        config = AutoConfig.from_pretrained(model_name, trust_remote_code=True)
+        layout = KVLayout.from_config(config)
+
+        path = self.model_path(model_name)
+        if os.path.exists(path):
+            logger.info(f"استخدام ملف ONNX المخزن: {path}")
+        else:
+            self._export(model_name, layout, path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+        session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+        return OnnxCausalLM(session, config, layout)
+
+    def _export(self, model_name: str, layout: KVLayout, path: str):
+        """تصدير النموذج إلى ONNX بمحاور ديناميكية للدفعة والتسلسل"""
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=torch.float32,
+            trust_remote_code=True,
+            low_cpu_mem_usage=True
+        )
+        model.eval()
+
+        # تمرير تجريبي يتحقق من أن ذاكرة KV الفعلية تطابق البنية المستنتجة من الإعدادات
+        with torch.no_grad():
+            past = model(input_ids=torch.zeros((1, 2), dtype=torch.long), use_cache=True).past_key_values
+        if hasattr(past, 'to_legacy_cache'):
+            past = past.to_legacy_cache()
+        layout.validate(past)
+
+        logger.info(f"تصدير النموذج إلى ONNX: {path}")
+        start_time = time.time()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        batch_size, past_length, seq_length = 2, 3, 2
+        past_names, present_names = layout.names("past"), layout.names("present")
+        dummy_inputs = [
+            torch.ones((batch_size, seq_length), dtype=torch.long),
+            torch.ones((batch_size, past_length + seq_length), dtype=torch.long),
+            torch.arange(past_length, past_length + seq_length, dtype=torch.long).repeat(batch_size, 1)
+        ] + [torch.zeros(layout.shape(batch_size, past_length), dtype=torch.float32) for _ in past_names]
+
+        dynamic_axes = {
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "total_sequence"},
+            "position_ids": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch", 1: "sequence"}
+        }
+        dynamic_axes.update({name: {0: "batch", layout.seq_axis: "past_sequence"} for name in past_names})
+        dynamic_axes.update({name: {0: "batch", layout.seq_axis: "total_sequence"} for name in present_names})
+
+        # المصدّر التقليدي يدعم المحاور الديناميكية في جميع الإصدارات
+        export_kwargs = {}
+        if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+            export_kwargs['dynamo'] = False
+
+        # الكتابة إلى ملف مؤقت ثم نقله حتى لا يبقى ملف ناقص عند الفشل
+        temp_path = f"{path}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                _ExportWrapper(model, layout),
+                tuple(dummy_inputs),
+                temp_path,
+                input_names=["input_ids", "attention_mask", "position_ids"] + past_names,
+                output_names=["logits"] + present_names,
+                dynamic_axes=dynamic_axes,
+                opset_version=14,
+                do_constant_folding=True,
+                **export_kwargs
+            )
+        os.replace(temp_path, path)
+        logger.info(f"تم التصدير إلى ONNX خلال {time.time() - start_time:.1f} ثانية")
+
+
+BACKENDS = {
+    TorchBackend.name: TorchBackend,
+    OnnxRuntimeBackend.name: OnnxRuntimeBackend
+}
+
+
+def create_backend(name: str) -> InferenceBackend:
+    """إنشاء واجهة خلفية بالاسم مع الرجوع إلى PyTorch عند عدم توفرها"""
+    name = (name or TorchBackend.name).lower()
+    if name not in BACKENDS:
+        logger.warning(f"واجهة خلفية غير معروفة '{name}'، استخدام torch")
+        return TorchBackend()
+    if name == OnnxRuntimeBackend.name and not ONNX_AVAILABLE:
+        logger.warning("onnxruntime غير مثبت، استخدام torch")
+        return TorchBackend()
+    return BACKENDS[name]()
+
+
+def benchmark_model(model, tokenizer, prompts: List[str], max_new_tokens: int = 32) -> Dict[str, Any]:
+    """قياس سرعة التوليد الجشع مع إعادة استخدام ذاكرة KV بين الخطوات"""
+    total_tokens = 0
+    peak_memory = get_process_memory_mb()
+    outputs = []
+    start_time = time.time()
+
+    with torch.no_grad():
+        for prompt in prompts:
+            token_ids = tokenizer.encode(prompt)
+            input_ids = torch.tensor([token_ids], dtype=torch.long)
+            attention_mask = torch.ones_like(input_ids)
+            past = None
+            generated = []
+
+            for _ in range(max_new_tokens):
+                result = model(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    position_ids=torch.arange(
+                        attention_mask.shape[1] - input_ids.shape[1], attention_mask.shape[1]
+                    ).unsqueeze(0),
+                    past_key_values=past,
+                    use_cache=True
+                )
+                past = result.past_key_values
+                next_token = int(result.logits[0, -1].argmax())
+                generated.append(next_token)
+                if next_token == tokenizer.eos_token_id:
+                    break
+                input_ids = torch.tensor([[next_token]], dtype=torch.long)
+                attention_mask = torch.ones((1, attention_mask.shape[1] + 1), dtype=torch.long)
+
+            total_tokens += len(generated)
+            outputs.append(generated)
+            peak_memory = max(peak_memory, get_process_memory_mb())
+
+    elapsed = time.time() - start_time
+    return {
+        "tokens": total_tokens,
+        "seconds": round(elapsed, 3),
+        "tokens_per_second": round(total_tokens / elapsed, 2) if elapsed else 0,
+        "peak_rss_mb": round(peak_memory, 1),
+        "outputs": outputs
+    }
@@ -0,0 +1,659 @@
+import os
+import sys
+import secrets
+import argparse
+import threading
+import logging
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.admission import AdmissionRejected
+from src.stopping import DeadlineExceeded
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# المقبس الافتراضي داخل مجلد خاص بالمستخدم (0700)
+DEFAULT_SOCKET = '/tmp/starcoder-inference/inference.sock'
+
+# العمليات المساعدة التي تُنفذ في عملية الاستدلال وتُرجع نتيجة واحدة
+SERVER_CALLS = ("status", "compare_backends")
+
+# سعة الخانة الواحدة بالرموز (سياق النموذج 1024 رمزاً)
+SLOT_TOKENS = 1024
+# عدد الخانات في الذاكرة المشتركة لكل اتصال
+ARENA_SLOTS = int(os.getenv('INFERENCE_ARENA_SLOTS', 256))
+
+# الأخطاء التي يُعاد بناؤها بنوعها في عملية الويب
+REMOTE_ERRORS = {
+    "AdmissionRejected": AdmissionRejected,
+    "DeadlineExceeded": DeadlineExceeded,
+    "MemoryError": MemoryError,
+    "ValueError": ValueError,
+}
+
+
+def socket_paths(base: str, processes: int = 1) -> List[str]:
+    """مسارات مقابس خوادم الاستدلال (مقبس لكل عملية)"""
+    if processes <= 1:
+        return [base]
+    return [f"{base}.{index}" for index in range(processes)]
+
+
+def key_path(base: str) -> str:
+    """ملف مفتاح المصادقة بجوار المقبس (يقرؤه العملاء من المستخدم نفسه)"""
+    return f"{base}.key"
+
+
+def load_authkey(base: str) -> bytes:
+    """مفتاح مصادقة الاتصال: INFERENCE_SERVER_AUTHKEY أو الملف الذي كتبه الخادم
+
+    الرسائل تُفك بـ pickle فلا يُسمح باتصال غير مصادق.
+    """
+    key = os.getenv('INFERENCE_SERVER_AUTHKEY')
+    if key:
+        return key.encode()
+    try:
+        with open(key_path(base), 'rb') as key_file:
+            key = key_file.read().strip()
+    except FileNotFoundError:
+        key = None
+    if not key:
+        raise ConnectionError(
+            f"مفتاح مصادقة خادم الاستدلال غير متاح: عيّن INFERENCE_SERVER_AUTHKEY أو شغّل الخادم أولاً ({key_path(base)})"
+        )
+    return key
+
+
+def ensure_authkey(base: str) -> bytes:
+    """مفتاح الخادم: من البيئة أو مولد عشوائياً، ويُكتب في ملف بصلاحية 0600"""
+    key = os.getenv('INFERENCE_SERVER_AUTHKEY')
+    key = key.encode() if key else secrets.token_hex(32).encode()
+    prepare_socket_dir(base)
+    path = key_path(base)
+    if os.path.exists(path):
+        os.unlink(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as key_file:
+        key_file.write(key)
+    return key
+
+
+def prepare_socket_dir(path: str):
+    """إنشاء مجلد المقبس بصلاحية 0700 إن لم يكن موجوداً"""
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+
+def encode_error(error: Exception) -> Dict[str, Any]:
+    """تحويل الخطأ إلى رسالة قابلة للإرسال"""
+    return {
+        "type": type(error).__name__,
+        "message": str(error),
+        "retry_after": getattr(error, 'retry_after', None)
+    }
+
+
+def decode_error(data: Dict[str, Any]) -> Exception:
+    """إعادة بناء خطأ عملية الاستدلال"""
+    if data["type"] == "AdmissionRejected":
+        return AdmissionRejected(data["message"], retry_after=data.get("retry_after"))
+    return REMOTE_ERRORS.get(data["type"], RuntimeError)(data["message"])
+
+
+class TokenArena:
+    """ذاكرة مشتركة مقسمة إلى خانات ثابتة لمعرفات الرموز
+
+    ينشئها العميل لكل اتصال ويربطها الخادم مرة واحدة، فتُنقل معرفات الإدخال
+    والإخراج دون تسلسل، ولا تحمل الرسائل إلا أرقام الخانات والأطوال.
+    """
+
+    def __init__(self, slots: int = ARENA_SLOTS, name: Optional[str] = None):
+        self.owner = name is None
+        if self.owner:
+            self.shm = SharedMemory(create=True, size=slots * SLOT_TOKENS * 4)
+        else:
+            self.shm = self._attach(name)
+            slots = self.shm.size // (SLOT_TOKENS * 4)
+        self.slots = slots
+        self.buffer = np.ndarray((slots, SLOT_TOKENS), dtype=np.int32, buffer=self.shm.buf)
+        self.condition = threading.Condition()
+        self.free_slots = list(range(slots))
+
+    @staticmethod
+    def _attach(name: str) -> SharedMemory:
+        """ربط ذاكرة أنشأتها عملية أخرى دون تتبعها (حتى لا تُحذف عند خروج هذه العملية)"""
+        try:
+            return SharedMemory(name=name, track=False)
+        except TypeError:
+            from multiprocessing import resource_tracker
+            shm = SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+            return shm
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def allocate(self, count: int, timeout: float = 30.0) -> List[int]:
+        """حجز عدد من الخانات (الانتظار حتى تتحرر عند امتلائها)"""
+        if count > self.slots:
+            raise ValueError(f"الطلب يحتاج {count} خانة والذاكرة المشتركة {self.slots} خانة")
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.free_slots) >= count, timeout):
+                raise RuntimeError("الذاكرة المشتركة لخادم الاستدلال ممتلئة")
+            allocated, self.free_slots = self.free_slots[:count], self.free_slots[count:]
+            return allocated
+
+    def free(self, slots: List[int]):
+        """تحرير الخانات"""
+        with self.condition:
+            self.free_slots.extend(slots)
+            self.condition.notify_all()
+
+    def write(self, slot: int, token_ids: List[int], offset: int = 0):
+        """كتابة معرفات الرموز في الخانة"""
+        self.buffer[slot, offset:offset + len(token_ids)] = token_ids
+
+    def read(self, slot: int, end: int, offset: int = 0) -> List[int]:
+        """قراءة معرفات الرموز من الخانة حتى الموضع end"""
+        return self.buffer[slot, offset:end].tolist()
+
+    def close(self):
+        """فك الربط (وحذف الذاكرة إن كانت هذه العملية منشئتها)"""
+        self.buffer = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class InferenceServer:
+    """خادم استدلال محلي عبر مقبس Unix
+
+    يستقبل طلبات التوليد من عمليات الويب ويرسلها إلى مجدولات الدفعات في
+    سجل النماذج المحلي، فلا يشارك فك الترميز قفل GIL مع Flask وautopep8.
+    لكل اتصال خيط قراءة، ولكل طلب خيط ينتظره ويرسل رموزه ونتيجته.
+    """
+
+    def __init__(self, model_registry, socket_path: str, authkey: bytes):
+        if not authkey:
+            raise ValueError("خادم الاستدلال يتطلب مفتاح مصادقة")
+        self.model_registry = model_registry
+        self.socket_path = socket_path
+        self.authkey = authkey
+        self.listener = None
+        self.running = False
+
+    def serve_forever(self):
+        """قبول الاتصالات حتى الإيقاف"""
+        prepare_socket_dir(self.socket_path)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        # المقبس يُنشأ بصلاحية 0600 لحظة ربطه فلا يتصل مستخدم آخر قبل تعديلها
+        previous_umask = os.umask(0o077)
+        try:
+            self.listener = Listener(self.socket_path, family='AF_UNIX', authkey=self.authkey)
+        finally:
+            os.umask(previous_umask)
+        self.running = True
+        logger.info(f"خادم الاستدلال يستمع على {self.socket_path}")
+
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                if self.running:
+                    logger.error(f"خطأ في قبول اتصال: {str(e)}")
+                continue
+            threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def stop(self):
+        """إيقاف الخادم"""
+        self.running = False
+        if self.listener is not None:
+            self.listener.close()
+
+    def _serve_connection(self, conn):
+        """قراءة رسائل اتصال واحد"""
+        arena = None
+        send_lock = threading.Lock()
+        # طلبات التوليد الجارية في هذا الاتصال: المعرف -> الطلب (لتنفيذ الإلغاء)
+        requests: Dict[int, Any] = {}
+        try:
+            while True:
+                message = conn.recv()
+                if message["op"] == "hello":
+                    arena = TokenArena(name=message["arena"])
+                elif message["op"] == "generate":
+                    threading.Thread(
+                        target=self._handle_generate, args=(conn, send_lock, arena, message, requests), daemon=True
+                    ).start()
+                elif message["op"] == "cancel":
+                    request = requests.get(message["id"])
+                    if request is not None:
+                        request.cancel()
+                elif message["op"] in SERVER_CALLS:
+                    threading.Thread(
+                        target=self._handle_call, args=(conn, send_lock, message), daemon=True
+                    ).start()
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            logger.error(f"خطأ في اتصال خادم الاستدلال: {str(e)}")
+        finally:
+            conn.close()
+            if arena is not None:
+                arena.close()
+
+    def _handle_generate(self, conn, send_lock, arena: TokenArena, message: Dict[str, Any],
+                         requests: Dict[int, Any]):
+        """تنفيذ طلب توليد وإرسال رموزه ونتيجته"""
+        from src.batch_scheduler import GenerationRequest
+
+        slots = message["slots"]
+        members = []
+        try:
+            manager = self.model_registry.models[message["model"]]
+            with manager.lifecycle.request():
+                request = GenerationRequest(
+                    input_ids=arena.read(slots[0], message["input_length"]),
+                    max_new_tokens=message["max_new_tokens"],
+                    temperature=message["temperature"],
+                    repetition_penalty=message["repetition_penalty"],
+                    stream=message["stream"],
+                    do_sample=message["do_sample"],
+                    endpoint=message["endpoint"],
+                    stopping=message["stopping"][0],
+                    deadline=message["deadline"]
+                )
+                request.track_logprobs = message["track_logprobs"]
+                for stopping in message["stopping"][1:]:
+                    request.fork(stopping)
+                members = request.group()
+                for member in members:
+                    if member.stopping is not None:
+                        member.stopping.bind(manager.tokenizer)
+                requests[message["id"]] = request
+
+                def forward_tokens(request):
+                    count = 0
+                    while True:
+                        token = request.token_queue.get()
+                        if token is None:
+                            break
+                        arena.write(slots[1], [token], offset=count)
+                        count += 1
+                        with send_lock:
+                            conn.send({"op": "tokens", "id": message["id"], "count": count})
+
+                manager._execute(request, consume=forward_tokens if message["stream"] else None)
+            error = next((member.error for member in members if member.error is not None), None)
+        except Exception as e:
+            error = e
+        finally:
+            requests.pop(message["id"], None)
+
+        try:
+            results = []
+            for slot, member in zip(slots[1:], members):
+                arena.write(slot, member.generated_ids)
+                stopping = member.stopping
+                results.append({
+                    "count": len(member.generated_ids),
+                    "truncated": member.truncated,
+                    "logprob_sum": member.logprob_sum,
+                    "stop": (stopping.text, stopping.stop_position, stopping.reason) if stopping is not None else None
+                })
+            with send_lock:
+                conn.send({
+                    "op": "done",
+                    "id": message["id"],
+                    "members": results,
+                    "error": encode_error(error) if error is not None else None
+                })
+        except Exception as e:
+            # انقطع الاتصال قبل اكتمال الطلب
+            logger.error(f"تعذر إرسال نتيجة الطلب {message['id']}: {str(e)}")
+
+
+    def _handle_call(self, conn, send_lock, message: Dict[str, Any]):
+        """تنفيذ عملية مساعدة (الحالة أو مقارنة الواجهات الخلفية) وإرسال نتيجتها"""
+        result = None
+        error = None
+        try:
+            manager = self.model_registry.models[message["model"]]
+            if message["op"] == "status":
+                result = {
+                    "pid": os.getpid(),
+                    "loaded": manager.model_loaded,
+                    "precision": manager.precision,
+                    "admission": manager.admission.get_stats(),
+                    "batching": manager.replica_pool.get_stats()
+                }
+            else:
+                result = manager.compare_backends(message.get("prompts"), message.get("max_new_tokens", 32))
+        except Exception as e:
+            logger.error(f"خطأ في العملية {message['op']}: {str(e)}")
+            error = e
+
+        try:
+            with send_lock:
+                conn.send({
+                    "op": "reply",
+                    "id": message["id"],
+                    "result": result,
+                    "error": encode_error(error) if error is not None else None
+                })
+        except Exception as e:
+            logger.error(f"تعذر إرسال نتيجة العملية {message['id']}: {str(e)}")
+
+
+class ServerConnection:
+    """اتصال عميل واحد بخادم استدلال مع خيط قراءة يوزع الرسائل على الطلبات"""
+
+    def __init__(self, socket_path: str, authkey: bytes):
+        self.socket_path = socket_path
+        self.conn = Client(socket_path, family='AF_UNIX', authkey=authkey)
+        self.arena = TokenArena()
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.pending: Dict[int, tuple] = {}
+        # العمليات المساعدة المنتظرة: المعرف -> [حدث الاكتمال، الرسالة]
+        self.calls: Dict[int, list] = {}
+        self.alive = True
+        self.conn.send({"op": "hello", "arena": self.arena.name})
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    @property
+    def load(self) -> int:
+        return sum(len(request.group()) for request, _ in self.pending.values())
+
+    def submit(self, request_id: int, model: str, request):
+        """كتابة الإدخال في الذاكرة المشتركة وإرسال الطلب"""
+        members = request.group()
+        if len(request.input_ids) > SLOT_TOKENS or request.max_new_tokens > SLOT_TOKENS:
+            raise ValueError(f"طول الطلب يتجاوز سعة خانة الذاكرة المشتركة ({SLOT_TOKENS} رمزاً)")
+        slots = self.arena.allocate(len(members) + 1)
+        self.arena.write(slots[0], request.input_ids)
+        with self.lock:
+            self.pending[request_id] = (request, slots)
+        try:
+            with self.send_lock:
+                self.conn.send({
+                    "op": "generate",
+                    "id": request_id,
+                    "model": model,
+                    "slots": slots,
+                    "input_length": len(request.input_ids),
+                    "max_new_tokens": request.max_new_tokens,
+                    "temperature": request.temperature,
+                    "repetition_penalty": request.repetition_penalty,
+                    "do_sample": request.do_sample,
+                    "stream": request.token_queue is not None,
+                    "endpoint": request.endpoint,
+                    # المعايير تُرسل دون المحلل اللغوي ويربطها الخادم بمحلله
+                    "stopping": [m.stopping.clone() if m.stopping is not None else None for m in members],
+                    "deadline": request.deadline,
+                    "track_logprobs": request.track_logprobs
+                })
+        except Exception:
+            with self.lock:
+                self.pending.pop(request_id, None)
+            self.arena.free(slots)
+            self.alive = False
+            raise
+
+    def call(self, request_id: int, op: str, timeout: float, **payload) -> Any:
+        """تنفيذ عملية مساعدة في الخادم وانتظار نتيجتها"""
+        waiter = [threading.Event(), None]
+        with self.lock:
+            self.calls[request_id] = waiter
+        try:
+            with self.send_lock:
+                self.conn.send(dict(payload, op=op, id=request_id))
+            if not waiter[0].wait(timeout):
+                raise TimeoutError(f"انتهت مهلة العملية {op} في خادم الاستدلال")
+        finally:
+            with self.lock:
+                self.calls.pop(request_id, None)
+        reply = waiter[1]
+        if reply is None:
+            raise ConnectionError("انقطع الاتصال بخادم الاستدلال")
+        if reply["error"] is not None:
+            raise decode_error(reply["error"])
+        return reply["result"]
+
+    def cancel(self, request) -> bool:
+        """إبلاغ الخادم بإلغاء طلب معلق في هذا الاتصال"""
+        with self.lock:
+            request_id = next((rid for rid, (pending, _) in self.pending.items() if pending is request), None)
+        if request_id is None:
+            return False
+        try:
+            with self.send_lock:
+                self.conn.send({"op": "cancel", "id": request_id})
+        except Exception as e:
+            logger.error(f"تعذر إرسال إلغاء الطلب {request_id}: {str(e)}")
+        return True
+
+    def _read_loop(self):
+        """توزيع رسائل الخادم على الطلبات المعلقة"""
+        try:
+            while True:
+                message = self.conn.recv()
+                if message["op"] == "reply":
+                    with self.lock:
+                        waiter = self.calls.get(message["id"])
+                    if waiter is not None:
+                        waiter[1] = message
+                        waiter[0].set()
+                    continue
+                with self.lock:
+                    entry = self.pending.get(message["id"])
+                if entry is None:
+                    continue
+                request, slots = entry
+                if message["op"] == "tokens":
+                    for token in self.arena.read(slots[1], message["count"], offset=len(request.generated_ids)):
+                        request.append_token(token)
+                elif message["op"] == "done":
+                    with self.lock:
+                        del self.pending[message["id"]]
+                    self._finish(request, slots, message)
+        except (EOFError, OSError) as e:
+            logger.error(f"انقطع الاتصال بخادم الاستدلال {self.socket_path}: {str(e)}")
+        finally:
+            self.alive = False
+            with self.lock:
+                pending, self.pending = list(self.pending.values()), {}
+                calls, self.calls = list(self.calls.values()), {}
+            for waiter in calls:
+                waiter[0].set()
+            for request, _ in pending:
+                for member in request.group():
+                    member.finish(ConnectionError("انقطع الاتصال بخادم الاستدلال"))
+
+    def _finish(self, request, slots: List[int], message: Dict[str, Any]):
+        """نسخ نتائج الطلب وعيناته من الذاكرة المشتركة وإنهاؤها"""
+        error = decode_error(message["error"]) if message["error"] is not None else None
+        for slot, member, result in zip(slots[1:], request.group(), message["members"]):
+            streamed = len(member.generated_ids)
+            for token in self.arena.read(slot, result["count"], offset=streamed):
+                member.append_token(token)
+            member.truncated = result["truncated"]
+            member.logprob_sum = result["logprob_sum"]
+            if member.stopping is not None and result["stop"] is not None:
+                member.stopping.text, member.stopping.stop_position, member.stopping.reason = result["stop"]
+        self.arena.free(slots)
+        for member in request.group():
+            member.finish(error)
+
+    def close(self):
+        """إغلاق الاتصال وتحرير الذاكرة المشتركة"""
+        self.alive = False
+        try:
+            self.conn.close()
+        finally:
+            self.arena.close()
+
+
+class InferenceClient:
+    """عميل خوادم الاستدلال بواجهة مجموعة النسخ نفسها (submit)
+
+    يحتفظ باتصال دائم لكل خادم ويرسل الطلب إلى الخادم الأقل حملاً، ويعيد
+    الاتصال تلقائياً عند انقطاعه.
+    """
+
+    def __init__(self, paths: List[str], base: str):
+        self.paths = paths
+        self.base = base
+        self.connections: Dict[str, ServerConnection] = {}
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.submitted = 0
+        self.reconnects = 0
+
+    def _connection(self) -> ServerConnection:
+        """الاتصال الأقل حملاً (مع إنشاء الاتصالات المفقودة)"""
+        with self.lock:
+            errors = []
+            key = None
+            for path in self.paths:
+                connection = self.connections.get(path)
+                if connection is not None and connection.alive:
+                    continue
+                if connection is not None:
+                    connection.close()
+                    self.reconnects += 1
+                try:
+                    key = key or load_authkey(self.base)
+                    self.connections[path] = ServerConnection(path, key)
+                except Exception as e:
+                    self.connections.pop(path, None)
+                    errors.append(f"{path}: {str(e)}")
+            if not self.connections:
+                raise ConnectionError(f"تعذر الاتصال بخوادم الاستدلال: {'; '.join(errors)}")
+            return min(self.connections.values(), key=lambda c: c.load)
+
+    def submit(self, model: str, request):
+        """إرسال الطلب إلى خادم الاستدلال (تكتمل النتيجة في الطلب نفسه)"""
+        connection = self._connection()
+        with self.lock:
+            request_id = self.next_id
+            self.next_id += 1
+            self.submitted += 1
+        connection.submit(request_id, model, request)
+        return request
+
+    def cancel(self, request):
+        """إلغاء طلب مرسل (يخرج من دفعة الخادم في الخطوة التالية)"""
+        with self.lock:
+            connections = list(self.connections.values())
+        for connection in connections:
+            if connection.cancel(request):
+                return
+
+    def call(self, model: str, op: str, timeout: float = 10.0, **payload) -> Any:
+        """تنفيذ عملية مساعدة في الخادم الأقل حملاً"""
+        connection = self._connection()
+        with self.lock:
+            request_id = self.next_id
+            self.next_id += 1
+        return connection.call(request_id, op, timeout, model=model, **payload)
+
+    def call_all(self, model: str, op: str, timeout: float = 5.0) -> List[Any]:
+        """تنفيذ عملية مساعدة في كل خادم متصل (الخطأ يُرجع مكان النتيجة)"""
+        self._connection()
+        with self.lock:
+            connections = list(self.connections.values())
+            first_id = self.next_id
+            self.next_id += len(connections)
+        results = []
+        for offset, connection in enumerate(connections):
+            try:
+                results.append(connection.call(first_id + offset, op, timeout, model=model))
+            except Exception as e:
+                results.append({"server": connection.socket_path, "error": str(e)})
+        return results
+
+    def close(self):
+        """إغلاق جميع الاتصالات"""
+        with self.lock:
+            connections, self.connections = list(self.connections.values()), {}
+        for connection in connections:
+            connection.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """إحصائيات العميل"""
+        with self.lock:
+            return {
+                "mode": "remote",
+                "servers": self.paths,
+                "connected": [path for path, c in self.connections.items() if c.alive],
+                "in_flight": sum(c.load for c in self.connections.values()),
+                "submitted": self.submitted,
+                "reconnects": self.reconnects
+            }
+
+
+def run_server(socket_path: str, key: bytes, cpus: Optional[List[int]] = None):
+    """تشغيل خادم استدلال واحد في هذه العملية"""
+    if cpus:
+        # كل عملية في المجموعة تأخذ شريحة منفصلة من الأنوية لنسخها
+        os.sched_setaffinity(0, cpus)
+    # عملية الخادم تحمل النماذج محلياً ولا تتصل بخادم آخر
+    os.environ.pop('INFERENCE_SERVER_SOCKET', None)
+    from src.model_manager import model_registry
+    from src.warmup import warm_up, startup_report
+
+    if not model_registry.load_model():
+        raise RuntimeError("فشل في تحميل النموذج")
+    # الإحماء يجري هنا حيث النسخ والترجمة، قبل قبول الاتصالات
+    if os.getenv('MODEL_WARMUP', 'true').lower() == 'true':
+        warm_up(model_registry, startup_report, rounds=int(os.getenv('WARMUP_ROUNDS', 2)))
+    InferenceServer(model_registry, socket_path, key).serve_forever()
+
+
+def serve(socket_path: str, processes: int = 1):
+    """تشغيل خادم أو مجموعة خوادم استدلال بأنوية مقسمة بينها
+
+    مفتاح المصادقة يُولد إن لم يُحدد ويُمرر إلى كل عمليات المجموعة.
+    """
+    key = ensure_authkey(socket_path)
+    paths = socket_paths(socket_path, processes)
+    if processes <= 1:
+        run_server(paths[0], key)
+        return
+
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = []
+    share = max(1, len(cpus) // processes)
+    context = multiprocessing.get_context('spawn')
+    workers = []
+    for index, path in enumerate(paths):
+        worker_cpus = cpus[index * share:(index + 1) * share] or None
+        worker = context.Process(target=run_server, args=(path, key, worker_cpus), daemon=False)
+        worker.start()
+        workers.append(worker)
+        logger.info(f"تم بدء خادم الاستدلال {index} على {path}")
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="خادم الاستدلال المحلي عبر مقبس Unix")
+    parser.add_argument('--socket', default=os.getenv('INFERENCE_SERVER_SOCKET', DEFAULT_SOCKET))
+    parser.add_argument('--processes', type=int, default=int(os.getenv('INFERENCE_SERVER_PROCESSES', 1)))
+    args = parser.parse_args()
+    serve(args.socket, args.processes)
@@ -11,10 +11,11 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 from flask import Flask, send_from_directory, jsonify
 from flask_cors import CORS
 from src.routes.api_routes import api_bp
-from src.model_manager import model_manager
+from src.model_manager import model_manager, model_registry
 from src.queue_manager import queue_manager
 from src.monitoring import system_monitor
 from src.auth import api_key_manager
+from src.warmup import warm_up, startup_report
 
 # إعداد نظام السجلات
 logging.basicConfig(
@@ -50,20 +51,31 @@ def initialize_services():
     
     try:
         # بدء مدير الطابور
-        queue_manager.start_worker()
+        with startup_report.phase("queue"):
+            queue_manager.start_worker()
         logger.info("تم بدء مدير الطابور")
         
-        # تحميل النموذج في خيط منفصل لتجنب حظر التطبيق
+        # تحميل النموذج وإحماؤه في خيط منفصل لتجنب حظر التطبيق،
+        # ولا تُعلن الجاهزية إلا بعد الإحماء
         def load_model():
+            error = None
             try:
                 logger.info("بدء تحميل النموذج...")
-                success = model_manager.load_model()
-                if success:
-                    logger.info("تم تحميل النموذج بنجاح")
-                else:
+                with startup_report.phase("model_load"):
+                    success = model_manager.load_model()
+                if not success:
                     logger.error("فشل في تحميل النموذج")
+                    error = "فشل في تحميل النموذج"
+                    return
+                logger.info("تم تحميل النموذج بنجاح")
+                
+                if os.getenv('MODEL_WARMUP', 'true').lower() == 'true':
+                    warm_up(model_registry, startup_report, rounds=int(os.getenv('WARMUP_ROUNDS', 2)))
             except Exception as e:
                 logger.error(f"خطأ في تحميل النموذج: {str(e)}")
+                error = str(e)
+            finally:
+                startup_report.mark_ready(error)
         
         model_thread = threading.Thread(target=load_model, daemon=True)
         model_thread.start()
@@ -82,8 +94,8 @@ def cleanup_services():
         queue_manager.stop_worker()
         logger.info("تم إيقاف مدير الطابور")
         
-        # تنظيف النموذج
-        model_manager.cleanup_model()
+        # تنظيف جميع النماذج
+        model_registry.cleanup_all()
         logger.info("تم تنظيف النموذج")
         
         # تنظيف البيانات القديمة
@@ -138,7 +150,14 @@ def documentation():
                         "code": "الكود المراد إكماله",
                         "lang": "لغة البرمجة",
                         "max_tokens": "عدد الرموز الأقصى (اختياري)",
-                        "temperature": "درجة الإبداع (اختياري)"
+                        "temperature": "درجة الإبداع (اختياري)",
+                        "stream": "بث الرموز عبر Server-Sent Events (اختياري)",
+                        "async": "معالجة غير متزامنة عبر الطابور: 202 مع task_id (اختياري، أو الرأس Prefer: respond-async)",
+                        "deterministic": "فك ترميز حتمي تُخزن نتيجته مؤقتاً (اختياري)",
+                        "cache": "تخزين النتيجة مؤقتاً (اختياري، افتراضياً يتبع deterministic)",
+                        "n": "عدد الإكمالات البديلة بترميز أولي مشترك (اختياري، حتى 8)",
+                        "dedup": "حذف الإكمالات المكررة عند n > 1 (اختياري، افتراضياً true)",
+                        "rank": "ترتيب الإكمالات حسب متوسط لوغاريتم الاحتمال (اختياري، افتراضياً true)"
                     }
                 },
                 "explanations": {
@@ -148,7 +167,11 @@ def documentation():
                     "parameters": {
                         "code": "الكود المراد شرحه",
                         "lang": "لغة البرمجة",
-                        "detail_level": "مستوى التفصيل (basic/medium/detailed)"
+                        "detail_level": "مستوى التفصيل (basic/medium/detailed)",
+                        "stream": "بث الرموز عبر Server-Sent Events (اختياري)",
+                        "async": "معالجة غير متزامنة عبر الطابور: 202 مع task_id (اختياري، أو الرأس Prefer: respond-async)",
+                        "deterministic": "فك ترميز حتمي تُخزن نتيجته مؤقتاً (اختياري)",
+                        "cache": "تخزين النتيجة مؤقتاً (اختياري، افتراضياً يتبع deterministic)"
                     }
                 },
                 "conversions": {
@@ -158,7 +181,11 @@ def documentation():
                     "parameters": {
                         "code": "الكود المراد تحويله",
                         "from": "اللغة المصدر",
-                        "to": "اللغة الهدف"
+                        "to": "اللغة الهدف",
+                        "stream": "بث الرموز عبر Server-Sent Events (اختياري)",
+                        "async": "معالجة غير متزامنة عبر الطابور: 202 مع task_id (اختياري، أو الرأس Prefer: respond-async)",
+                        "deterministic": "فك ترميز حتمي تُخزن نتيجته مؤقتاً (اختياري)",
+                        "cache": "تخزين النتيجة مؤقتاً (اختياري، افتراضياً يتبع deterministic)"
                     }
                 },
                 "refactors": {
@@ -168,7 +195,11 @@ def documentation():
                     "parameters": {
                         "code": "الكود المراد إعادة هيكلته",
                         "lang": "لغة البرمجة",
-                        "type": "نوع إعادة الهيكلة (general/performance/readability)"
+                        "type": "نوع إعادة الهيكلة (general/performance/readability)",
+                        "stream": "بث الرموز عبر Server-Sent Events (اختياري)",
+                        "async": "معالجة غير متزامنة عبر الطابور: 202 مع task_id (اختياري، أو الرأس Prefer: respond-async)",
+                        "deterministic": "فك ترميز حتمي تُخزن نتيجته مؤقتاً (اختياري)",
+                        "cache": "تخزين النتيجة مؤقتاً (اختياري، افتراضياً يتبع deterministic)"
                     }
                 }
             },
@@ -194,6 +225,23 @@ def documentation():
                     "description": "إنشاء توثيق تلقائي"
                 }
             },
+            "queue": {
+                "status": {
+                    "method": "GET",
+                    "url": "/api/v1/queue/status?task_id=...&wait=30",
+                    "description": "حالة مهمة غير متزامنة مع انتظار انتهائها حتى wait ثانية (حتى 60)"
+                },
+                "events": {
+                    "method": "GET",
+                    "url": "/api/v1/queue/events?task_id=...",
+                    "description": "بث تقدم المهمة عبر Server-Sent Events: الحالة والموقع في الطابور والرموز الجزئية ثم النتيجة"
+                },
+                "cancel": {
+                    "method": "POST",
+                    "url": "/api/v1/queue/cancel",
+                    "description": "إلغاء مهمة منتظرة"
+                }
+            },
             "system": {
                 "health": {
                     "method": "GET",
@@ -249,9 +297,10 @@ def health_check():
         health_status = {
             "status": "healthy",
             "timestamp": datetime.now().isoformat(),
+            "startup": startup_report.get_stats(),
             "components": {
                 "model": {
-                    "status": "loaded" if model_status["loaded"] else "loading",
+                    "status": ("loaded" if startup_report.ready else "warming_up") if model_status["loaded"] else "loading",
                     "memory_usage": f"{model_status['memory_usage_mb']:.1f}MB"
                 },
                 "queue": {
@@ -285,6 +334,13 @@ def health_check():
             "timestamp": datetime.now().isoformat()
         }), 503
 
+@app.route('/ready')
+def readiness_check():
+    """فحص الجاهزية: 503 حتى ينتهي تحميل النموذج وإحماؤه"""
+    startup = startup_report.get_stats()
+    startup["timestamp"] = datetime.now().isoformat()
+    return jsonify(startup), 200 if startup["ready"] else 503
+
 @app.route('/<path:path>')
 def serve_static(path):
     """خدمة الملفات الثابتة"""
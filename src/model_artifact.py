@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple
+
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WEIGHTS_FILE = "model.safetensors"
+TOKENIZER_FILE = "tokenizer.json"
+
+# أنواع البيانات في ترويسة safetensors
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool
+}
+
+# الدقة التي تُبقي أوزان الملف المحلي دون تحويل (فتبقى صفحاتها مشتركة)
+ARTIFACT_PRECISIONS = {"F32": "fp32", "BF16": "bf16"}
+
+
+def get_artifact_dir() -> str:
+    """مجلد النموذج المحلي (على القرص الدائم افتراضياً)"""
+    return os.getenv('MODEL_ARTIFACT_DIR', '/app/data/model')
+
+
+def is_artifact(path: str) -> bool:
+    """التحقق من وجود نموذج محلي كامل في المسار"""
+    return all(
+        os.path.isfile(os.path.join(path, name))
+        for name in (WEIGHTS_FILE, TOKENIZER_FILE, "config.json")
+    )
+
+
+def read_header(path: str) -> Tuple[Dict[str, Any], int]:
+    """قراءة ترويسة ملف safetensors وحجمها بالبايت"""
+    with open(path, 'rb') as f:
+        header_size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    return header, header_size
+
+
+def artifact_precision(path: str) -> Optional[str]:
+    """دقة الأوزان المحفوظة في النموذج المحلي (None لنوع لا يطابق دقة مدعومة)"""
+    header, _ = read_header(os.path.join(path, WEIGHTS_FILE))
+    dtypes = {info["dtype"] for info in header.values()}
+    if len(dtypes) != 1:
+        return None
+    return ARTIFACT_PRECISIONS.get(dtypes.pop())
+
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """ربط ملف safetensors بالذاكرة دون نسخ الأوزان
+
+    الصفحات تُقرأ من ذاكرة نظام التشغيل المؤقتة فتتشاركها جميع العمليات التي
+    تربط الملف نفسه، ولا تُنسخ إلا عند الكتابة (وهذا لا يحدث أثناء الاستدلال).
+    """
+    header, header_size = read_header(path)
+
+    file_size = os.path.getsize(path)
+    storage = torch.UntypedStorage.from_file(path, False, file_size)
+    data = torch.empty(0, dtype=torch.uint8).set_(storage)
+    data_start = 8 + header_size
+
+    tensors = {}
+    for name, info in header.items():
+        start, end = info["data_offsets"]
+        raw = data[data_start + start:data_start + end]
+        tensors[name] = raw.view(SAFETENSORS_DTYPES[info["dtype"]]).reshape(info["shape"])
+    return tensors
+
+
+@contextmanager
+def empty_parameters():
+    """إنشاء معاملات النموذج على جهاز meta دون حجز ذاكرة
+
+    المخازن غير المحفوظة في الملف (مثل أقنعة الانتباه) تبقى حقيقية.
+    """
+    original_register = torch.nn.Module.register_parameter
+
+    def register_parameter(module, name, param):
+        original_register(module, name, param)
+        if param is not None:
+            param_class = type(module._parameters[name])
+            module._parameters[name] = param_class(
+                module._parameters[name].to('meta'), requires_grad=param.requires_grad
+            )
+
+    torch.nn.Module.register_parameter = register_parameter
+    try:
+        yield
+    finally:
+        torch.nn.Module.register_parameter = original_register
+
+
+def load_mmap_model(path: str):
+    """تحميل النموذج من الملف المحلي بأوزان مربوطة بالذاكرة"""
+    state_dict = mmap_safetensors(os.path.join(path, WEIGHTS_FILE))
+    dtype = next(iter(state_dict.values())).dtype
+    config = AutoConfig.from_pretrained(path)
+
+    with empty_parameters():
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype)
+
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    # الأوزان المربوطة (مثل lm_head) لا تُحفظ مرتين في الملف
+    model.tie_weights()
+
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise ValueError(f"أوزان مفقودة في الملف المحلي: {', '.join(missing[:5])}")
+
+    model.eval()
+    return model
+
+
+def export_artifact(model_name: str, path: str, dtype: torch.dtype = torch.float32) -> Dict[str, Any]:
+    """تنزيل النموذج وحفظه كملف safetensors مع tokenizer.json"""
+    start_time = time.time()
+    os.makedirs(path, exist_ok=True)
+
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=dtype, low_cpu_mem_usage=True)
+    model.save_pretrained(path, safe_serialization=True, max_shard_size="100GB")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if not tokenizer.is_fast:
+        raise ValueError("المحلل اللغوي لا يدعم صيغة tokenizer.json")
+    tokenizer.save_pretrained(path)
+
+    return {
+        "path": path,
+        "weights_mb": round(os.path.getsize(os.path.join(path, WEIGHTS_FILE)) / 1024 / 1024, 1),
+        "seconds": round(time.time() - start_time, 1)
+    }
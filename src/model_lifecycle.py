@@ -0,0 +1,206 @@
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Callable
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ModelLifecycle:
+    """سياسة تفريغ النموذج عند الخمول وإعادة تحميله عند الطلب
+
+    يُفرَّغ النموذج بعد مدة خمول قابلة للتهيئة ويُعاد تحميله مع أول طلب.
+    الطلبات التي تصل أثناء التحميل أو التفريغ تنتظر حدث الانتقال نفسه بدلاً
+    من بدء تحميل آخر. لمنع التذبذب يبقى النموذج محملاً مدة دنيا، وتتضاعف مدة
+    الخمول عندما يُطلب النموذج بعد تفريغه بوقت قصير.
+    """
+
+    def __init__(self, model_manager, idle_unload_seconds=0, min_residency_seconds=300,
+                 max_idle_multiplier=8):
+        self.model_manager = model_manager
+        self.idle_unload_seconds = idle_unload_seconds
+        self.min_residency_seconds = min_residency_seconds
+        self.max_idle_timeout = idle_unload_seconds * max_idle_multiplier
+        self.idle_timeout = idle_unload_seconds
+
+        self.condition = threading.Condition()
+        self.transitioning = False
+        self.active_requests = 0
+        self.last_used = time.time()
+        self.loaded_at = None
+        self.unloaded_at = None
+        self.monitor_thread = None
+
+        # إحصائيات
+        self.load_count = 0
+        self.unload_count = 0
+        self.idle_unloads = 0
+        self.parked_waiters = 0
+        self.cold_starts = 0
+        self.cold_start_total = 0.0
+        self.cold_start_max = 0.0
+        self.last_cold_start = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.idle_unload_seconds > 0
+
+    def _wait_transition(self):
+        """انتظار انتهاء أي تحميل أو تفريغ جارٍ (يُستدعى مع حجز القفل)"""
+        if self.transitioning:
+            self.parked_waiters += 1
+            while self.transitioning:
+                self.condition.wait()
+
+    def run_load(self, load_fn: Callable[[], bool]) -> bool:
+        """تنفيذ التحميل مرة واحدة وإيقاف بقية المستدعين على حدث التحميل"""
+        with self.condition:
+            self._wait_transition()
+            if self.model_manager.model_loaded:
+                return True
+            self.transitioning = True
+
+        success = False
+        try:
+            success = load_fn()
+        finally:
+            with self.condition:
+                self.transitioning = False
+                if success:
+                    self._on_loaded()
+                self.condition.notify_all()
+        return success
+
+    def _on_loaded(self):
+        """تحديث الحالة بعد تحميل ناجح وتطبيق التخلف (hysteresis)"""
+        now = time.time()
+        self.load_count += 1
+        self.loaded_at = now
+        self.last_used = now
+
+        if self.enabled and self.unloaded_at is not None:
+            gap = now - self.unloaded_at
+            if gap < self.idle_timeout:
+                # إعادة طلب سريعة بعد التفريغ: إطالة مدة الخمول لتجنب التذبذب
+                self.idle_timeout = min(self.idle_timeout * 2, self.max_idle_timeout)
+            elif gap > self.idle_timeout * 2:
+                self.idle_timeout = self.idle_unload_seconds
+
+        self._start_monitor()
+
+    def on_unloaded(self):
+        """تسجيل تفريغ النموذج"""
+        with self.condition:
+            self.unload_count += 1
+            self.unloaded_at = time.time()
+            self.loaded_at = None
+
+    @contextmanager
+    def request(self):
+        """تسجيل طلب نشط وتحميل النموذج عند الحاجة"""
+        arrival = time.time()
+        with self.condition:
+            self._wait_transition()
+            self.active_requests += 1
+            cold = not self.model_manager.model_loaded
+
+        try:
+            if cold:
+                if not self.model_manager.load_model():
+                    raise RuntimeError("فشل في تحميل النموذج")
+                self._record_cold_start(time.time() - arrival)
+            yield
+        finally:
+            with self.condition:
+                self.active_requests -= 1
+                self.last_used = time.time()
+
+    def _record_cold_start(self, latency: float):
+        """تسجيل زمن انتظار طلب وصل والنموذج غير محمل"""
+        with self.condition:
+            self.cold_starts += 1
+            self.cold_start_total += latency
+            self.cold_start_max = max(self.cold_start_max, latency)
+            self.last_cold_start = latency
+
+    def _start_monitor(self):
+        """بدء خيط مراقبة الخمول مرة واحدة"""
+        if not self.enabled or (self.monitor_thread and self.monitor_thread.is_alive()):
+            return
+        self.monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
+        self.monitor_thread.start()
+
+    def _monitor_loop(self):
+        """فحص الخمول دورياً وتفريغ النموذج عند تجاوز المهلة"""
+        interval = max(1.0, min(30.0, self.idle_unload_seconds / 4))
+        while True:
+            time.sleep(interval)
+            try:
+                if self._should_unload():
+                    self._unload()
+            except Exception as e:
+                logger.error(f"خطأ في مراقبة خمول النموذج: {str(e)}")
+
+    def _should_unload(self) -> bool:
+        """التحقق من شروط التفريغ وبدء الانتقال إن تحققت"""
+        now = time.time()
+        with self.condition:
+            if (self.transitioning or not self.model_manager.model_loaded or self.active_requests
+                    or now - self.last_used < self.idle_timeout
+                    or (self.loaded_at and now - self.loaded_at < self.min_residency_seconds)):
+                return False
+            self.transitioning = True
+            return True
+
+    def _unload(self):
+        """تفريغ النموذج مع إيقاف الطلبات الجديدة حتى انتهاء التفريغ"""
+        try:
+            idle = time.time() - self.last_used
+            logger.info(f"تفريغ النموذج بعد خمول {idle:.0f} ثانية")
+            self.model_manager.cleanup_model()
+            self.idle_unloads += 1
+        finally:
+            with self.condition:
+                self.transitioning = False
+                self.condition.notify_all()
+
+    def evict(self) -> bool:
+        """تفريغ النموذج لإفساح الذاكرة لنموذج آخر إن كان خاملاً
+
+        يتبع بروتوكول الانتقال نفسه: الفحص وبدء الانتقال تحت القفل، فالطلب الذي
+        يصل أثناء التفريغ ينتظره ثم يعيد تحميل النموذج بدلاً من العمل عليه.
+        """
+        with self.condition:
+            if self.transitioning or not self.model_manager.model_loaded or self.active_requests:
+                return False
+            self.transitioning = True
+        try:
+            self.model_manager.cleanup_model()
+        finally:
+            with self.condition:
+                self.transitioning = False
+                self.condition.notify_all()
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """إحصائيات التحميل والتفريغ والبدء البارد"""
+        with self.condition:
+            return {
+                "idle_unload_enabled": self.enabled,
+                "idle_unload_seconds": self.idle_unload_seconds,
+                "effective_idle_timeout_seconds": self.idle_timeout,
+                "min_residency_seconds": self.min_residency_seconds,
+                "idle_seconds": round(time.time() - self.last_used, 1),
+                "active_requests": self.active_requests,
+                "load_count": self.load_count,
+                "unload_count": self.unload_count,
+                "idle_unloads": self.idle_unloads,
+                "parked_waiters": self.parked_waiters,
+                "cold_starts": self.cold_starts,
+                "last_cold_start_ms": round(self.last_cold_start * 1000, 1) if self.last_cold_start is not None else None,
+                "avg_cold_start_ms": round(self.cold_start_total / self.cold_starts * 1000, 1) if self.cold_starts else 0,
+                "max_cold_start_ms": round(self.cold_start_max * 1000, 1)
+            }
@@ -1,30 +1,141 @@
 import os
+import time
 import torch
 import psutil
 import logging
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from threading import Lock
 import gc
+from collections import OrderedDict
+from src.batch_scheduler import GenerationRequest
+from src.prefix_cache import PrefixCache
+from src.generation_cache import GenerationCache, response_cache_budget_mb
+from src.single_flight import SingleFlight
+from src.inference_backends import (
+    BACKENDS, BENCHMARK_PROMPTS, PRECISIONS, TorchBackend, create_backend, benchmark_model, get_process_memory_mb
+)
+from src.precision import PrecisionCalibrator
+from src.model_artifact import get_artifact_dir, is_artifact, artifact_precision
+from src.model_lifecycle import ModelLifecycle
+from src.replica_pool import ReplicaPool
+from src.stopping import DeadlineExceeded, stopping_stats
+from src.context_packer import ContextPacker, PromptContext
+from src.token_cache import TokenCache
+from src.warmup import OPTIMIZATION_MODES, compile_model, uncompiled
+from src.admission import AdmissionController
+from src.inference_server import InferenceClient, socket_paths
 
 # إعداد نظام السجلات
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_MODEL_NAME = "sshleifer/tiny-gpt2"
+
 class ModelManager:
     """مدير النموذج المكمم مع إدارة ذكية للذاكرة"""
     
-    def __init__(self):
+    def __init__(self, model_name=None, name="default", response_cache_mb=None):
+        self.name = name
         self.model = None
         self.tokenizer = None
         self.model_lock = Lock()
         self.max_memory_mb = 450  # حد أقصى 450MB للنموذج
+        self.max_input_tokens = int(os.getenv('MAX_INPUT_TOKENS', 512))
         self.model_loaded = False
+        self.load_time = None
+        self.footprint_mb = None
+        self.load_phases = {}
+        
+        # النموذج المحلي (safetensors مربوط بالذاكرة) له الأولوية على التنزيل
+        if model_name is None:
+            artifact_dir = get_artifact_dir()
+            model_name = artifact_dir if is_artifact(artifact_dir) else DEFAULT_MODEL_NAME
+        self.model_name = model_name
+        
+        # الواجهة الخلفية للاستدلال (torch أو onnx)
+        self.backend = create_backend(os.getenv('INFERENCE_BACKEND', 'torch'))
+        
+        # دقة النموذج: auto للمعايرة عند الإقلاع أو fp32/bf16/int8 مباشرة
+        self.precision_setting = os.getenv('MODEL_PRECISION', 'auto').lower()
+        self.precision_calibrator = PrecisionCalibrator()
+        self.precision = None
+        
+        # وضع تحسين الاستدلال: none أو inference_mode أو compile
+        optimization = os.getenv('MODEL_OPTIMIZATION', 'none').lower()
+        self.optimization = optimization if optimization in OPTIMIZATION_MODES else 'none'
+        
+        # تفريغ النموذج عند الخمول وإعادة تحميله عند الطلب (0 يعطل التفريغ)
+        self.lifecycle = ModelLifecycle(
+            self,
+            idle_unload_seconds=int(os.getenv('MODEL_IDLE_UNLOAD_SECONDS', 0)),
+            min_residency_seconds=int(os.getenv('MODEL_MIN_RESIDENCY_SECONDS', 300))
+        )
+        
+        # نموذج مسودة اختياري لفك الترميز التخميني
+        self.draft_model = None
+        self.draft_model_name = os.getenv('DRAFT_MODEL_NAME')
+        self.speculative_tokens = int(os.getenv('SPECULATIVE_TOKENS', 4))
+        
+        # ذاكرة KV مؤقتة لبادئات الـ prompts المشتركة
+        self.prefix_cache = PrefixCache(max_memory_mb=32)
+        
+        # ذاكرة LRU لترميز القوالب وكتل الكود المتكررة
+        self.token_cache = TokenCache(max_entries=int(os.getenv('TOKEN_CACHE_ENTRIES', 4096)))
+        
+        # ذاكرة مؤقتة للنتائج المطابقة تماماً، ميزانيتها مقتطعة من حد ذاكرة النموذج
+        # (السجل يقسم ميزانية واحدة على نماذجه)
+        if response_cache_mb is None:
+            response_cache_mb = response_cache_budget_mb(self.max_memory_mb)
+        self.response_cache = GenerationCache(max_memory_mb=response_cache_mb, ttl_seconds=600)
+        
+        # دمج طلبات التوليد المتطابقة المتزامنة في عملية واحدة
+        self.single_flight = SingleFlight()
+        
+        # الاستدلال في عملية منفصلة عبر مقبس Unix (هذه العملية تحمل المحلل اللغوي فقط)
+        inference_socket = os.getenv('INFERENCE_SERVER_SOCKET')
+        self.inference_client = InferenceClient(
+            socket_paths(inference_socket, int(os.getenv('INFERENCE_SERVER_PROCESSES', 1))), inference_socket
+        ) if inference_socket else None
+        
+        # قبول الطلبات حسب ذاكرة KV التقديرية بدلاً من قياس RSS لكل طلب
+        # (الميزانية الافتراضية هي المتبقي من حد الذاكرة بعد التحميل)
+        kv_budget = os.getenv('KV_MEMORY_BUDGET_MB')
+        self.admission = AdmissionController(
+            budget_mb=float(kv_budget) if kv_budget else None,
+            wait_ms=int(os.getenv('ADMISSION_WAIT_MS', 2000))
+        )
+        
+        # نسخ استدلال مثبتة على الأنوية، لكل منها مجدول دفعات مستمرة خاص بها
+        # (auto يستنتج العدد من الأنوية وميزانية الذاكرة)
+        replicas = os.getenv('MODEL_REPLICAS', 'auto')
+        threads = os.getenv('MODEL_THREADS_PER_REPLICA')
+        self.replica_pool = ReplicaPool(
+            self,
+            replicas=int(replicas) if replicas.isdigit() else None,
+            threads=int(threads) if threads else None
+        )
         
     def get_memory_usage(self):
         """الحصول على استخدام الذاكرة الحالي بالميجابايت"""
         process = psutil.Process(os.getpid())
         return process.memory_info().rss / 1024 / 1024
     
+    def get_unique_memory_usage(self):
+        """الذاكرة الخاصة بهذه العملية فقط (USS) دون الصفحات المشتركة"""
+        try:
+            process = psutil.Process(os.getpid())
+            return process.memory_full_info().uss / 1024 / 1024
+        except Exception:
+            return None
+    
+    def cache_budget_mb(self):
+        """ميزانية الذاكرات المؤقتة المحدودة (مقتطعة من حد ذاكرة النموذج)"""
+        return (self.prefix_cache.max_bytes + self.response_cache.max_bytes) / 1024 / 1024
+    
+    def model_budget_mb(self):
+        """ما يبقى للأوزان وذاكرة KV من حد الذاكرة بعد الذاكرات المؤقتة"""
+        return self.max_memory_mb - self.cache_budget_mb()
+    
     def check_memory_limit(self):
         """التحقق من حد الذاكرة"""
         current_memory = self.get_memory_usage()
@@ -34,41 +145,47 @@ class ModelManager:
         return True
     
     def load_model(self):
-        """تحميل النموذج المكمم"""
+        """تحميل النموذج المكمم (المستدعون المتزامنون ينتظرون التحميل الجاري)"""
         if self.model_loaded:
             return True
-            
+        return self.lifecycle.run_load(self._load_model)
+    
+    def _load_model(self):
+        """تنفيذ تحميل النموذج"""
         try:
             with self.model_lock:
-                logger.info("بدء تحميل نموذج StarCoderBase-350M...")
+                logger.info(f"بدء تحميل النموذج {self.name} ({self.model_name})...")
+                load_start = time.time()
+                phase_start = load_start
+                self.load_phases = {}
+                memory_before = self.get_memory_usage()
                 
                 # التحقق من الذاكرة قبل التحميل
                 if not self.check_memory_limit():
                     raise MemoryError("ذاكرة غير كافية لتحميل النموذج")
                 
-                # تحميل النموذج مع التكميم 4-bit
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    "sshleifer/tiny-gpt2",
-                    
-                    device_map="auto",
-                    torch_dtype=torch.float16,
-                    trust_remote_code=True,
-                    low_cpu_mem_usage=True
-                )
-                
                 # تحميل المحلل اللغوي
                 self.tokenizer = AutoTokenizer.from_pretrained(
-                    "sshleifer/tiny-gpt2",
+                    self.model_name,
                     trust_remote_code=True
                 )
+                phase_start = self._record_phase('tokenizer', phase_start)
                 
                 # إضافة رمز الإنهاء إذا لم يكن موجوداً
                 if self.tokenizer.pad_token is None:
                     self.tokenizer.pad_token = self.tokenizer.eos_token
                 
+                # في وضع الخادم المنفصل تُحمّل الأوزان في عملية الاستدلال
+                if self.inference_client is None:
+                    self._load_weights(phase_start)
+                
                 self.model_loaded = True
+                self.load_time = time.time() - load_start
                 memory_after = self.get_memory_usage()
-                logger.info(f"تم تحميل النموذج بنجاح. استخدام الذاكرة: {memory_after:.1f}MB")
+                self.footprint_mb = max(0.0, memory_after - memory_before)
+                logger.info(
+                    f"تم تحميل النموذج بنجاح خلال {self.load_time:.2f} ثانية. استخدام الذاكرة: {memory_after:.1f}MB"
+                )
                 
                 return True
                 
@@ -77,9 +194,109 @@ class ModelManager:
             self.cleanup_model()
             return False
     
+    def _load_weights(self, phase_start):
+        """تحميل الأوزان ونموذج المسودة وإعداد النسخ وميزانية ذاكرة KV"""
+        # اختيار الدقة (المعايرة تحتاج المحلل اللغوي)
+        if isinstance(self.backend, TorchBackend):
+            self.backend.precision = self._select_precision()
+        phase_start = self._record_phase('precision', phase_start)
+        
+        # تحميل النموذج عبر الواجهة الخلفية المحددة
+        try:
+            self.model = self.backend.load_model(self.model_name)
+        except Exception as e:
+            if isinstance(self.backend, TorchBackend):
+                raise
+            logger.error(f"خطأ في تحميل الواجهة الخلفية {self.backend.name}، استخدام torch: {str(e)}")
+            self.backend = TorchBackend(self._select_precision())
+            self.model = self.backend.load_model(self.model_name)
+        self.precision = getattr(self.backend, 'precision', 'fp32')
+        phase_start = self._record_phase('weights', phase_start)
+        
+        # الترجمة نفسها تحدث مع أول استدعاء أثناء الإحماء
+        if self.optimization == 'compile':
+            self.model = compile_model(self.model)
+            phase_start = self._record_phase('compile', phase_start)
+        
+        # تحميل نموذج المسودة (فشل تحميله لا يمنع عمل النموذج الرئيسي)
+        if self.draft_model_name:
+            self._load_draft_model()
+            phase_start = self._record_phase('draft_model', phase_start)
+        
+        # توزيع الأنوية على النسخ بعد معرفة حجم النموذج
+        self.replica_pool.configure()
+        self._record_phase('replicas', phase_start)
+        
+        # ميزانية ذاكرة KV: المتبقي بعد الأوزان والذاكرات المؤقتة المحدودة
+        self.admission.configure(
+            self.model.config,
+            getattr(self.model, 'dtype', torch.float32),
+            self.model_budget_mb() - self.get_memory_usage()
+        )
+    
+    def _record_phase(self, name, phase_start):
+        """تسجيل مدة مرحلة من مراحل التحميل وإرجاع بداية المرحلة التالية"""
+        now = time.time()
+        self.load_phases[name] = round((now - phase_start) * 1000, 1)
+        return now
+    
+    def disable_compile(self):
+        """الرجوع إلى النموذج غير المترجم عند فشل الترجمة أثناء الإحماء"""
+        with self.model_lock:
+            if self.model is not None:
+                self.model = uncompiled(self.model)
+            self.optimization = 'inference_mode'
+        logger.warning("تم تعطيل torch.compile والرجوع إلى inference_mode")
+    
+    def _select_precision(self):
+        """الدقة المحددة في الإعدادات أو نتيجة المعايرة المخزنة/الجديدة
+        
+        أوزان النموذج المحلي مربوطة بالذاكرة ومشتركة بين العمليات، وتحويلها إلى
+        دقة أخرى ينسخها في كل عملية؛ لذا يستخدم auto دقة الملف دون معايرة.
+        """
+        stored = artifact_precision(self.model_name) if is_artifact(self.model_name) else None
+        if self.precision_setting in PRECISIONS:
+            if is_artifact(self.model_name) and self.precision_setting != stored:
+                logger.warning(
+                    f"الدقة {self.precision_setting} تختلف عن أوزان النموذج المحلي ({stored})، "
+                    f"ستُنسخ الأوزان في كل عملية بدلاً من مشاركتها"
+                )
+            return self.precision_setting
+        if is_artifact(self.model_name):
+            logger.info(f"تخطي معايرة الدقة للنموذج المحلي المربوط بالذاكرة، استخدام {stored or 'fp32'}")
+            return stored or "fp32"
+        try:
+            return self.precision_calibrator.select(self.model_name, self.tokenizer, int(self.model_budget_mb()))
+        except Exception as e:
+            logger.error(f"خطأ في معايرة الدقة، استخدام fp32: {str(e)}")
+            return "fp32"
+    
+    def _load_draft_model(self):
+        """تحميل نموذج المسودة لفك الترميز التخميني"""
+        try:
+            logger.info(f"بدء تحميل نموذج المسودة {self.draft_model_name}...")
+            self.draft_model = AutoModelForCausalLM.from_pretrained(
+                self.draft_model_name,
+                torch_dtype=getattr(self.model, 'dtype', torch.float32),
+                trust_remote_code=True,
+                low_cpu_mem_usage=True
+            )
+            self.draft_model.eval()
+            logger.info("تم تحميل نموذج المسودة، تفعيل فك الترميز التخميني")
+        except Exception as e:
+            logger.error(f"خطأ في تحميل نموذج المسودة: {str(e)}")
+            self.draft_model = None
+    
     def cleanup_model(self):
         """تنظيف النموذج من الذاكرة"""
         try:
+            # إيقاف نسخ الاستدلال وتحرير ذاكرة KV الخاصة بها
+            self.replica_pool.stop()
+            if self.inference_client is not None:
+                self.inference_client.close()
+            self.prefix_cache.clear()
+            self.token_cache.clear()
+            
             with self.model_lock:
                 if self.model is not None:
                     del self.model
@@ -87,6 +304,9 @@ class ModelManager:
                 if self.tokenizer is not None:
                     del self.tokenizer
                     self.tokenizer = None
+                if self.draft_model is not None:
+                    del self.draft_model
+                    self.draft_model = None
                 
                 # تنظيف ذاكرة GPU إذا كانت متاحة
                 if torch.cuda.is_available():
@@ -95,66 +315,536 @@ class ModelManager:
                 # تنظيف ذاكرة Python
                 gc.collect()
                 
+                was_loaded = self.model_loaded
                 self.model_loaded = False
                 logger.info("تم تنظيف النموذج من الذاكرة")
+            
+            if was_loaded:
+                self.lifecycle.on_unloaded()
                 
         except Exception as e:
             logger.error(f"خطأ في تنظيف النموذج: {str(e)}")
     
-    def generate_text(self, prompt, max_length=100, temperature=0.7, repetition_penalty=1.2):
-        """توليد النص باستخدام النموذج"""
-        if not self.model_loaded:
-            if not self.load_model():
-                raise RuntimeError("فشل في تحميل النموذج")
+    def generate_text(self, prompt, max_length=100, temperature=0.7, repetition_penalty=1.2,
+                      on_token=None, cache_result=False, deterministic=False, endpoint=None, stopping=None,
+                      usage=None, deadline=None):
+        """توليد النص باستخدام النموذج
         
-        try:
-            with self.model_lock:
-                # التحقق من الذاكرة قبل التوليد
-                if not self.check_memory_limit():
-                    raise MemoryError("ذاكرة غير كافية للتوليد")
-                
-                # ترميز النص
-                inputs = self.tokenizer.encode(prompt, return_tensors="pt", max_length=512, truncation=True)
-                
-                # التحقق من طول الإدخال
-                if inputs.shape[1] > 512:
-                    logger.warning("تم اقتصاص الإدخال إلى 512 رمز")
-                
-                # توليد النص
-                with torch.no_grad():
-                    outputs = self.model.generate(
-                        inputs,
-                        max_length=min(inputs.shape[1] + max_length, 1024),
-                        temperature=temperature,
-                        repetition_penalty=repetition_penalty,
-                        do_sample=True,
-                        pad_token_id=self.tokenizer.eos_token_id,
-                        eos_token_id=self.tokenizer.eos_token_id,
-                        num_return_sequences=1
+        عند تمرير on_token يتم استدعاؤها بكل جزء نصي جديد فور فك ترميزه.
+        cache_result يفعّل الذاكرة المؤقتة للنتائج، و deterministic يستخدم
+        فك الترميز الجشع حتى تكون النتيجة قابلة للتخزين وإعادة الاستخدام.
+        endpoint اسم الخدمة المستدعية ويُستخدم في الإحصائيات، و stopping
+        معايير إيقاف مبكر (StoppingCriteria) جديدة لكل طلب. يمكن تمرير
+        prompt كنص أو PromptContext ليُعبأ ضمن ميزانية الإدخال حول المؤشر.
+        usage قاموس اختياري يُملأ بعدد رموز الإدخال والإخراج الفعلي، و deadline
+        موعد نهائي (Deadline) يُرجع عنده ما تولد حتى الآن مع truncated في usage.
+        """
+        prompt_text = prompt.text if isinstance(prompt, PromptContext) else prompt
+        request_key = GenerationCache.make_key(
+            prompt_text, max_length, temperature, repetition_penalty, deterministic,
+            stop=stopping.signature() if stopping is not None else None
+        )
+        
+        if cache_result:
+            cached_usage = {}
+            cached_text = self.response_cache.get(request_key, usage=cached_usage)
+            if cached_text is not None:
+                if usage is not None:
+                    usage.update(cached_usage, cached=True, truncated=False)
+                if on_token is not None:
+                    on_token(cached_text)
+                return cached_text
+        
+        def generate():
+            generated_text, request_usage = self._generate(
+                prompt, max_length, temperature, repetition_penalty, on_token, deterministic, endpoint, stopping,
+                deadline
+            )
+            # النتيجة المقتطعة بسبب المهلة ليست النتيجة الكاملة للطلب فلا تُخزن
+            if cache_result and not request_usage["truncated"]:
+                self.response_cache.put(request_key, generated_text, usage=request_usage)
+            return generated_text, request_usage
+        
+        # المشاركة للتوليد الحتمي فقط (العينات العشوائية لكل مستدعٍ عينته الخاصة)،
+        # وطلبات البث تحتاج رموزها الخاصة وطلبات المهلة قد تقتطع النتيجة المشتركة
+        shareable = (deterministic or temperature == 0) and on_token is None and deadline is None
+        if shareable:
+            generated_text, request_usage = self.single_flight.do(request_key, generate)
+        else:
+            generated_text, request_usage = generate()
+        if usage is not None:
+            usage.update(request_usage, cached=False)
+        return generated_text
+    
+    def _generate(self, prompt, max_length, temperature, repetition_penalty, on_token, deterministic, endpoint,
+                  stopping=None, deadline=None):
+        """تنفيذ التوليد الفعلي عبر مجدول الدفعات
+        
+        الترميز وفك الترميز مرحلتان مستقلتان خارج أي قفل، فلا يبقى النموذج
+        خاملاً أثناءهما. يُرجع النص المولد وعدد رموز الإدخال والإخراج.
+        """
+        # تسجيل الطلب النشط يمنع تفريغ النموذج ويحمله عند الحاجة
+        with self.lifecycle.request():
+            try:
+                inputs = self._preprocess(prompt)
+                if deadline is not None and deadline.expired():
+                    raise DeadlineExceeded("انقضت مهلة الطلب قبل بدء التوليد")
+                
+                if stopping is not None:
+                    stopping.bind(self.tokenizer)
+                
+                request = GenerationRequest(
+                    input_ids=inputs,
+                    max_new_tokens=max(1, min(max_length, 1024 - len(inputs))),
+                    temperature=temperature,
+                    repetition_penalty=repetition_penalty,
+                    stream=on_token is not None,
+                    do_sample=not deterministic,
+                    endpoint=endpoint,
+                    stopping=stopping,
+                    deadline=deadline
+                )
+                self._execute(
+                    request, consume=(lambda r: self._stream_tokens(r, on_token)) if on_token is not None else None
+                )
+                if request.error is not None:
+                    raise request.error
+                stopping_stats.record(
+                    endpoint, stopping, len(request.generated_ids), request.max_new_tokens,
+                    deadline_hit=request.truncated
+                )
+                
+                generated_text = self._postprocess(request.generated_ids, stopping)
+                return generated_text, {
+                    "input_tokens": len(inputs),
+                    "output_tokens": len(request.generated_ids),
+                    "truncated": request.truncated
+                }
+                
+            except Exception as e:
+                logger.error(f"خطأ في توليد النص: {str(e)}")
+                raise
+    
+    def generate_samples(self, prompt, n=2, max_length=100, temperature=0.7, repetition_penalty=1.2,
+                         endpoint=None, stopping=None, deadline=None, usage=None, dedup=True, rank=True):
+        """توليد عدة عينات للـ prompt نفسه في مرور واحد
+        
+        يُرمز الـ prompt مرة واحدة ثم تُنسخ ذاكرة KV لكل عينة وتُفك رموز العينات
+        معاً في الدفعة. dedup يحذف العينات المكررة و rank يرتبها حسب متوسط
+        لوغاريتم احتمال رموزها. يُرجع قائمة من {text, mean_logprob, tokens}.
+        """
+        with self.lifecycle.request():
+            try:
+                inputs = self._preprocess(prompt)
+                if deadline is not None and deadline.expired():
+                    raise DeadlineExceeded("انقضت مهلة الطلب قبل بدء التوليد")
+                
+                if stopping is not None:
+                    stopping.bind(self.tokenizer)
+                request = GenerationRequest(
+                    input_ids=inputs,
+                    max_new_tokens=max(1, min(max_length, 1024 - len(inputs))),
+                    temperature=temperature,
+                    repetition_penalty=repetition_penalty,
+                    do_sample=True,
+                    endpoint=endpoint,
+                    stopping=stopping,
+                    deadline=deadline
+                )
+                request.track_logprobs = True
+                for _ in range(n - 1):
+                    fork_stopping = stopping.clone() if stopping is not None else None
+                    if fork_stopping is not None:
+                        fork_stopping.bind(self.tokenizer)
+                    request.fork(fork_stopping)
+                
+                self._execute(request)
+                for member in request.group():
+                    if member.error is not None:
+                        raise member.error
+                
+                samples = []
+                for member in request.group():
+                    stopping_stats.record(
+                        endpoint, member.stopping, len(member.generated_ids), member.max_new_tokens,
+                        deadline_hit=member.truncated
                     )
+                    samples.append({
+                        "text": self._postprocess(member.generated_ids, member.stopping),
+                        "mean_logprob": member.logprob_sum / len(member.generated_ids) if member.generated_ids else 0.0,
+                        "tokens": len(member.generated_ids),
+                        "truncated": member.truncated
+                    })
                 
-                # فك ترميز النتيجة
-                generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+                if usage is not None:
+                    usage.update(
+                        input_tokens=len(inputs),
+                        output_tokens=sum(sample["tokens"] for sample in samples),
+                        truncated=any(sample["truncated"] for sample in samples),
+                        cached=False
+                    )
+                
+                if dedup:
+                    unique = {}
+                    for sample in samples:
+                        # الاحتفاظ بالنسخة الأعلى احتمالاً من كل نص مكرر
+                        key = sample["text"].strip()
+                        if key not in unique or sample["mean_logprob"] > unique[key]["mean_logprob"]:
+                            unique[key] = sample
+                    samples = list(unique.values())
+                if rank:
+                    samples.sort(key=lambda sample: sample["mean_logprob"], reverse=True)
+                return samples
                 
-                # إزالة النص الأصلي من النتيجة
-                if generated_text.startswith(prompt):
-                    generated_text = generated_text[len(prompt):].strip()
+            except Exception as e:
+                logger.error(f"خطأ في توليد العينات: {str(e)}")
+                raise
+    
+    def _preprocess(self, prompt):
+        """مرحلة الترميز: تعبئة الـ prompt ثم ترميزه عبر ذاكرة الترميز المؤقتة"""
+        packed = self.pack_prompt(prompt)
+        return self.token_cache.encode_prompt(self.tokenizer, packed)
+    
+    def _postprocess(self, generated_ids, stopping=None):
+        """مرحلة فك الترميز: فك الرموز المولدة فقط واقتطاعها عند موضع الإيقاف"""
+        # الـ prompt المعبأ قد يحوي رموزاً خاصة (مثل FIM) فلا يُفك ترميزه مع النتيجة
+        generated_text = self.tokenizer.decode(generated_ids, skip_special_tokens=True).strip()
+        
+        # اقتطاع النص عند موضع الإيقاف المبكر
+        if stopping is not None and stopping.stop_position is not None:
+            generated_text = stopping.truncate(generated_text).strip()
+        return generated_text
+    
+    def pack_prompt(self, prompt):
+        """تعبئة الـ prompt ضمن max_input_tokens مع الإبقاء على القالب والكود قرب المؤشر
+        
+        النص العادي يُعامل ككود بلا قالب فيُحتفظ بذيله بدلاً من بدايته.
+        """
+        if not isinstance(prompt, PromptContext):
+            prompt = PromptContext("", prompt, lang="text")
+        tokenizer = self.tokenizer
+        packer = ContextPacker(
+            tokenizer, max_tokens=self.max_input_tokens,
+            encode=lambda text: self.token_cache.encode(tokenizer, text)
+        )
+        packed = packer.pack(prompt)
+        if packed != prompt.text:
+            logger.info(f"تمت تعبئة الإدخال ضمن {self.max_input_tokens} رمز حول موضع المؤشر")
+        return packed
+    
+    def _execute(self, request, consume=None):
+        """إرسال الطلب (مع عيناته) إلى النسخ المحلية أو خادم الاستدلال وانتظار اكتماله
+        
+        تُحجز ذاكرة KV قبل الإرسال وتُحرر بعد الاكتمال، ولكل عينة صف KV خاص
+        بعد النسخ. consume (اختياري) يستهلك رموز البث أثناء الانتظار. في وضع
+        الخادم المنفصل يحجز الخادم الذاكرة بميزانيته ويُعاد رفضه بنوعه هنا.
+        """
+        if self.inference_client is not None:
+            self.inference_client.submit(self.name, request)
+            self._wait(request, consume, cancel=self.inference_client.cancel)
+            return
+        with self.admission.reserve(len(request.input_ids), request.max_new_tokens,
+                                    rows=len(request.group()), deadline=request.deadline):
+            self.replica_pool.submit(request)
+            self._wait(request, consume)
+    
+    @staticmethod
+    def _wait(request, consume=None, cancel=None):
+        """استهلاك رموز البث ثم انتظار اكتمال الطلب وعيناته
+        
+        إذا فشل consume (مثل انقطاع عميل البث) يُلغى الطلب فيخرج من الدفعة في
+        الخطوة التالية، ويُنتظر خروجه قبل تحرير حجز الذاكرة. cancel (اختياري)
+        يبلغ خادم الاستدلال بالإلغاء في وضع الخادم المنفصل.
+        """
+        try:
+            if consume is not None:
+                consume(request)
+        except Exception:
+            request.cancel()
+            if cancel is not None:
+                cancel(request)
+            for member in request.group():
+                member.done.wait()
+            raise
+        for member in request.group():
+            member.done.wait()
+    
+    def _stream_tokens(self, request, on_token):
+        """فك ترميز الرموز تدريجياً وتمرير النص الجديد فور اكتماله"""
+        tokenizer = self.tokenizer
+        token_ids = []
+        prefix_offset = 0
+        read_offset = 0
+        
+        while True:
+            token = request.token_queue.get()
+            if token is None:
+                break
+            token_ids.append(token)
+            
+            # فك ترميز نافذة صغيرة فقط لتجنب إعادة فك ترميز التسلسل كاملاً
+            prefix_text = tokenizer.decode(token_ids[prefix_offset:read_offset], skip_special_tokens=True)
+            new_text = tokenizer.decode(token_ids[prefix_offset:], skip_special_tokens=True)
+            
+            # تأجيل الأحرف غير المكتملة (UTF-8 مجزأ على عدة رموز)
+            if len(new_text) > len(prefix_text) and not new_text.endswith('\ufffd'):
+                prefix_offset = read_offset
+                read_offset = len(token_ids)
+                on_token(new_text[len(prefix_text):])
+    
+    def compare_backends(self, prompts=None, max_new_tokens=32):
+        """تشغيل نفس الـ prompts على جميع الواجهات الخلفية ومقارنة السرعة والذاكرة
+        
+        يُحمَّل نموذج مستقل لكل واجهة خلفية ثم يُحرر، ولا يتأثر النموذج العامل.
+        في وضع الخادم المنفصل تُنفذ المقارنة في عملية الاستدلال.
+        """
+        if self.inference_client is not None:
+            return self.inference_client.call(
+                self.name, "compare_backends", timeout=600, prompts=prompts, max_new_tokens=max_new_tokens
+            )
+        
+        if not self.model_loaded:
+            if not self.load_model():
+                raise RuntimeError("فشل في تحميل النموذج")
+        
+        prompts = prompts or BENCHMARK_PROMPTS
+        results = {}
+        outputs = {}
+        
+        for name, backend_class in BACKENDS.items():
+            try:
+                gc.collect()
+                memory_before = get_process_memory_mb()
+                start_time = time.time()
+                backend = self.backend if isinstance(self.backend, backend_class) else backend_class()
+                model = backend.load_model(self.model_name)
+                load_time = time.time() - start_time
+                memory_loaded = get_process_memory_mb()
                 
-                return generated_text
+                benchmark = benchmark_model(model, self.tokenizer, prompts, max_new_tokens)
+                outputs[name] = benchmark.pop("outputs")
                 
+                results[name] = {
+                    "load_time_seconds": round(load_time, 3),
+                    "rss_before_mb": round(memory_before, 1),
+                    "rss_loaded_mb": round(memory_loaded, 1),
+                    "rss_delta_mb": round(benchmark["peak_rss_mb"] - memory_before, 1),
+                    **benchmark
+                }
+                del model
+            except Exception as e:
+                logger.error(f"خطأ في قياس الواجهة الخلفية {name}: {str(e)}")
+                results[name] = {"error": str(e)}
+            finally:
+                gc.collect()
+        
+        generated = list(outputs.values())
+        return {
+            "active_backend": self.backend.name,
+            "prompts": len(prompts),
+            "max_new_tokens": max_new_tokens,
+            "backends": results,
+            "outputs_match": len(generated) > 1 and all(output == generated[0] for output in generated)
+        }
+    
+    def _inference_server_status(self):
+        """حالة خوادم الاستدلال مع القبول والدفعات في كل منها (في وضع الخادم المنفصل)"""
+        if self.inference_client is None:
+            return {"mode": "local"}
+        status = self.inference_client.get_stats()
+        try:
+            status["servers_status"] = self.inference_client.call_all(self.name, "status")
         except Exception as e:
-            logger.error(f"خطأ في توليد النص: {str(e)}")
-            raise
+            status["servers_status"] = {"error": str(e)}
+        return status
+    
+    def estimate_footprint_mb(self):
+        """الذاكرة المتوقعة للنموذج: المقاسة عند آخر تحميل أو حجم الأوزان المحلية"""
+        if self.footprint_mb is not None:
+            return self.footprint_mb
+        if is_artifact(self.model_name):
+            return os.path.getsize(os.path.join(self.model_name, "model.safetensors")) / 1024 / 1024
+        return 0.0
     
     def get_model_status(self):
         """الحصول على حالة النموذج"""
         return {
+            "name": self.name,
+            "model_name": self.model_name,
             "loaded": self.model_loaded,
+            "footprint_mb": round(self.footprint_mb, 1) if self.footprint_mb is not None else None,
+            "backend": self.backend.name,
+            "precision": self.precision,
+            "optimization": self.optimization,
+            "precision_calibration": self.precision_calibrator.last_result,
+            "model_source": "artifact" if is_artifact(self.model_name) else "hub",
+            "load_time_seconds": round(self.load_time, 3) if self.load_time is not None else None,
+            "load_phases_ms": self.load_phases,
             "memory_usage_mb": self.get_memory_usage(),
+            "unique_memory_mb": self.get_unique_memory_usage(),
             "memory_limit_mb": self.max_memory_mb,
-            "memory_available": self.check_memory_limit()
+            "cache_budget_mb": round(self.cache_budget_mb(), 1),
+            "memory_available": self.check_memory_limit(),
+            "admission": self.admission.get_stats() if self.inference_client is None else None,
+            "inference_server": self._inference_server_status(),
+            "batching": self.replica_pool.get_stats(),
+            "prefix_cache": self.prefix_cache.get_stats(),
+            "response_cache": self.response_cache.get_stats(),
+            "token_cache": self.token_cache.get_stats(),
+            "single_flight": self.single_flight.get_stats(),
+            "lifecycle": self.lifecycle.get_stats(),
+            "stopping": stopping_stats.get_stats()
+        }
+
+class ModelRegistry:
+    """سجل نماذج مسماة مع جدول توجيه لكل خدمة
+    
+    تُحمَّل النماذج عند أول طلب يوجَّه إليها، وعندما يتجاوز مجموع أحجامها
+    ميزانية MAX_MEMORY_MB تُفرَّغ الأقدم استخداماً (LRU) من غير المشغولة.
+    """
+    
+    def __init__(self):
+        self.max_memory_mb = int(os.getenv('MAX_MEMORY_MB', 450))
+        self.lock = Lock()
+        self.evictions = 0
+        
+        # النماذج بالصيغة name=model_name مفصولة بفواصل، والأول هو الافتراضي
+        entries = self._parse_pairs(os.getenv('MODEL_REGISTRY', ''))
+        # ميزانية واحدة لذاكرة النتائج مقسومة على النماذج
+        response_cache_mb = response_cache_budget_mb(self.max_memory_mb) / max(1, len(entries))
+        self.models = OrderedDict()
+        for name, model_name in entries:
+            self.models[name] = ModelManager(model_name=model_name, name=name, response_cache_mb=response_cache_mb)
+        if not self.models:
+            self.models["default"] = ModelManager(response_cache_mb=response_cache_mb)
+        self.default_name = next(iter(self.models))
+        
+        # جدول التوجيه بالصيغة endpoint=name، والخدمات غير المذكورة تستخدم الافتراضي
+        self.routes = {}
+        for endpoint, name in self._parse_pairs(os.getenv('MODEL_ROUTES', '')):
+            if name in self.models:
+                self.routes[endpoint] = name
+            else:
+                logger.warning(f"نموذج غير معروف '{name}' في جدول التوجيه للخدمة {endpoint}")
+    
+    @staticmethod
+    def _parse_pairs(value):
+        """تحليل قائمة key=value مفصولة بفواصل"""
+        pairs = []
+        for item in value.split(','):
+            if '=' in item:
+                key, val = item.split('=', 1)
+                pairs.append((key.strip(), val.strip()))
+        return pairs
+    
+    @property
+    def default(self):
+        return self.models[self.default_name]
+    
+    def route(self, endpoint=None):
+        """النموذج المسؤول عن الخدمة"""
+        return self.models[self.routes.get(endpoint, self.default_name)]
+    
+    def generate_text(self, prompt, endpoint=None, **kwargs):
+        """توليد النص بالنموذج الموجه إليه الخدمة"""
+        manager = self.route(endpoint)
+        if not manager.model_loaded:
+            self._make_room(manager)
+        
+        with self.lock:
+            self.models.move_to_end(manager.name)
+        
+        try:
+            return manager.generate_text(prompt, endpoint=endpoint, **kwargs)
+        finally:
+            # الحجم الفعلي يُعرف بعد أول تحميل فقط
+            self._make_room(manager)
+    
+    @staticmethod
+    def _model_footprint_mb(manager):
+        """حجم النموذج المحمل مع ذاكرة بادئاته (تُفرغ معه)"""
+        return manager.estimate_footprint_mb() + manager.prefix_cache.max_bytes / 1024 / 1024
+    
+    def _loaded_footprint_mb(self):
+        """مجموع أحجام النماذج المحملة وذاكرات النتائج لجميع النماذج (تبقى بعد التفريغ)"""
+        models_mb = sum(self._model_footprint_mb(m) for m in self.models.values() if m.model_loaded)
+        caches_mb = sum(m.response_cache.max_bytes for m in self.models.values()) / 1024 / 1024
+        return models_mb + caches_mb
+    
+    def _make_room(self, manager):
+        """تفريغ النماذج الأقدم استخداماً حتى يتسع النموذج المطلوب ضمن الميزانية"""
+        with self.lock:
+            needed = 0.0 if manager.model_loaded else self._model_footprint_mb(manager)
+            for name, other in list(self.models.items()):
+                if self._loaded_footprint_mb() + needed <= self.max_memory_mb:
+                    break
+                if other is manager:
+                    continue
+                # التفريغ عبر بروتوكول الانتقال نفسه: الطلب الذي يصل أثناءه ينتظر ثم يعيد التحميل
+                if other.lifecycle.evict():
+                    logger.info(f"تم تفريغ النموذج {name} لإفساح الذاكرة للنموذج {manager.name}")
+                    self.evictions += 1
+    
+    def generate_samples(self, prompt, endpoint=None, **kwargs):
+        """توليد عدة عينات بالنموذج الموجه إليه الخدمة"""
+        manager = self.route(endpoint)
+        if not manager.model_loaded:
+            self._make_room(manager)
+        
+        with self.lock:
+            self.models.move_to_end(manager.name)
+        
+        try:
+            return manager.generate_samples(prompt, endpoint=endpoint, **kwargs)
+        finally:
+            self._make_room(manager)
+    
+    def response_cache_stats(self):
+        """إحصائيات ذاكرة النتائج مجمعة لجميع النماذج مع تفصيل كل نموذج"""
+        per_model = {name: m.response_cache.get_stats() for name, m in self.models.items()}
+        stats = {
+            key: sum(s[key] for s in per_model.values())
+            for key in ("entries", "hits", "misses", "evictions", "expirations")
         }
+        lookups = stats["hits"] + stats["misses"]
+        stats.update({
+            "memory_mb": round(sum(s["memory_mb"] for s in per_model.values()), 3),
+            "memory_limit_mb": round(sum(s["memory_limit_mb"] for s in per_model.values()), 2),
+            "hit_rate": round(stats["hits"] / lookups * 100, 2) if lookups else 0,
+            "models": per_model
+        })
+        return stats
+    
+    def load_model(self):
+        """تحميل النموذج الافتراضي"""
+        return self.default.load_model()
+    
+    def cleanup_all(self):
+        """تفريغ جميع النماذج"""
+        for manager in self.models.values():
+            manager.cleanup_model()
+    
+    def get_stats(self):
+        """حالة السجل وجدول التوجيه"""
+        with self.lock:
+            return {
+                "default_model": self.default_name,
+                "memory_budget_mb": self.max_memory_mb,
+                "loaded_footprint_mb": round(self._loaded_footprint_mb(), 1),
+                "lru_order": list(self.models.keys()),
+                "routes": dict(self.routes),
+                "evictions": self.evictions,
+                "models": {
+                    name: {
+                        "model_name": m.model_name,
+                        "loaded": m.model_loaded,
+                        "footprint_mb": round(m.estimate_footprint_mb(), 1)
+                    }
+                    for name, m in self.models.items()
+                }
+            }
 
-# إنشاء مثيل عام من مدير النموذج
-model_manager = ModelManager()
+# إنشاء مثيل عام من سجل النماذج، والمدير العام هو النموذج الافتراضي
+model_registry = ModelRegistry()
+model_manager = model_registry.default
 
@@ -345,10 +345,13 @@ class PerformanceProfiler:
     def get_all_stats(self) -> Dict[str, Any]:
         """الحصول على إحصائيات جميع العمليات"""
         with self.lock:
-            stats = {}
-            for operation in self.operation_times:
-                stats[operation] = self.get_operation_stats(operation)
-            return stats
+            operations = list(self.operation_times)
+        
+        # get_operation_stats يأخذ القفل بنفسه
+        stats = {}
+        for operation in operations:
+            stats[operation] = self.get_operation_stats(operation)
+        return stats
 
 # إنشاء مثيلات عامة
 system_monitor = SystemMonitor()
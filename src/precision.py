@@ -0,0 +1,123 @@
+import os
+import gc
+import json
+import time
+import logging
+from typing import Dict, Any, Optional
+
+import torch
+
+from src.inference_backends import PRECISIONS, TorchBackend, benchmark_model, get_process_memory_mb
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# prompt ثابت للقياس المصغر حتى تكون النتائج قابلة للمقارنة بين التشغيلات
+CALIBRATION_PROMPT = "# Complete this python code:\ndef fibonacci(n):\n"
+
+
+class PrecisionCalibrator:
+    """اختيار أسرع دقة للنموذج تناسب حد الذاكرة على المعالج
+
+    يجرب fp32 و bf16 و int8 الديناميكي على prompt قياسي ثابت، ويحتفظ بأسرع
+    إعداد لا يتجاوز حد الذاكرة. تُحفظ النتيجة على القرص حتى تتخطى عمليات
+    الإقلاع اللاحقة المعايرة.
+    """
+
+    def __init__(self, cache_path: Optional[str] = None, benchmark_tokens: int = 16):
+        self.cache_path = cache_path or os.getenv('PRECISION_CACHE_PATH', '/app/data/precision.json')
+        self.benchmark_tokens = benchmark_tokens
+        self.last_result: Optional[Dict[str, Any]] = None
+
+    def _cache_key(self, model_name: str, max_memory_mb: int) -> str:
+        """مفتاح النتيجة المخزنة (تتغير النتيجة بتغير النموذج أو العتاد أو الحد)"""
+        return f"{model_name}|torch-{torch.__version__}|cpus-{os.cpu_count()}|{max_memory_mb}MB"
+
+    def _read_cache(self) -> Dict[str, Any]:
+        """قراءة نتائج المعايرة المخزنة"""
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self, key: str, result: Dict[str, Any]):
+        """حفظ نتيجة المعايرة على القرص"""
+        try:
+            cache = self._read_cache()
+            cache[key] = result
+            directory = os.path.dirname(self.cache_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.error(f"خطأ في حفظ نتيجة المعايرة: {str(e)}")
+
+    def select(self, model_name: str, tokenizer, max_memory_mb: int) -> str:
+        """إرجاع الدقة المخزنة أو تشغيل المعايرة لاختيارها"""
+        key = self._cache_key(model_name, max_memory_mb)
+        cached = self._read_cache().get(key)
+        if cached and cached.get("precision") in PRECISIONS:
+            logger.info(f"استخدام الدقة المخزنة: {cached['precision']}")
+            self.last_result = {**cached, "cached": True}
+            return cached["precision"]
+
+        result = self.calibrate(model_name, tokenizer, max_memory_mb)
+        self._write_cache(key, result)
+        self.last_result = {**result, "cached": False}
+        return result["precision"]
+
+    def calibrate(self, model_name: str, tokenizer, max_memory_mb: int) -> Dict[str, Any]:
+        """قياس كل دقة واختيار الأسرع ضمن حد الذاكرة"""
+        logger.info("بدء معايرة دقة النموذج...")
+        calibration_start = time.time()
+        gc.collect()
+        baseline_memory = get_process_memory_mb()
+        candidates = {}
+
+        for precision in PRECISIONS:
+            model = None
+            try:
+                gc.collect()
+                memory_before = get_process_memory_mb()
+                model = TorchBackend(precision).load_model(model_name)
+
+                # تمرير إحماء أول حتى لا تُحتسب تكلفة التهيئة
+                benchmark_model(model, tokenizer, [CALIBRATION_PROMPT], max_new_tokens=2)
+                benchmark = benchmark_model(model, tokenizer, [CALIBRATION_PROMPT], self.benchmark_tokens)
+
+                # ذاكرة هذا الإعداد وحده مضافة إلى خط الأساس قبل المعايرة
+                estimated_memory = baseline_memory + max(0.0, benchmark["peak_rss_mb"] - memory_before)
+                candidates[precision] = {
+                    "tokens_per_second": benchmark["tokens_per_second"],
+                    "estimated_rss_mb": round(estimated_memory, 1),
+                    "fits": estimated_memory <= max_memory_mb
+                }
+            except Exception as e:
+                logger.warning(f"تعذر قياس الدقة {precision}: {str(e)}")
+                candidates[precision] = {"error": str(e), "fits": False}
+            finally:
+                del model
+                gc.collect()
+
+        measured = {name: data for name, data in candidates.items() if "error" not in data}
+        fitting = {name: data for name, data in measured.items() if data["fits"]}
+        if fitting:
+            precision = max(fitting, key=lambda name: fitting[name]["tokens_per_second"])
+        elif measured:
+            # لا شيء ضمن الحد: اختيار الأقل استهلاكاً للذاكرة
+            logger.warning("لا توجد دقة ضمن حد الذاكرة، اختيار الأقل استهلاكاً")
+            precision = min(measured, key=lambda name: measured[name]["estimated_rss_mb"])
+        else:
+            precision = "fp32"
+
+        elapsed = time.time() - calibration_start
+        logger.info(f"تم اختيار الدقة {precision} خلال {elapsed:.1f} ثانية")
+        return {
+            "precision": precision,
+            "candidates": candidates,
+            "calibration_seconds": round(elapsed, 2),
+            "calibrated_at": time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
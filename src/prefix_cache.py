@@ -0,0 +1,153 @@
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Tuple
+
+import torch
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def map_cache(past, fn):
+    """تطبيق دالة على جميع موترات ذاكرة KV مع الحفاظ على بنيتها"""
+    if isinstance(past, torch.Tensor):
+        return fn(past)
+    return tuple(map_cache(item, fn) for item in past)
+
+
+def cache_nbytes(past) -> int:
+    """حساب حجم ذاكرة KV بالبايت"""
+    if isinstance(past, torch.Tensor):
+        return past.numel() * past.element_size()
+    return sum(cache_nbytes(item) for item in past)
+
+
+def slice_cache(past, length: int, seq_dim: int, copy: bool = False):
+    """اقتطاع أول length موضع من ذاكرة KV"""
+    def cut(tensor):
+        sliced = tensor.narrow(seq_dim, 0, length)
+        return sliced.clone() if copy else sliced
+    return map_cache(past, cut)
+
+
+def common_prefix_length(first, second) -> int:
+    """طول البادئة المشتركة بين تسلسلين من الرموز"""
+    limit = min(len(first), len(second))
+    length = 0
+    while length < limit and first[length] == second[length]:
+        length += 1
+    return length
+
+
+class PrefixCache:
+    """ذاكرة مؤقتة لقيم past_key_values الخاصة ببادئات الـ prompts
+
+    تحتفظ بذاكرة KV لكل prompt تمت معالجته مفهرسة برموزه، وتعيد أطول بادئة
+    مشتركة مع الطلب الجديد حتى لا يُعالَج إلا الجزء المتبقي منه. عند تكرار
+    بادئة بين prompts مختلفة (مثل قوالب الخدمات الثابتة) تُحفظ كمدخل مستقل
+    حتى تبقى بعد إخراج الـ prompts الكاملة. الإخراج LRU ضمن حد الذاكرة.
+    """
+
+    def __init__(self, max_memory_mb=32, min_prefix_tokens=4):
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+        self.min_prefix_tokens = min_prefix_tokens
+        self.entries: "OrderedDict[Tuple[int, ...], Tuple[Any, int]]" = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        # إحصائيات
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.tokens_reused = 0
+
+    def lookup(self, input_ids: List[int], seq_dim: int) -> Tuple[int, Any]:
+        """البحث عن أطول بادئة مخزنة مشتركة مع الإدخال"""
+        # يجب أن يبقى رمز واحد على الأقل لحساب توزيع الرمز التالي
+        limit = len(input_ids) - 1
+
+        with self.lock:
+            best_key = None
+            best_length = 0
+            covered = []
+            for key in self.entries:
+                length = min(common_prefix_length(key, input_ids), limit)
+                if length == len(key):
+                    covered.append(key)
+                if length > best_length:
+                    best_key, best_length = key, length
+
+            # تحديث المدخلات التي تغطيها البادئة بالكامل حتى لا تُخرج
+            for key in covered:
+                self.entries.move_to_end(key)
+
+            if best_key is None or best_length < self.min_prefix_tokens:
+                self.misses += 1
+                return 0, None
+
+            self.entries.move_to_end(best_key)
+            past = self.entries[best_key][0]
+            self.hits += 1
+            self.tokens_reused += best_length
+
+        return best_length, slice_cache(past, best_length, seq_dim)
+
+    def store(self, token_ids: List[int], past, seq_dim: int):
+        """تخزين ذاكرة KV لتسلسل مع بادئته المشتركة مع المدخلات الحالية"""
+        key = tuple(token_ids)
+        if len(key) < self.min_prefix_tokens:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+
+            shared_length = 0
+            for existing in self.entries:
+                shared_length = max(shared_length, common_prefix_length(existing, key))
+
+            self._insert(key, slice_cache(past, len(key), seq_dim, copy=True))
+
+            # حفظ البادئة المشتركة (مثل قالب الخدمة) كمدخل مستقل
+            if self.min_prefix_tokens <= shared_length < len(key):
+                shared_key = key[:shared_length]
+                if shared_key not in self.entries:
+                    self._insert(shared_key, slice_cache(past, shared_length, seq_dim, copy=True))
+
+    def _insert(self, key: Tuple[int, ...], past):
+        """إضافة مدخل مع إخراج الأقدم عند تجاوز حد الذاكرة"""
+        nbytes = cache_nbytes(past)
+        if nbytes > self.max_bytes:
+            return
+
+        self.entries[key] = (past, nbytes)
+        self.total_bytes += nbytes
+
+        while self.total_bytes > self.max_bytes and self.entries:
+            _, (_, evicted_bytes) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_bytes
+            self.evictions += 1
+
+    def clear(self):
+        """مسح جميع المدخلات"""
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """الحصول على إحصائيات الذاكرة المؤقتة"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "memory_mb": round(self.total_bytes / 1024 / 1024, 2),
+                "memory_limit_mb": round(self.max_bytes / 1024 / 1024, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0,
+                "evictions": self.evictions,
+                "tokens_reused": self.tokens_reused
+            }
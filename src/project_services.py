@@ -2,7 +2,9 @@ import re
 import json
 import logging
 from typing import Dict, Any, List, Optional
-from src.model_manager import model_manager
+from src.model_manager import model_registry
+from src.admission import admission_error_fields
+from src.stopping import StoppingCriteria, CODE_FENCE
 
 # إعداد نظام السجلات
 logging.basicConfig(level=logging.INFO)
@@ -96,6 +98,7 @@ function addClickListener(elementId, callback) {
             
             # البحث في القوالب المحفوظة
             template = self._find_template(task, lang)
+            usage = {"input_tokens": 0, "output_tokens": 0}
             
             if template:
                 # استخدام القالب الموجود
@@ -103,7 +106,7 @@ function addClickListener(elementId, callback) {
                 source = "template"
             else:
                 # توليد مقطع جديد باستخدام النموذج
-                snippet = self._generate_snippet(task, lang, style)
+                snippet = self._generate_snippet(task, lang, style, usage)
                 source = "generated"
             
             # إضافة تعليقات وتوثيق
@@ -111,6 +114,7 @@ function addClickListener(elementId, callback) {
             
             return {
                 "success": True,
+                "usage": usage,
                 "snippet": documented_snippet,
                 "task": task,
                 "language": lang,
@@ -124,6 +128,7 @@ function addClickListener(elementId, callback) {
             return {
                 "success": False,
                 "error": str(e),
+                **admission_error_fields(e),
                 "snippet": "",
                 "task": data.get('task', '')
             }
@@ -272,7 +277,7 @@ function addClickListener(elementId, callback) {
         
         return None
     
-    def _generate_snippet(self, task: str, lang: str, style: str) -> str:
+    def _generate_snippet(self, task: str, lang: str, style: str, usage: Optional[Dict[str, Any]] = None) -> str:
         """توليد مقطع كود جديد"""
         if style == 'minimal':
             prompt = f"Create a minimal {lang} code snippet for: {task}"
@@ -281,10 +286,13 @@ function addClickListener(elementId, callback) {
         else:
             prompt = f"Create a {lang} code snippet for: {task}"
         
-        snippet = model_manager.generate_text(
+        snippet = model_registry.generate_text(
             prompt=prompt,
             max_length=150,
-            temperature=0.5
+            temperature=0.5,
+            endpoint='create_snippet',
+            usage=usage,
+            stopping=StoppingCriteria(stop_strings=[CODE_FENCE])
         )
         
         return self._clean_generated_code(snippet)
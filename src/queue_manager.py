@@ -1,17 +1,32 @@
+import os
 import uuid
 import time
-import asyncio
+import heapq
 import threading
 import logging
 from collections import deque
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import Dict, Any, Optional, Callable
+from typing import Dict, Any, Optional, Callable, Iterator, List, Tuple
+from src.auth import api_key_manager
+from src.stopping import BATCH_WINDOW_MS
 
 # إعداد نظام السجلات
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# أولوية فئة النقطة: إكمال الكود تفاعلي فيسبق التوليد الطويل والتحليل
+ENDPOINT_PRIORITIES = {"completions": 0}
+DEFAULT_ENDPOINT_PRIORITY = 1
+
+# الشيخوخة: كل مستوى أولوية يعادل هذه المدة من الانتظار، فلا تُجوَّع المهام منخفضة الأولوية
+PRIORITY_AGING_SECONDS = float(os.getenv('QUEUE_AGING_SECONDS', 5))
+
+def task_priority(api_key: Optional[str], endpoint: str) -> int:
+    """أولوية المهمة من مستوى المفتاح وفئة النقطة (الأصغر أولاً)"""
+    tier_priority = api_key_manager.get_tier(api_key)["priority"]
+    return tier_priority + ENDPOINT_PRIORITIES.get(endpoint, DEFAULT_ENDPOINT_PRIORITY)
+
 class TaskStatus(Enum):
     """حالات المهام"""
     PENDING = "pending"
@@ -19,12 +34,26 @@ class TaskStatus(Enum):
     COMPLETED = "completed"
     FAILED = "failed"
     CANCELLED = "cancelled"
+    EXPIRED = "expired"
+
+# الحالات النهائية للمهمة
+FINAL_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED, TaskStatus.EXPIRED)
+
+class QueueFullError(RuntimeError):
+    """الطابور ممتلئ (أو طابور المفتاح بلغ حده عند tenant=True)"""
+    
+    def __init__(self, message: str, tenant: bool = False):
+        super().__init__(message)
+        self.tenant = tenant
 
 class Task:
     """فئة المهمة"""
-    def __init__(self, task_id: str, endpoint: str, data: Dict[str, Any], callback: Callable):
+    def __init__(self, task_id: str, endpoint: str, data: Dict[str, Any], callback: Callable,
+                 priority: int = 1, api_key: Optional[str] = None):
         self.task_id = task_id
         self.endpoint = endpoint
+        self.api_key = api_key
+        self.tenant = api_key or "anonymous"
         self.data = data
         self.callback = callback
         self.status = TaskStatus.PENDING
@@ -33,83 +62,257 @@ class Task:
         self.completed_at = None
         self.result = None
         self.error = None
-        self.priority = 1  # أولوية افتراضية
+        self.priority = priority
+        self.enqueued_at = time.perf_counter()
+        self.sequence = 0
+        # الرموز الجزئية لمهام التوليد (تُمرر on_token إلى الخدمة عند stream_tokens)
+        self.stream_tokens = False
+        self.tokens: List[str] = []
+    
+    def schedule_key(self) -> float:
+        """مفتاح الترتيب في الكومة: وقت الإدراج مؤخراً بمقدار الأولوية
+        
+        المقارنة بين مفتاحين تكافئ مقارنة الأولوية الفعلية بعد طرح مدة الانتظار
+        (كل PRIORITY_AGING_SECONDS تقدم مستوى واحداً)، فالمفتاح ثابت ولا تحتاج
+        الكومة إلى إعادة ترتيب مع الوقت.
+        """
+        return self.enqueued_at + self.priority * PRIORITY_AGING_SECONDS
+    
+    def remaining_deadline_ms(self) -> Optional[float]:
+        """الوقت المتبقي من deadline_ms محسوباً من لحظة إرسال المهمة"""
+        deadline_ms = self.data.get('deadline_ms') if isinstance(self.data, dict) else None
+        if deadline_ms is None:
+            return None
+        try:
+            elapsed_ms = (datetime.now() - self.created_at).total_seconds() * 1000
+            return float(deadline_ms) - elapsed_ms
+        except (TypeError, ValueError):
+            return None
+
+def percentiles_ms(samples) -> Dict[str, Any]:
+    """متوسط ومئينات عينات زمنية بالثواني محولة إلى مللي ثانية"""
+    samples = sorted(samples)
+    if not samples:
+        return {"samples": 0}
+    return {
+        "samples": len(samples),
+        "avg": round(sum(samples) / len(samples) * 1000, 3),
+        "p50": round(samples[len(samples) // 2] * 1000, 3),
+        "p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+        "max": round(samples[-1] * 1000, 3)
+    }
+
+class TenantQueue:
+    """طابور فرعي لمفتاح API واحد: كومة أولويات مع رصيد العجز لجدولة DRR"""
+    
+    def __init__(self, tenant: str, weight: float):
+        self.tenant = tenant
+        self.weight = weight
+        # كومة (مفتاح الترتيب، رقم تسلسلي، المهمة) وعدد المهام المنتظرة الفعلية
+        self.heap = []
+        self.waiting_count = 0
+        self.deficit = 0.0
+        self.served = 0
+        self.waits = deque(maxlen=500)
+    
+    def push(self, task: Task, sequence: int):
+        """إضافة مهمة إلى الكومة"""
+        task.sequence = sequence
+        heapq.heappush(self.heap, (task.schedule_key(), sequence, task))
+        self.waiting_count += 1
+    
+    def position(self, task: Task) -> int:
+        """ترتيب المهمة بين مهام هذا الطابور المنتظرة (1 يعني التالية)"""
+        key = (task.schedule_key(), task.sequence)
+        return 1 + sum(
+            1 for entry in self.heap
+            if entry[2].status == TaskStatus.PENDING and entry[2] is not task and (entry[0], entry[1]) < key
+        )
+    
+    def pop(self) -> Optional[Task]:
+        """أخذ المهمة الأعلى أولوية مع تجاهل المهام الملغاة"""
+        while self.heap:
+            _, _, task = heapq.heappop(self.heap)
+            if task.status == TaskStatus.PENDING:
+                self.waiting_count -= 1
+                return task
+        return None
+    
+    def compact(self):
+        """إعادة بناء الكومة عندما تتجاوز المهام الملغاة نصفها"""
+        if len(self.heap) > 2 * self.waiting_count + 16:
+            self.heap = [entry for entry in self.heap if entry[2].status == TaskStatus.PENDING]
+            heapq.heapify(self.heap)
 
 class QueueManager:
-    """مدير الطابور الذكي"""
+    """مدير الطابور الذكي
+    
+    التوزيع مدفوع بالأحداث: عمال مجموعة محدودة بعدد max_concurrent_tasks
+    ينتظرون على متغير شرط ويأخذون المهمة فور إرسالها أو فور تحرر عامل،
+    فلا استطلاع دوري ولا خيط جديد لكل مهمة.
     
-    def __init__(self, max_concurrent_tasks=3, max_queue_size=50):
+    لكل مفتاح API طابور فرعي بحد أقصى، وتتناوب الطوابير بجدولة العجز
+    الدوري (DRR) بأوزان المفاتيح فلا يحجب مفتاح مزدحم غيره. داخل الطابور
+    الفرعي تُرتب المهام بالأولوية مع الشيخوخة، والإلغاء كسول: تبقى المهمة
+    الملغاة في الكومة وتُتجاهل عند أخذها.
+    """
+    
+    def __init__(self, max_concurrent_tasks=3, max_queue_size=50, max_tenant_queue_size=None):
         self.max_concurrent_tasks = max_concurrent_tasks
         self.max_queue_size = max_queue_size
+        self.max_tenant_queue_size = max_tenant_queue_size or int(
+            os.getenv('QUEUE_TENANT_CAP', max(1, max_queue_size // 4))
+        )
         self.active_tasks = 0
-        self.waiting_queue = deque()
+        # الطوابير الفرعية لكل مفتاح، والمفاتيح ذات المهام المنتظرة بترتيب الدور
+        self.tenants: Dict[str, TenantQueue] = {}
+        self.active_tenants = deque()
+        self.waiting_count = 0
+        self.sequence = 0
+        # يزداد مع كل إرسال أو تسليم أو إلغاء ليعيد متابعو الأحداث حساب مواقعهم
+        self.queue_version = 0
         self.tasks: Dict[str, Task] = {}
         self.queue_lock = threading.Lock()
-        self.worker_thread = None
+        self.queue_condition = threading.Condition(self.queue_lock)
+        # متغير شرط منفصل لانتظار انتهاء المهام (حتى لا يستهلك المنتظرون إشعارات العمال)
+        self.task_condition = threading.Condition(self.queue_lock)
+        self.worker_threads = []
         self.running = False
+        # عند الإيقاف مع التصريف يُكمل العمال المهام المنتظرة ولا تُقبل مهام جديدة
+        self.draining = False
         
         # إحصائيات
         self.total_processed = 0
         self.total_failed = 0
+        self.total_expired = 0
         self.average_processing_time = 0
+        # زمن التسليم: من جاهزية المهمة وتوفر عامل خامل حتى بدء تنفيذها
+        self.dispatch_latencies = deque(maxlen=1000)
         
     def start_worker(self):
-        """بدء خيط العامل لمعالجة الطابور"""
-        if not self.running:
+        """بدء عمال معالجة الطابور"""
+        with self.queue_lock:
+            if self.running:
+                return
             self.running = True
-            self.worker_thread = threading.Thread(target=self._worker_loop, daemon=True)
-            self.worker_thread.start()
-            logger.info("تم بدء خيط معالجة الطابور")
+            self.draining = False
+            self.worker_threads = [
+                threading.Thread(target=self._worker_loop, name=f"queue-worker-{index}", daemon=True)
+                for index in range(self.max_concurrent_tasks)
+            ]
+        for thread in self.worker_threads:
+            thread.start()
+        logger.info(f"تم بدء {self.max_concurrent_tasks} عامل لمعالجة الطابور")
     
-    def stop_worker(self):
-        """إيقاف خيط العامل"""
-        self.running = False
-        if self.worker_thread:
-            self.worker_thread.join(timeout=5)
-        logger.info("تم إيقاف خيط معالجة الطابور")
+    def stop_worker(self, drain: bool = True, timeout: float = 30.0):
+        """إيقاف العمال
+        
+        drain يرفض المهام الجديدة ويترك العمال يكملون المهام المنتظرة قبل الخروج
+        (حتى timeout)، وبدونه تبقى المهام المنتظرة معلقة في الطابور.
+        """
+        with self.queue_condition:
+            self.running = False
+            self.draining = drain
+            self.queue_condition.notify_all()
+        stop_by = time.time() + timeout
+        for thread in self.worker_threads:
+            thread.join(timeout=max(0.0, stop_by - time.time()))
+        with self.queue_condition:
+            self.draining = False
+            remaining = self.waiting_count
+        self.worker_threads = []
+        if drain and remaining:
+            logger.warning(f"انتهت مهلة تصريف الطابور مع {remaining} مهمة منتظرة")
+        logger.info("تم إيقاف عمال معالجة الطابور")
     
     def _worker_loop(self):
-        """حلقة العامل الرئيسية"""
-        while self.running:
+        """حلقة العامل: انتظار مهمة ثم تنفيذها"""
+        while True:
+            with self.queue_condition:
+                idle_since = time.perf_counter()
+                while self.running and not self.waiting_count:
+                    self.queue_condition.wait()
+                if not self.running and not (self.draining and self.waiting_count):
+                    return
+                task = self._next_task()
+                if task is None:
+                    continue
+                
+                now = time.perf_counter()
+                self.dispatch_latencies.append(now - max(idle_since, task.enqueued_at))
+                self.tenants[task.tenant].waits.append(now - task.enqueued_at)
+                self.active_tasks += 1
+                task.status = TaskStatus.PROCESSING
+                task.started_at = datetime.now()
+                self.queue_version += 1
+                self.task_condition.notify_all()
+            
             try:
-                self._process_queue()
-                time.sleep(0.1)  # فترة انتظار قصيرة
+                self._execute_task(task)
             except Exception as e:
                 logger.error(f"خطأ في حلقة العامل: {str(e)}")
-                time.sleep(1)
     
-    def _process_queue(self):
-        """معالجة الطابور"""
-        with self.queue_lock:
-            # التحقق من إمكانية معالجة مهام جديدة
-            if self.active_tasks >= self.max_concurrent_tasks:
-                return
-            
-            # البحث عن مهمة في الانتظار
-            if not self.waiting_queue:
-                return
-            
-            # أخذ المهمة التالية
-            task = self.waiting_queue.popleft()
-            self.active_tasks += 1
-            task.status = TaskStatus.PROCESSING
-            task.started_at = datetime.now()
+    def _next_task(self) -> Optional[Task]:
+        """أخذ المهمة التالية مع إسقاط المهام التي انقضت مهلتها أثناء الانتظار (يُستدعى مع حجز القفل)"""
+        while True:
+            candidate = self._drr_pop()
+            if candidate is None:
+                return None
+            self.waiting_count -= 1
+            remaining = candidate.remaining_deadline_ms()
+            # المتبقي الذي لا يتجاوز نافذة تجميع الدفعة ينقضي قبل الترميز الأولي
+            if remaining is not None and remaining <= BATCH_WINDOW_MS:
+                candidate.status = TaskStatus.EXPIRED
+                candidate.completed_at = datetime.now()
+                candidate.error = "انقضت مهلة المهمة قبل بدء معالجتها"
+                self.total_expired += 1
+                self.task_condition.notify_all()
+                logger.info(f"تم إسقاط المهمة {candidate.task_id} لانقضاء مهلتها")
+                continue
+            if remaining is not None:
+                # تبدأ مهلة الخدمة مما تبقى وليس من بداية المعالجة
+                candidate.data = dict(candidate.data, deadline_ms=remaining)
+            return candidate
+    
+    def _drr_pop(self) -> Optional[Task]:
+        """المهمة التالية بجدولة العجز الدوري بين المفاتيح (يُستدعى مع حجز القفل)
         
-        # معالجة المهمة في خيط منفصل
-        processing_thread = threading.Thread(
-            target=self._execute_task, 
-            args=(task,), 
-            daemon=True
-        )
-        processing_thread.start()
+        كل مهمة تكلف وحدة واحدة، والمفتاح في رأس الدور يضيف وزنه إلى رصيده عند
+        بداية دوره ويُخدم ما دام رصيده يكفي، ثم ينتقل إلى آخر الدور.
+        """
+        while self.active_tenants:
+            tenant = self.active_tenants[0]
+            if tenant.waiting_count == 0:
+                self.active_tenants.popleft()
+                tenant.deficit = 0.0
+                continue
+            if tenant.deficit < 1:
+                tenant.deficit += tenant.weight
+                if tenant.deficit < 1:
+                    self.active_tenants.rotate(-1)
+                    continue
+            
+            task = tenant.pop()
+            tenant.deficit -= 1
+            tenant.served += 1
+            if tenant.waiting_count == 0:
+                self.active_tenants.popleft()
+                tenant.deficit = 0.0
+            elif tenant.deficit < 1:
+                self.active_tenants.rotate(-1)
+            return task
+        return None
     
     def _execute_task(self, task: Task):
         """تنفيذ مهمة واحدة"""
         try:
             logger.info(f"بدء معالجة المهمة {task.task_id}")
             
-            # تنفيذ المهمة
-            result = task.callback(task.data)
+            # تنفيذ المهمة (مع تمرير الرموز الجزئية لمتابعي الأحداث)
+            if task.stream_tokens:
+                result = task.callback(task.data, on_token=lambda text: self._append_token(task, text))
+            else:
+                result = task.callback(task.data)
             
             # تحديث حالة المهمة
             with self.queue_lock:
@@ -118,6 +321,7 @@ class QueueManager:
                 task.result = result
                 self.active_tasks -= 1
                 self.total_processed += 1
+                self.task_condition.notify_all()
                 
                 # حساب متوسط وقت المعالجة
                 processing_time = (task.completed_at - task.started_at).total_seconds()
@@ -137,23 +341,56 @@ class QueueManager:
                 task.error = str(e)
                 self.active_tasks -= 1
                 self.total_failed += 1
+                self.task_condition.notify_all()
+    
+    def _append_token(self, task: Task, text: str):
+        """إضافة رمز جزئي للمهمة وإيقاظ متابعي أحداثها"""
+        with self.task_condition:
+            task.tokens.append(text)
+            self.task_condition.notify_all()
     
-    def submit_task(self, endpoint: str, data: Dict[str, Any], callback: Callable) -> str:
-        """إرسال مهمة جديدة"""
+    def submit_task(self, endpoint: str, data: Dict[str, Any], callback: Callable,
+                    api_key: Optional[str] = None, stream_tokens: bool = False) -> str:
+        """إرسال مهمة جديدة (أولويتها من مستوى مفتاح API وفئة النقطة)
+        
+        stream_tokens يمرر on_token إلى callback لتُتاح الرموز الجزئية عبر task_events.
+        """
         # إنشاء معرف فريد للمهمة
         task_id = str(uuid.uuid4())
+        priority = task_priority(api_key, endpoint)
+        
+        tenant_name = api_key or "anonymous"
+        weight = max(0.1, float(api_key_manager.get_tier(api_key)["weight"]))
         
         with self.queue_lock:
+            if self.draining:
+                raise QueueFullError("الطابور قيد الإيقاف، يرجى المحاولة لاحقاً")
+            
             # التحقق من حد الطابور
-            if len(self.waiting_queue) >= self.max_queue_size:
-                raise RuntimeError("الطابور ممتلئ، يرجى المحاولة لاحقاً")
+            if self.waiting_count >= self.max_queue_size:
+                raise QueueFullError("الطابور ممتلئ، يرجى المحاولة لاحقاً")
+            
+            tenant = self.tenants.get(tenant_name)
+            if tenant is None:
+                tenant = self.tenants[tenant_name] = TenantQueue(tenant_name, weight)
+            tenant.weight = weight
+            if tenant.waiting_count >= self.max_tenant_queue_size:
+                raise QueueFullError("تم بلوغ حد المهام المنتظرة لهذا المفتاح، يرجى المحاولة لاحقاً", tenant=True)
             
             # إنشاء المهمة
-            task = Task(task_id, endpoint, data, callback)
+            task = Task(task_id, endpoint, data, callback, priority=priority, api_key=api_key)
+            task.stream_tokens = stream_tokens
             self.tasks[task_id] = task
             
-            # إضافة المهمة للطابور
-            self.waiting_queue.append(task)
+            # إضافة المهمة لطابور المفتاح وإيقاظ عامل خامل
+            tenant.push(task, self.sequence)
+            self.sequence += 1
+            self.waiting_count += 1
+            if tenant.waiting_count == 1 and tenant not in self.active_tenants:
+                self.active_tenants.append(tenant)
+            self.queue_version += 1
+            self.queue_condition.notify()
+            self.task_condition.notify_all()
             
         logger.info(f"تم إرسال المهمة {task_id} إلى الطابور")
         return task_id
@@ -168,6 +405,7 @@ class QueueManager:
             "task_id": task.task_id,
             "status": task.status.value,
             "endpoint": task.endpoint,
+            "priority": task.priority,
             "created_at": task.created_at.isoformat(),
             "started_at": task.started_at.isoformat() if task.started_at else None,
             "completed_at": task.completed_at.isoformat() if task.completed_at else None,
@@ -175,11 +413,74 @@ class QueueManager:
         
         if task.status == TaskStatus.COMPLETED:
             status_info["result"] = task.result
-        elif task.status == TaskStatus.FAILED:
+        elif task.status in (TaskStatus.FAILED, TaskStatus.EXPIRED):
             status_info["error"] = task.error
         
         return status_info
     
+    def wait_for_task(self, task_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """انتظار انتهاء المهمة حتى المهلة ثم إرجاع حالتها (للاستطلاع الطويل)"""
+        task = self.tasks.get(task_id)
+        if not task:
+            return None
+        with self.task_condition:
+            self.task_condition.wait_for(lambda: task.status in FINAL_STATUSES, timeout)
+        return self.get_task_status(task_id)
+    
+    def task_events(self, task_id: str, keepalive_seconds: float = 15.0) -> Iterator[Optional[Tuple[str, Dict[str, Any]]]]:
+        """أحداث تقدم المهمة حتى انتهائها: تغير الحالة والموقع في الطابور والرموز الجزئية ثم النتيجة
+        
+        يُرجع None عند مرور keepalive_seconds دون أحداث (لإبقاء الاتصال حياً).
+        """
+        task = self.tasks.get(task_id)
+        if not task:
+            return
+        
+        status = None
+        position = None
+        cursor = 0
+        version = -1
+        while True:
+            with self.task_condition:
+                self.task_condition.wait_for(
+                    lambda: task.status != status or len(task.tokens) > cursor or self.queue_version != version,
+                    keepalive_seconds
+                )
+                current_status = task.status
+                tokens = task.tokens[cursor:]
+                version = self.queue_version
+                current_position = None
+                if current_status == TaskStatus.PENDING:
+                    current_position = {
+                        "position": self.tenants[task.tenant].position(task),
+                        "waiting_total": self.waiting_count,
+                        "active_tasks": self.active_tasks
+                    }
+            
+            idle = True
+            if current_status != status:
+                status = current_status
+                idle = False
+                yield "status", {"task_id": task_id, "status": status.value}
+            if current_position is not None and current_position != position:
+                position = current_position
+                idle = False
+                yield "position", dict(current_position, task_id=task_id)
+            if tokens:
+                cursor += len(tokens)
+                idle = False
+                yield "token", {"task_id": task_id, "text": "".join(tokens)}
+            if status in FINAL_STATUSES:
+                yield "result", self.get_task_status(task_id)
+                return
+            if idle:
+                yield None
+    
+    def is_task_owner(self, task_id: str, api_key: Optional[str]) -> bool:
+        """التحقق من أن المهمة أُرسلت بهذا المفتاح"""
+        task = self.tasks.get(task_id)
+        return task is not None and (task.api_key is None or task.api_key == api_key)
+    
     def cancel_task(self, task_id: str) -> bool:
         """إلغاء مهمة"""
         with self.queue_lock:
@@ -188,15 +489,17 @@ class QueueManager:
                 return False
             
             if task.status == TaskStatus.PENDING:
-                # إزالة من الطابور
-                try:
-                    self.waiting_queue.remove(task)
-                    task.status = TaskStatus.CANCELLED
-                    task.completed_at = datetime.now()
-                    logger.info(f"تم إلغاء المهمة {task_id}")
-                    return True
-                except ValueError:
-                    return False
+                # حذف كسول: تبقى في الكومة وتُتجاهل عند أخذها
+                task.status = TaskStatus.CANCELLED
+                task.completed_at = datetime.now()
+                tenant = self.tenants[task.tenant]
+                tenant.waiting_count -= 1
+                tenant.compact()
+                self.waiting_count -= 1
+                self.queue_version += 1
+                self.task_condition.notify_all()
+                logger.info(f"تم إلغاء المهمة {task_id}")
+                return True
             
             return False
     
@@ -205,14 +508,44 @@ class QueueManager:
         with self.queue_lock:
             return {
                 "active_tasks": self.active_tasks,
-                "waiting_tasks": len(self.waiting_queue),
+                "waiting_tasks": self.waiting_count,
+                "waiting_by_priority": self._waiting_by_priority(),
+                "max_tenant_queue_size": self.max_tenant_queue_size,
+                "tenants": self._tenant_stats(),
                 "max_concurrent": self.max_concurrent_tasks,
                 "max_queue_size": self.max_queue_size,
                 "total_processed": self.total_processed,
                 "total_failed": self.total_failed,
+                "total_expired": self.total_expired,
                 "average_processing_time": round(self.average_processing_time, 2),
-                "queue_utilization": len(self.waiting_queue) / self.max_queue_size * 100
+                "dispatch_latency_ms": self._latency_stats(),
+                "queue_utilization": self.waiting_count / self.max_queue_size * 100
+            }
+    
+    def _waiting_by_priority(self) -> Dict[int, int]:
+        """عدد المهام المنتظرة لكل مستوى أولوية (يُستدعى مع حجز القفل)"""
+        counts: Dict[int, int] = {}
+        for tenant in self.tenants.values():
+            for _, _, task in tenant.heap:
+                if task.status == TaskStatus.PENDING:
+                    counts[task.priority] = counts.get(task.priority, 0) + 1
+        return dict(sorted(counts.items()))
+    
+    def _tenant_stats(self) -> Dict[str, Any]:
+        """عمق طابور كل مفتاح ومئينات زمن انتظاره (يُستدعى مع حجز القفل)"""
+        return {
+            (name[:8] + "..." if name != "anonymous" else name): {
+                "waiting": tenant.waiting_count,
+                "weight": tenant.weight,
+                "served": tenant.served,
+                "wait_ms": percentiles_ms(tenant.waits)
             }
+            for name, tenant in self.tenants.items()
+        }
+    
+    def _latency_stats(self) -> Dict[str, Any]:
+        """إحصائيات زمن التسليم بالمللي ثانية (يُستدعى مع حجز القفل)"""
+        return percentiles_ms(self.dispatch_latencies)
     
     def cleanup_old_tasks(self, max_age_hours=24):
         """تنظيف المهام القديمة"""
@@ -221,9 +554,7 @@ class QueueManager:
         with self.queue_lock:
             old_task_ids = [
                 task_id for task_id, task in self.tasks.items()
-                if task.created_at < cutoff_time and task.status in [
-                    TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED
-                ]
+                if task.created_at < cutoff_time and task.status in FINAL_STATUSES
             ]
             
             for task_id in old_task_ids:
@@ -0,0 +1,181 @@
+import os
+import threading
+import logging
+from typing import Dict, Any, List, Optional
+
+import torch
+
+from src.batch_scheduler import BatchScheduler, GenerationRequest
+from src.speculative import SpeculativeDecoder
+from src.stopping import BATCH_WINDOW_MS
+from src.warmup import grad_context
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# أقل عدد خيوط لكل نسخة حتى لا تتحول كل نسخة إلى خيط واحد بطيء
+MIN_THREADS_PER_REPLICA = 2
+MAX_REPLICAS = 8
+
+
+def detect_cpus() -> List[int]:
+    """الأنوية المتاحة لهذه العملية"""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def estimate_replica_memory_mb(config, batch_size: int, sequence_length: int, bytes_per_value: int = 4) -> float:
+    """تقدير ذاكرة KV والتنشيطات لنسخة واحدة بدفعة كاملة"""
+    layers = getattr(config, 'num_hidden_layers', None) or getattr(config, 'n_layer', 1)
+    hidden = getattr(config, 'hidden_size', None) or getattr(config, 'n_embd', 1)
+    vocab = getattr(config, 'vocab_size', 0)
+    kv_bytes = 2 * layers * hidden * sequence_length * batch_size * bytes_per_value
+    logits_bytes = vocab * batch_size * sequence_length * bytes_per_value
+    return (kv_bytes + logits_bytes) / 1024 / 1024
+
+
+def plan_replicas(cpus: List[int], memory_available_mb: float, replica_memory_mb: float,
+                  replicas: Optional[int] = None, threads: Optional[int] = None) -> List[List[int]]:
+    """توزيع الأنوية على النسخ بحسب عدد الأنوية وميزانية الذاكرة
+
+    تُحجز نواة لخيوط Flask عند توفر أكثر من نواتين، ويُرجع قائمة بأنوية كل نسخة.
+    """
+    usable = cpus[:-1] if len(cpus) > 2 else list(cpus)
+
+    if replicas is None:
+        by_cores = max(1, len(usable) // (threads or MIN_THREADS_PER_REPLICA))
+        by_memory = max(1, int(memory_available_mb // replica_memory_mb)) if replica_memory_mb > 0 else by_cores
+        replicas = min(by_cores, by_memory, MAX_REPLICAS)
+    replicas = max(1, replicas)
+
+    threads = threads or max(1, len(usable) // replicas)
+    plan = []
+    for index in range(replicas):
+        start = (index * threads) % len(usable)
+        plan.append([usable[(start + offset) % len(usable)] for offset in range(min(threads, len(usable)))])
+    return plan
+
+
+class ModelReplica:
+    """نسخة استدلال لها خيط جدولة وأنوية وعدد خيوط خاص بها
+
+    النسخ تتشارك أوزان النموذج نفسها (الاستدلال لا يعدلها) فتكلف كل نسخة
+    ذاكرة KV والتنشيطات فقط، ولكل نسخة قفل خاص بها بدلاً من قفل عام واحد.
+    """
+
+    def __init__(self, model_manager, index: int, cpus: List[int], num_threads: int,
+                 max_batch_size: int = 4, batch_window_ms: int = BATCH_WINDOW_MS):
+        self.model_manager = model_manager
+        self.index = index
+        self.cpus = cpus
+        self.num_threads = num_threads
+        self.model_lock = threading.Lock()
+
+        self.batch_scheduler = BatchScheduler(self, max_batch_size=max_batch_size, batch_window_ms=batch_window_ms)
+        self.batch_scheduler.worker_init = self._pin
+        self.batch_scheduler.grad_context = grad_context(model_manager.optimization)
+        if model_manager.draft_model_name:
+            self.batch_scheduler.speculative = SpeculativeDecoder(
+                self.batch_scheduler, num_draft_tokens=model_manager.speculative_tokens
+            )
+
+    # المجدول يصل إلى النموذج وذاكرة البادئات عبر النسخة
+    @property
+    def model(self):
+        return self.model_manager.model
+
+    @property
+    def tokenizer(self):
+        return self.model_manager.tokenizer
+
+    @property
+    def draft_model(self):
+        return self.model_manager.draft_model
+
+    @property
+    def prefix_cache(self):
+        return self.model_manager.prefix_cache
+
+    def _pin(self):
+        """تثبيت خيط الجدولة على أنوية النسخة وتحديد عدد خيوط PyTorch"""
+        torch.set_num_threads(self.num_threads)
+        if hasattr(os, 'sched_setaffinity'):
+            # على Linux يطبق الرقم 0 على الخيط الحالي فقط
+            os.sched_setaffinity(0, self.cpus)
+        logger.info(f"النسخة {self.index}: الأنوية {self.cpus} بعدد خيوط {self.num_threads}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """إحصائيات النسخة"""
+        return {
+            "index": self.index,
+            "cpus": self.cpus,
+            "num_threads": self.num_threads,
+            "load": self.batch_scheduler.get_load(),
+            **self.batch_scheduler.get_stats()
+        }
+
+
+class ReplicaPool:
+    """مجموعة نسخ الاستدلال مع توجيه كل طلب إلى النسخة الأقل حملاً"""
+
+    def __init__(self, model_manager, replicas: Optional[int] = None, threads: Optional[int] = None):
+        self.model_manager = model_manager
+        self.requested_replicas = replicas
+        self.requested_threads = threads
+        self.replicas: List[ModelReplica] = []
+        self.lock = threading.Lock()
+        self.dispatched = 0
+
+    def configure(self, max_batch_size: int = 4, sequence_length: int = 1024):
+        """إنشاء النسخ بعد تحميل النموذج من الأنوية المتاحة والذاكرة المتبقية"""
+        self.stop()
+
+        config = getattr(self.model_manager.model, 'config', None)
+        replica_memory = estimate_replica_memory_mb(config, max_batch_size, sequence_length) if config else 0
+        memory_available = self.model_manager.max_memory_mb - self.model_manager.get_memory_usage()
+
+        plan = plan_replicas(
+            detect_cpus(), memory_available, replica_memory,
+            replicas=self.requested_replicas, threads=self.requested_threads
+        )
+        with self.lock:
+            self.replicas = [
+                ModelReplica(self.model_manager, index, cpus, len(cpus), max_batch_size=max_batch_size)
+                for index, cpus in enumerate(plan)
+            ]
+        logger.info(
+            f"تم إعداد {len(plan)} نسخة استدلال (ذاكرة تقديرية لكل نسخة {replica_memory:.1f}MB)"
+        )
+
+    def submit(self, request: GenerationRequest) -> GenerationRequest:
+        """إرسال الطلب إلى النسخة الأقل حملاً"""
+        with self.lock:
+            if not self.replicas:
+                raise RuntimeError("لا توجد نسخ استدلال جاهزة")
+            replica = min(self.replicas, key=lambda r: r.batch_scheduler.get_load())
+            self.dispatched += 1
+        return replica.batch_scheduler.submit(request)
+
+    def stop(self):
+        """إيقاف جميع النسخ"""
+        with self.lock:
+            replicas, self.replicas = self.replicas, []
+        for replica in replicas:
+            replica.batch_scheduler.stop()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """إحصائيات المجموعة وكل نسخة"""
+        with self.lock:
+            replicas = list(self.replicas)
+        stats = [replica.get_stats() for replica in replicas]
+        return {
+            "replicas": len(replicas),
+            "available_cpus": len(detect_cpus()),
+            "dispatched_requests": self.dispatched,
+            "total_tokens": sum(s["total_tokens"] for s in stats),
+            "tokens_per_second": round(sum(s["tokens_per_second"] for s in stats), 2),
+            "replica_stats": stats
+        }
@@ -1,10 +1,17 @@
+import math
 import time
+import json
+import queue
 import logging
+import threading
 from datetime import datetime
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 from src.auth import require_api_key, admin_required
-from src.model_manager import model_manager
-from src.queue_manager import queue_manager
+from src.model_manager import model_manager, model_registry
+from src.queue_manager import queue_manager, QueueFullError
+from src.warmup import startup_report
+from src.admission import ADMISSION_ERROR_CODE
+from src.stopping import Deadline, GenerationCancelled
 from src.code_services import code_services
 from src.enhanced_services import enhanced_services
 from src.project_services import project_services
@@ -43,6 +50,128 @@ def measure_performance(endpoint_name):
         return wrapper
     return decorator
 
+def parameter_error(data, *parsers):
+    """رفض المعاملات غير الصالحة برمز 400 قبل التنفيذ
+
+    يُفحص deadline_ms دائماً (يجب أن يتجاوز نافذة تجميع الدفعة)، ثم محللات
+    الخدمة الإضافية التي ترفع ValueError للقيمة غير الصالحة.
+    """
+    for parse in (Deadline.from_data,) + parsers:
+        try:
+            parse(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    return None
+
+def admission_response(response, result):
+    """رمز الحالة عند رفض القبول: 503 مع Retry-After عند امتلاء الذاكرة، و 413 للطلب الأكبر من الميزانية"""
+    if result.get("error_code") != ADMISSION_ERROR_CODE:
+        return response
+    retry_after = result.get("retry_after")
+    if retry_after is None:
+        return response, 413
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response, 503
+
+# ===== المهام غير المتزامنة عبر الطابور =====
+
+# أقصى مدة للاستطلاع الطويل لحالة مهمة
+MAX_STATUS_WAIT_SECONDS = 60
+
+def wants_async(data):
+    """التحقق من طلب العميل للمعالجة غير المتزامنة"""
+    if data.get('async') is True:
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+def submit_async(endpoint, service_method, data, stream_tokens=True):
+    """إرسال الطلب إلى الطابور وإرجاع 202 مع معرف المهمة دون انتظار التوليد
+    
+    stream_tokens يتيح الرموز الجزئية عبر /v1/queue/events للخدمات التي تقبل on_token.
+    """
+    data = {key: value for key, value in data.items() if key != 'async'}
+    try:
+        task_id = queue_manager.submit_task(
+            endpoint, data, service_method,
+            api_key=getattr(request, 'api_key', None), stream_tokens=stream_tokens
+        )
+    except QueueFullError as e:
+        response = jsonify({"success": False, "error": str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 429 if e.tenant else 503
+    
+    status_url = f"{request.script_root}/api/v1/queue/status?task_id={task_id}"
+    response = jsonify({
+        "success": True,
+        "task_id": task_id,
+        "status": "pending",
+        "status_url": status_url,
+        "events_url": f"{request.script_root}/api/v1/queue/events?task_id={task_id}",
+        "timestamp": datetime.now().isoformat()
+    })
+    response.headers['Location'] = status_url
+    response.headers['Preference-Applied'] = 'respond-async'
+    return response, 202
+
+# ===== البث عبر Server-Sent Events =====
+
+def wants_stream(data):
+    """التحقق من طلب العميل لوضع البث"""
+    if data.get('stream') is True:
+        return True
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+def format_sse(event, payload):
+    """تنسيق حدث SSE واحد"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def stream_service(service_method, data):
+    """بث الرموز أثناء توليدها ثم إرسال النتيجة المعالجة كحدث أخير
+    
+    عند انقطاع العميل يُضبط علم الإلغاء فيرفع الرمز التالي GenerationCancelled
+    ويخرج التسلسل من دفعة المجدول بدلاً من إكمال التوليد دون مستمع.
+    """
+    events = queue.Queue()
+    cancelled = threading.Event()
+    
+    def on_token(text):
+        if cancelled.is_set():
+            raise GenerationCancelled("انقطع اتصال العميل أثناء البث")
+        events.put(("token", {"text": text}))
+    
+    def run_service():
+        try:
+            result = service_method(data, on_token=on_token)
+            events.put(("done", {
+                "success": result["success"],
+                "data": result,
+                "timestamp": datetime.now().isoformat()
+            }))
+        except Exception as e:
+            logger.error(f"خطأ أثناء البث: {str(e)}")
+            events.put(("error", {"error": str(e)}))
+        finally:
+            events.put(None)
+    
+    threading.Thread(target=run_service, daemon=True).start()
+    
+    def generate():
+        try:
+            while True:
+                item = events.get()
+                if item is None:
+                    break
+                event, payload = item
+                yield format_sse(event, payload)
+        finally:
+            # GeneratorExit عند إغلاق العميل للاتصال
+            cancelled.set()
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 # ===== نقاط الخدمات الأساسية =====
 
 @api_bp.route('/v1/completions', methods=['POST'])
@@ -55,15 +184,25 @@ def complete_code():
         if not data:
             return jsonify({"error": "بيانات JSON مطلوبة"}), 400
         
+        invalid = parameter_error(data, code_services.parse_sample_count)
+        if invalid:
+            return invalid
+        
+        if wants_stream(data):
+            return stream_service(code_services.complete_code, data)
+        
+        if wants_async(data):
+            return submit_async('completions', code_services.complete_code, data)
+        
         # معالجة متزامنة للطلبات البسيطة
         result = code_services.complete_code(data)
         
-        return jsonify({
+        return admission_response(jsonify({
             "success": result["success"],
             "data": result,
             "timestamp": datetime.now().isoformat(),
             "processing_time": performance_profiler.get_operation_stats('completions').get('avg_time', 0)
-        })
+        }), result)
         
     except Exception as e:
         logger.error(f"خطأ في إكمال الكود: {str(e)}")
@@ -79,13 +218,23 @@ def explain_code():
         if not data:
             return jsonify({"error": "بيانات JSON مطلوبة"}), 400
         
+        invalid = parameter_error(data)
+        if invalid:
+            return invalid
+        
+        if wants_stream(data):
+            return stream_service(code_services.explain_code, data)
+        
+        if wants_async(data):
+            return submit_async('explanations', code_services.explain_code, data)
+        
         result = code_services.explain_code(data)
         
-        return jsonify({
+        return admission_response(jsonify({
             "success": result["success"],
             "data": result,
             "timestamp": datetime.now().isoformat()
-        })
+        }), result)
         
     except Exception as e:
         logger.error(f"خطأ في شرح الكود: {str(e)}")
@@ -101,13 +250,23 @@ def convert_language():
         if not data:
             return jsonify({"error": "بيانات JSON مطلوبة"}), 400
         
+        invalid = parameter_error(data)
+        if invalid:
+            return invalid
+        
+        if wants_stream(data):
+            return stream_service(code_services.convert_language, data)
+        
+        if wants_async(data):
+            return submit_async('conversions', code_services.convert_language, data)
+        
         result = code_services.convert_language(data)
         
-        return jsonify({
+        return admission_response(jsonify({
             "success": result["success"],
             "data": result,
             "timestamp": datetime.now().isoformat()
-        })
+        }), result)
         
     except Exception as e:
         logger.error(f"خطأ في تحويل اللغة: {str(e)}")
@@ -123,13 +282,23 @@ def refactor_code():
         if not data:
             return jsonify({"error": "بيانات JSON مطلوبة"}), 400
         
+        invalid = parameter_error(data)
+        if invalid:
+            return invalid
+        
+        if wants_stream(data):
+            return stream_service(code_services.refactor_code, data)
+        
+        if wants_async(data):
+            return submit_async('refactors', code_services.refactor_code, data)
+        
         result = code_services.refactor_code(data)
         
-        return jsonify({
+        return admission_response(jsonify({
             "success": result["success"],
             "data": result,
             "timestamp": datetime.now().isoformat()
-        })
+        }), result)
         
     except Exception as e:
         logger.error(f"خطأ في إعادة الهيكلة: {str(e)}")
@@ -235,13 +404,23 @@ def explain_concept():
         if not data:
             return jsonify({"error": "بيانات JSON مطلوبة"}), 400
         
+        invalid = parameter_error(data)
+        if invalid:
+            return invalid
+        
+        if wants_stream(data):
+            return stream_service(enhanced_services.explain_concept, data)
+        
+        if wants_async(data):
+            return submit_async('explain_concept', enhanced_services.explain_concept, data)
+        
         result = enhanced_services.explain_concept(data)
         
-        return jsonify({
+        return admission_response(jsonify({
             "success": result["success"],
             "data": result,
             "timestamp": datetime.now().isoformat()
-        })
+        }), result)
         
     except Exception as e:
         logger.error(f"خطأ في شرح المفهوم: {str(e)}")
@@ -257,13 +436,23 @@ def simplify_code():
         if not data:
             return jsonify({"error": "بيانات JSON مطلوبة"}), 400
         
+        invalid = parameter_error(data)
+        if invalid:
+            return invalid
+        
+        if wants_stream(data):
+            return stream_service(enhanced_services.simplify_code, data)
+        
+        if wants_async(data):
+            return submit_async('simplify_code', enhanced_services.simplify_code, data)
+        
         result = enhanced_services.simplify_code(data)
         
-        return jsonify({
+        return admission_response(jsonify({
             "success": result["success"],
             "data": result,
             "timestamp": datetime.now().isoformat()
-        })
+        }), result)
         
     except Exception as e:
         logger.error(f"خطأ في تبسيط الكود: {str(e)}")
@@ -281,13 +470,16 @@ def create_snippet():
         if not data:
             return jsonify({"error": "بيانات JSON مطلوبة"}), 400
         
+        if wants_async(data):
+            return submit_async('create_snippet', project_services.create_snippet, data, stream_tokens=False)
+        
         result = project_services.create_snippet(data)
         
-        return jsonify({
+        return admission_response(jsonify({
             "success": result["success"],
             "data": result,
             "timestamp": datetime.now().isoformat()
-        })
+        }), result)
         
     except Exception as e:
         logger.error(f"خطأ في إنشاء المقطع: {str(e)}")
@@ -370,8 +562,18 @@ def get_queue_status():
         task_id = request.args.get('task_id')
         
         if task_id:
-            # حالة مهمة محددة
-            task_status = queue_manager.get_task_status(task_id)
+            # حالة مهمة محددة، مع انتظار انتهائها حتى wait ثانية (استطلاع طويل)
+            if not queue_manager.is_task_owner(task_id, request.api_key):
+                return jsonify({"error": "المهمة غير موجودة"}), 404
+            try:
+                wait = min(max(float(request.args.get('wait', 0)), 0), MAX_STATUS_WAIT_SECONDS)
+            except ValueError:
+                return jsonify({"error": "wait يجب أن يكون عدداً من الثواني"}), 400
+            
+            if wait > 0:
+                task_status = queue_manager.wait_for_task(task_id, wait)
+            else:
+                task_status = queue_manager.get_task_status(task_id)
             if not task_status:
                 return jsonify({"error": "المهمة غير موجودة"}), 404
             
@@ -393,6 +595,35 @@ def get_queue_status():
         logger.error(f"خطأ في الحصول على حالة الطابور: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@api_bp.route('/v1/queue/events', methods=['GET'])
+@require_api_key
+@measure_performance('queue_events')
+def get_task_events():
+    """بث تقدم مهمة عبر Server-Sent Events بدلاً من الاستطلاع المتكرر"""
+    try:
+        task_id = request.args.get('task_id')
+        if not task_id:
+            return jsonify({"error": "task_id مطلوب"}), 400
+        if not queue_manager.is_task_owner(task_id, request.api_key):
+            return jsonify({"error": "المهمة غير موجودة"}), 404
+        
+        def generate():
+            for item in queue_manager.task_events(task_id):
+                if item is None:
+                    yield ": keepalive\n\n"
+                    continue
+                event, payload = item
+                yield format_sse(event, payload)
+        
+        return Response(generate(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        
+    except Exception as e:
+        logger.error(f"خطأ في بث أحداث المهمة: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @api_bp.route('/v1/queue/cancel', methods=['POST'])
 @require_api_key
 @measure_performance('queue_cancel')
@@ -404,7 +635,7 @@ def cancel_task():
             return jsonify({"error": "task_id مطلوب"}), 400
         
         task_id = data['task_id']
-        cancelled = queue_manager.cancel_task(task_id)
+        cancelled = queue_manager.is_task_owner(task_id, request.api_key) and queue_manager.cancel_task(task_id)
         
         if cancelled:
             return jsonify({
@@ -472,6 +703,7 @@ def get_performance_stats():
         return jsonify({
             "success": True,
             "performance": performance_data,
+            "generation_cache": model_registry.response_cache_stats(),
             "timestamp": datetime.now().isoformat()
         })
         
@@ -520,6 +752,30 @@ def get_security_stats():
         logger.error(f"خطأ في الحصول على إحصائيات الأمان: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@api_bp.route('/v1/admin/backends/compare', methods=['POST'])
+@require_api_key
+@admin_required
+@measure_performance('admin_backends_compare')
+def compare_backends():
+    """مقارنة الواجهات الخلفية للاستدلال على نفس الـ prompts"""
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        comparison = model_manager.compare_backends(
+            prompts=data.get('prompts'),
+            max_new_tokens=int(data.get('max_new_tokens', 32))
+        )
+        
+        return jsonify({
+            "success": True,
+            "comparison": comparison,
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"خطأ في مقارنة الواجهات الخلفية: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 # ===== نقاط المساعدة =====
 
 @api_bp.route('/v1/info', methods=['GET'])
@@ -578,6 +834,13 @@ def get_model_status():
         return jsonify({
             "success": True,
             "model": model_status,
+            "registry": model_registry.get_stats(),
+            "startup": startup_report.get_stats(),
+            "models": {
+                name: manager.get_model_status()
+                for name, manager in model_registry.models.items()
+                if name != model_registry.default_name
+            },
             "timestamp": datetime.now().isoformat()
         })
         
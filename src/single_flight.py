@@ -0,0 +1,82 @@
+import threading
+import logging
+from typing import Dict, Any, Callable, Hashable, Optional
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """عملية جارية يشترك في نتيجتها عدة مستدعين"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """دمج الاستدعاءات المتطابقة المتزامنة في تنفيذ واحد
+
+    أول مستدعٍ لمفتاح معين ينفذ الدالة، وينتظر المستدعون المتطابقون خلال
+    التنفيذ النتيجة نفسها أو الاستثناء نفسه. يُحذف المفتاح فور الانتهاء
+    فلا تُخزَّن النتيجة بعد ذلك. لا مهلة ولا إلغاء لكل منتظر: الطلبات التي
+    قد تُقطع لكل مستدعٍ (البث والمهلة) لا تمر بهذه الطبقة.
+    """
+
+    def __init__(self):
+        self.calls: Dict[Hashable, _Call] = {}
+        self.lock = threading.Lock()
+
+        # إحصائيات
+        self.executed = 0
+        self.deduplicated = 0
+        self.failed = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """تنفيذ fn مرة واحدة لكل مفتاح بين المستدعين المتزامنين"""
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = _Call()
+                self.calls[key] = call
+                self.executed += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.deduplicated += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            with self.lock:
+                self.failed += 1
+            raise
+        finally:
+            # إزالة المفتاح قبل إيقاظ المنتظرين حتى تبدأ الطلبات اللاحقة تنفيذاً جديداً
+            with self.lock:
+                self.calls.pop(key, None)
+            call.done.set()
+            if call.waiters:
+                logger.info(f"تمت مشاركة نتيجة توليد واحدة مع {call.waiters} طلب متطابق")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """الحصول على إحصائيات الدمج"""
+        with self.lock:
+            return {
+                "in_flight": len(self.calls),
+                "executed": self.executed,
+                "generations_saved": self.deduplicated,
+                "failed": self.failed
+            }
@@ -0,0 +1,216 @@
+import time
+import threading
+import logging
+from collections import defaultdict
+from typing import Dict, Any, List
+
+import torch
+
+from src.batch_scheduler import GenerationRequest, process_logits
+from src.prefix_cache import common_prefix_length, slice_cache
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeState:
+    """حالة تسلسل واحد أثناء فك الترميز التخميني"""
+
+    def __init__(self, request: GenerationRequest):
+        self.request = request
+        # جميع الرموز (الإدخال + المولد)؛ آخر رمز لم يُمرر بعد لأي نموذج
+        self.tokens = list(request.input_ids)
+        self.target_past = None
+        self.target_len = 0
+        self.draft_past = None
+        self.draft_len = 0
+
+
+class SpeculativeDecoder:
+    """فك الترميز التخميني باستخدام نموذج مسودة صغير
+
+    يقترح نموذج المسودة عدة رموز ثم يتحقق منها النموذج الرئيسي في تمرير
+    واحد. القبول يتبع خوارزمية أخذ العينات التخميني (قبول بنسبة p/q وإعادة
+    أخذ العينة من الفرق عند الرفض) فيبقى توزيع المخرجات مطابقاً للنموذج
+    الرئيسي، وفي الوضع الحتمي تطابق النتيجة فك الترميز الجشع تماماً.
+    """
+
+    def __init__(self, scheduler, num_draft_tokens=4):
+        self.scheduler = scheduler
+        self.num_draft_tokens = num_draft_tokens
+        self.draft_seq_dim = None
+        self.lock = threading.Lock()
+        self.endpoint_stats = defaultdict(lambda: {
+            "requests": 0,
+            "rounds": 0,
+            "drafted": 0,
+            "accepted": 0,
+            "tokens": 0,
+            "time": 0.0
+        })
+
+    @property
+    def model_manager(self):
+        return self.scheduler.model_manager
+
+    def start(self, request: GenerationRequest) -> SpeculativeState:
+        """ترميز الـ prompt بالنموذج الرئيسي واختيار أول رمز"""
+        scheduler = self.scheduler
+        state = SpeculativeState(request)
+
+        prefix_length, prefix_past = (0, None)
+        if scheduler.kv_seq_dim is not None:
+            prefix_length, prefix_past = self.model_manager.prefix_cache.lookup(
+                request.input_ids, scheduler.kv_seq_dim
+            )
+
+        logits, past = scheduler.forward_single(
+            self.model_manager.model, request.input_ids[prefix_length:], prefix_past, prefix_length
+        )
+        if scheduler.kv_seq_dim is None:
+            scheduler.kv_seq_dim = scheduler.detect_seq_dim(past, len(request.input_ids))
+        self.model_manager.prefix_cache.store(request.input_ids, past, scheduler.kv_seq_dim)
+
+        state.target_past = past
+        state.target_len = len(request.input_ids)
+
+        first_token = int(scheduler._sample(logits[-1:], [request])[0])
+        self._append(state, [first_token])
+
+        with self.lock:
+            self.endpoint_stats[request.endpoint]["requests"] += 1
+        return state
+
+    def step(self, state: SpeculativeState) -> bool:
+        """تنفيذ جولة اقتراح وتحقق واحدة، ويرجع True عند اكتمال الطلب"""
+        round_start = time.time()
+        request = state.request
+        scheduler = self.scheduler
+        remaining = request.max_new_tokens - len(request.generated_ids)
+        num_draft = max(1, min(self.num_draft_tokens, remaining))
+        vocab_size = self._vocab_size()
+
+        # 1. اقتراح الرموز بنموذج المسودة
+        draft_tokens: List[int] = []
+        draft_probs: List[torch.Tensor] = []
+        context = list(state.tokens)
+        feed = state.tokens[state.draft_len:]
+        draft_past = state.draft_past
+        for _ in range(num_draft):
+            logits, draft_past = scheduler.forward_single(
+                self.model_manager.draft_model, feed, draft_past, len(context) - len(feed)
+            )
+            probs = self._probabilities(logits[-1, :vocab_size], context, request)
+            token = int(probs.argmax()) if not request.do_sample else int(torch.multinomial(probs, 1))
+            draft_tokens.append(token)
+            draft_probs.append(probs)
+            context.append(token)
+            feed = [token]
+        state.draft_past = draft_past
+        state.draft_len = len(context) - 1
+        if self.draft_seq_dim is None:
+            self.draft_seq_dim = scheduler.detect_seq_dim(draft_past, state.draft_len)
+
+        # 2. التحقق من جميع الرموز المقترحة بتمرير واحد للنموذج الرئيسي
+        pending = state.tokens[state.target_len:]
+        target_logits, target_past = scheduler.forward_single(
+            self.model_manager.model, pending + draft_tokens, state.target_past, state.target_len
+        )
+        offset = len(pending) - 1
+
+        # 3. قبول أو رفض الرموز المقترحة
+        accepted: List[int] = []
+        context = list(state.tokens)
+        for i, token in enumerate(draft_tokens):
+            target_probs = self._probabilities(target_logits[offset + i, :vocab_size], context, request)
+            if not request.do_sample:
+                choice = int(target_probs.argmax())
+                accepted.append(choice)
+                if choice != token:
+                    break
+            else:
+                draft_prob = draft_probs[i][token]
+                if torch.rand(1).item() * draft_prob <= target_probs[token]:
+                    accepted.append(token)
+                else:
+                    residual = torch.clamp(target_probs - draft_probs[i], min=0)
+                    if residual.sum() <= 0:
+                        residual = target_probs
+                    accepted.append(int(torch.multinomial(residual / residual.sum(), 1)))
+                    break
+            context.append(token)
+        else:
+            # قبول جميع الرموز يمنح رمزاً إضافياً من آخر موضع
+            target_probs = self._probabilities(target_logits[offset + num_draft, :vocab_size], context, request)
+            bonus = int(target_probs.argmax()) if not request.do_sample else int(torch.multinomial(target_probs, 1))
+            accepted.append(bonus)
+
+        proposed_sequence = state.tokens + draft_tokens
+        appended = self._append(state, accepted)
+
+        # 4. التراجع في ذاكرتي KV إلى آخر موضع صالح
+        valid = min(common_prefix_length(proposed_sequence, state.tokens), len(state.tokens) - 1)
+        seq_dim = scheduler.kv_seq_dim
+        state.target_past = slice_cache(target_past, valid, seq_dim)
+        state.target_len = valid
+        draft_valid = min(state.draft_len, valid)
+        state.draft_past = slice_cache(state.draft_past, draft_valid, self.draft_seq_dim)
+        state.draft_len = draft_valid
+
+        matched = sum(1 for a, b in zip(accepted, draft_tokens) if a == b)
+        with self.lock:
+            stats = self.endpoint_stats[request.endpoint]
+            stats["rounds"] += 1
+            stats["drafted"] += num_draft
+            stats["accepted"] += min(matched, appended)
+            stats["tokens"] += appended
+            stats["time"] += time.time() - round_start
+
+        return scheduler._is_finished(request)
+
+    def _append(self, state: SpeculativeState, tokens: List[int]) -> int:
+        """إضافة الرموز المقبولة حتى اكتمال الطلب"""
+        appended = 0
+        for token in tokens:
+            state.request.append_token(token)
+            state.tokens.append(token)
+            self.scheduler.total_tokens += 1
+            appended += 1
+            if self.scheduler._is_finished(state.request):
+                break
+        return appended
+
+    def _probabilities(self, logits: torch.Tensor, context: List[int], request: GenerationRequest) -> torch.Tensor:
+        """توزيع الرمز التالي بعد تطبيق معاملات الطلب"""
+        processed = process_logits(
+            logits.unsqueeze(0), [context], [request.temperature],
+            [request.repetition_penalty], self.scheduler.top_k
+        )
+        return torch.softmax(processed, dim=-1)[0]
+
+    def _vocab_size(self) -> int:
+        """حجم المفردات المشترك بين النموذجين"""
+        return min(
+            self.model_manager.model.config.vocab_size,
+            self.model_manager.draft_model.config.vocab_size
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """إحصائيات القبول والتسريع لكل نقطة"""
+        baseline = self.scheduler.single_step_time
+        with self.lock:
+            stats = {}
+            for endpoint, data in self.endpoint_stats.items():
+                ms_per_token = data["time"] / data["tokens"] * 1000 if data["tokens"] else 0
+                stats[endpoint] = {
+                    "requests": data["requests"],
+                    "rounds": data["rounds"],
+                    "drafted_tokens": data["drafted"],
+                    "accepted_tokens": data["accepted"],
+                    "acceptance_rate": round(data["accepted"] / data["drafted"] * 100, 2) if data["drafted"] else 0,
+                    "tokens_per_round": round(data["tokens"] / data["rounds"], 2) if data["rounds"] else 0,
+                    "ms_per_token": round(ms_per_token, 2),
+                    "speedup": round(baseline * 1000 / ms_per_token, 2) if baseline and ms_per_token else None
+                }
+            return stats
@@ -0,0 +1,257 @@
+import re
+import ast
+import time
+import threading
+import logging
+from collections import defaultdict
+from typing import Dict, Any, List, Optional, Tuple
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CODE_FENCE = "```"
+
+# سلاسل الإيقاف الشائعة لإكمال الكود
+CODE_STOP_STRINGS = [CODE_FENCE, "\ndef ", "\nclass "]
+
+# سطر فارغ يليه سطر يبدأ من العمود الأول (نهاية الكتلة الحالية)
+BLANK_LINE_DEDENT = re.compile(r'\n[ \t]*\n(?=\S)')
+
+# كلمات تكمل كتلة سابقة ولا تعني نهايتها
+CONTINUATION_KEYWORDS = ('else', 'elif', 'except', 'finally', 'case')
+IDENTIFIER = re.compile(r'[A-Za-z_]\w*')
+
+# نافذة تجميع الطلبات في مجدول الدفعات (ms)؛ المهلة التي لا تتجاوزها تنقضي قبل الترميز الأولي
+BATCH_WINDOW_MS = 20
+
+
+class DeadlineExceeded(TimeoutError):
+    """انتهاء مهلة الطلب قبل بدء التوليد"""
+
+
+class GenerationCancelled(Exception):
+    """إلغاء الطلب بعد انقطاع العميل (مثل إغلاق اتصال البث)"""
+
+
+class Deadline:
+    """موعد نهائي لطلب توليد يُفحص كمعيار إيقاف زمني بعد كل خطوة فك ترميز"""
+
+    def __init__(self, deadline_ms: float):
+        self.deadline_ms = deadline_ms
+        self.expires_at = time.time() + deadline_ms / 1000
+
+    @classmethod
+    def from_data(cls, data: Dict[str, Any]) -> Optional['Deadline']:
+        """إنشاء الموعد من الحقل الاختياري deadline_ms في بيانات الطلب"""
+        value = data.get('deadline_ms')
+        if value is None:
+            return None
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError("deadline_ms يجب أن يكون رقماً")
+        if value <= BATCH_WINDOW_MS:
+            raise ValueError(f"deadline_ms يجب أن يكون أكبر من نافذة تجميع الدفعة ({BATCH_WINDOW_MS}ms)")
+        return cls(value)
+
+    def expired(self) -> bool:
+        """التحقق من انقضاء الموعد"""
+        return time.time() >= self.expires_at
+
+    def remaining_ms(self) -> float:
+        """الوقت المتبقي بالميلي ثانية"""
+        return max(0.0, (self.expires_at - time.time()) * 1000)
+
+
+class StoppingCriteria:
+    """معايير إيقاف التوليد مبكراً لطلب واحد
+
+    تُفك رموز الطلب تدريجياً ويُفحص النص الناتج بعد كل رمز: سلاسل الإيقاف،
+    وسطر فارغ يليه تراجع في المسافة البادئة، واكتمال صياغة كود Python عبر
+    ast، وحد أقصى لعدد الرموز. يُقتطع النص النهائي عند موضع الإيقاف.
+    """
+
+    def __init__(self, stop_strings: Optional[List[str]] = None, blank_line_dedent: bool = False,
+                 python_code: Optional[str] = None, token_budget: Optional[int] = None):
+        self.stop_strings = list(stop_strings or [])
+        self.blank_line_dedent = blank_line_dedent
+        self.python_code = python_code
+        self.token_budget = token_budget
+        self.python_base_indent = self._base_indent(python_code) if python_code is not None else 0
+
+        self.tokenizer = None
+        self.text = ""
+        self.seen_tokens = 0
+        self.prefix_offset = 0
+        self.read_offset = 0
+        self.checked_lines = 1
+        self.stop_position: Optional[int] = None
+        self.reason: Optional[str] = None
+
+    def signature(self) -> Tuple:
+        """وصف ثابت للمعايير يُضاف إلى مفتاح الذاكرة المؤقتة"""
+        return (
+            tuple(self.stop_strings), self.blank_line_dedent,
+            self.python_code is not None, self.token_budget
+        )
+
+    def clone(self) -> 'StoppingCriteria':
+        """نسخة جديدة بنفس الإعدادات وحالة فارغة (لكل عينة من عينات الطلب)"""
+        return StoppingCriteria(self.stop_strings, self.blank_line_dedent, self.python_code, self.token_budget)
+
+    def bind(self, tokenizer):
+        """ربط المحلل اللغوي المستخدم لفك ترميز الرموز المولدة"""
+        self.tokenizer = tokenizer
+
+    @staticmethod
+    def _base_indent(code: str) -> int:
+        """المسافة البادئة التي يعني الرجوع إليها انتهاء الكتلة الجاري إكمالها"""
+        lines = [line for line in code.split('\n') if line.strip()]
+        if not lines:
+            return 0
+        last = lines[-1]
+        if last.rstrip().endswith(':'):
+            return len(last) - len(last.lstrip())
+        return 0
+
+    def check(self, token_ids: List[int]) -> bool:
+        """فحص الرموز الجديدة ويرجع True عند تحقق أحد معايير الإيقاف"""
+        if self.reason is not None:
+            return True
+
+        if self.token_budget is not None and len(token_ids) >= self.token_budget:
+            self.reason = "token_budget"
+            return True
+
+        if self.tokenizer is None or len(token_ids) <= self.seen_tokens:
+            return False
+        self.seen_tokens = len(token_ids)
+
+        # فك ترميز نافذة صغيرة فقط مع تأجيل الأحرف غير المكتملة
+        prefix_text = self.tokenizer.decode(token_ids[self.prefix_offset:self.read_offset], skip_special_tokens=True)
+        new_text = self.tokenizer.decode(token_ids[self.prefix_offset:], skip_special_tokens=True)
+        if len(new_text) <= len(prefix_text):
+            return False
+        # حرف UTF-8 لا يمتد على أكثر من أربعة رموز، فلا داعي لتأجيل أطول من ذلك
+        if new_text.endswith('\ufffd') and len(token_ids) - self.read_offset < 4:
+            return False
+        self.text += new_text[len(prefix_text):]
+        self.prefix_offset = self.read_offset
+        self.read_offset = len(token_ids)
+
+        position, reason = self.find_stop(self.text)
+        if position is not None:
+            self.stop_position = position
+            self.reason = reason
+            return True
+        return False
+
+    def find_stop(self, text: str) -> Tuple[Optional[int], Optional[str]]:
+        """أول موضع إيقاف في النص مع سببه"""
+        candidates = []
+
+        for stop in self.stop_strings:
+            start = 0
+            # سياج الكود الأول في بداية النص هو سياج الفتح
+            if stop == CODE_FENCE and text.lstrip().startswith(CODE_FENCE):
+                start = text.index(CODE_FENCE) + len(CODE_FENCE)
+            index = text.find(stop, start)
+            if index != -1:
+                candidates.append((index, "stop_string"))
+
+        if self.blank_line_dedent:
+            match = BLANK_LINE_DEDENT.search(text)
+            if match and text[:match.start()].strip():
+                candidates.append((match.start(), "blank_line_dedent"))
+
+        if self.python_code is not None:
+            index = self._python_block_end(text)
+            if index is not None:
+                candidates.append((index, "syntax_complete"))
+
+        if not candidates:
+            return None, None
+        return min(candidates)
+
+    def _python_block_end(self, text: str) -> Optional[int]:
+        """موضع أول سطر يتراجع عن الكتلة بعد أن يصبح الكود صالح الصياغة"""
+        lines = text.split('\n')
+        # السطر الأول يكمل آخر سطر في الكود، والأخير قد يكون غير مكتمل
+        for i in range(self.checked_lines, len(lines)):
+            line = lines[i]
+            stripped = line.lstrip()
+            if not stripped or len(line) - len(stripped) > self.python_base_indent:
+                continue
+
+            # في السطر غير المكتمل ننتظر اكتمال الكلمة الأولى لمعرفة إن كانت else وأمثالها
+            word = IDENTIFIER.match(stripped)
+            if i == len(lines) - 1 and word and word.end() == len(stripped):
+                continue
+            if word and word.group() in CONTINUATION_KEYWORDS:
+                continue
+
+            body = '\n'.join(lines[:i])
+            if not body.strip():
+                continue
+            try:
+                ast.parse(self.python_code + body)
+            except SyntaxError:
+                continue
+            return len(body)
+
+        self.checked_lines = max(1, len(lines) - 1)
+        return None
+
+    def truncate(self, text: str) -> str:
+        """النص المولد حتى موضع الإيقاف (أو النص كما هو إن لم يُقتطع)"""
+        if self.stop_position is None:
+            return text
+        return self.text[:self.stop_position]
+
+
+class StoppingStats:
+    """إحصائيات الإيقاف المبكر والرموز الموفرة لكل نقطة"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = defaultdict(lambda: {
+            "requests": 0,
+            "early_stops": 0,
+            "tokens_generated": 0,
+            "tokens_saved": 0,
+            "reasons": defaultdict(int)
+        })
+
+    def record(self, endpoint: str, criteria: Optional[StoppingCriteria], generated: int, max_new_tokens: int,
+               deadline_hit: bool = False):
+        """تسجيل نتيجة طلب مكتمل"""
+        with self.lock:
+            stats = self.endpoints[endpoint or "default"]
+            stats["requests"] += 1
+            stats["tokens_generated"] += generated
+            if deadline_hit:
+                stats["early_stops"] += 1
+                stats["reasons"]["deadline"] += 1
+            elif criteria is not None and criteria.reason is not None:
+                stats["early_stops"] += 1
+                stats["tokens_saved"] += max(0, max_new_tokens - generated)
+                stats["reasons"][criteria.reason] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """الحصول على الإحصائيات"""
+        with self.lock:
+            return {
+                endpoint: {
+                    "requests": data["requests"],
+                    "early_stops": data["early_stops"],
+                    "tokens_generated": data["tokens_generated"],
+                    "tokens_saved": data["tokens_saved"],
+                    "reasons": dict(data["reasons"])
+                }
+                for endpoint, data in self.endpoints.items()
+            }
+
+
+# إنشاء مثيل عام لإحصائيات الإيقاف
+stopping_stats = StoppingStats()
@@ -0,0 +1,114 @@
+import re
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Tuple
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# حدود الكتل: بعد سطر جديد منفرد يسبقه ويليه حرف غير فارغ. المقسم المسبق
+# (pre-tokenizer) بأسلوب GPT-2 يفصل عنده دائماً، أما بعد سطر فارغ فيضم الأسطر
+# الجديدة المتتالية في رمز واحد (ĊĊ) فلا يصلح حداً
+BLOCK_BOUNDARY = re.compile(r'(?<=\S\n)(?=\S)')
+
+# نص فحص لكل محلل لغوي: إن لم يطابق ترميز كتله ترميزه كاملاً يُرمز الـ prompt كاملاً
+BOUNDARY_PROBE = "import os\nimport sys\n\n\ndef f(x):\n    \n    return x  \n\nclass A:\n  pass\n# 12345\nz = 1\n"
+
+# الكتل الأطول من ذلك تُرمَّز دون تخزين
+MAX_CACHED_CHARS = 8192
+
+
+class TokenCache:
+    """ذاكرة LRU مؤقتة لترميز أجزاء الـ prompts
+
+    يُقسم الـ prompt إلى قالب وكتل كود عند حدود الأسطر العليا وتُرمَّز كل
+    كتلة مرة واحدة، فتتكرر القوالب الثابتة وكتل الكود نفسها (مثل الاستيرادات
+    والدوال السابقة للمؤشر) بين الطلبات دون إعادة ترميز.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Tuple[int, ...]]" = OrderedDict()
+        self.lock = threading.Lock()
+        # نتيجة فحص حدود الكتل لكل محلل لغوي: id(tokenizer) -> bool
+        self.block_safe: Dict[int, bool] = {}
+
+        # إحصائيات
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def encode(self, tokenizer, text: str) -> List[int]:
+        """ترميز جزء نصي دون رموز خاصة مع التخزين"""
+        if not text:
+            return []
+        if len(text) > MAX_CACHED_CHARS:
+            return tokenizer.encode(text, add_special_tokens=False)
+
+        with self.lock:
+            ids = self.entries.get(text)
+            if ids is not None:
+                self.entries.move_to_end(text)
+                self.hits += 1
+                return list(ids)
+            self.misses += 1
+
+        ids = tokenizer.encode(text, add_special_tokens=False)
+        with self.lock:
+            self.entries[text] = tuple(ids)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return ids
+
+    def _blocks_match(self, tokenizer) -> bool:
+        """التحقق (مرة لكل محلل لغوي) من أن ترميز الكتل يطابق الترميز الكامل"""
+        key = id(tokenizer)
+        safe = self.block_safe.get(key)
+        if safe is None:
+            blocks: List[int] = []
+            for block in BLOCK_BOUNDARY.split(BOUNDARY_PROBE):
+                blocks.extend(tokenizer.encode(block, add_special_tokens=False))
+            safe = blocks == tokenizer.encode(BOUNDARY_PROBE, add_special_tokens=False)
+            if not safe:
+                logger.warning("المحلل اللغوي لا يفصل عند حدود الأسطر، ترميز الـ prompts كاملة دون تقسيم")
+            with self.lock:
+                self.block_safe[key] = safe
+        return safe
+
+    def encode_prompt(self, tokenizer, prompt: str) -> List[int]:
+        """ترميز الـ prompt كتلةً كتلة (أو كاملاً) مع إضافة الرموز الخاصة للنموذج
+
+        الناتج يطابق tokenizer.encode للنص كاملاً رمزاً برمز.
+        """
+        if not self._blocks_match(tokenizer):
+            return tokenizer.build_inputs_with_special_tokens(self.encode(tokenizer, prompt))
+        ids: List[int] = []
+        for block in BLOCK_BOUNDARY.split(prompt):
+            ids.extend(self.encode(tokenizer, block))
+        return tokenizer.build_inputs_with_special_tokens(ids)
+
+    def count(self, tokenizer, text: str) -> int:
+        """عدد رموز النص"""
+        return len(self.encode(tokenizer, text))
+
+    def clear(self):
+        """مسح جميع المدخلات (عند تفريغ النموذج أو تغيير المحلل اللغوي)"""
+        with self.lock:
+            self.entries.clear()
+            self.block_safe.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """الحصول على إحصائيات الذاكرة المؤقتة"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0,
+                "evictions": self.evictions
+            }
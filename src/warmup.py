@@ -0,0 +1,208 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+import torch
+
+# إعداد نظام السجلات
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# أوضاع تحسين الاستدلال: none (no_grad)، أو inference_mode، أو compile (torch.compile مع inference_mode)
+OPTIMIZATION_MODES = ["none", "inference_mode", "compile"]
+
+# مسار ذاكرة ترجمة torch.compile على القرص (تُعاد بين عمليات النشر)
+COMPILE_CACHE_DIR = os.getenv('COMPILE_CACHE_DIR', '/app/data/compile_cache')
+
+# طلبات تمثيلية لكل قالب خدمة: (الخدمة، الدالة، البيانات)
+WARMUP_REQUESTS: List[Tuple[str, str, Dict[str, Any]]] = [
+    ("completions", "complete_code", {"code": "def add(a, b):\n    ", "lang": "python"}),
+    ("explanations", "explain_code", {"code": "for i in range(3):\n    print(i)", "lang": "python"}),
+    ("conversions", "convert_language", {"code": "x = [i * 2 for i in range(5)]", "from": "python", "to": "javascript"}),
+    ("refactors", "refactor_code", {"code": "if x == True:\n    y = 1", "lang": "python"}),
+    ("explain_concept", "explain_concept", {"concept": "recursion", "lang": "python"}),
+    ("simplify_code", "simplify_code", {"code": "result = list(map(lambda v: v + 1, values))", "lang": "python"}),
+]
+
+
+def grad_context(mode: str):
+    """سياق تعطيل التدرج المناسب لوضع التحسين"""
+    return torch.inference_mode if mode in ("inference_mode", "compile") else torch.no_grad
+
+
+def compile_model(model, cache_dir: str = COMPILE_CACHE_DIR):
+    """تغليف النموذج بـ torch.compile مع ذاكرة ترجمة على القرص
+
+    الترجمة الفعلية تحدث مع أول استدعاء (أثناء الإحماء)، ويُرجع النموذج كما هو
+    إن لم يكن nn.Module (مثل ONNX) أو تعذرت الترجمة.
+    """
+    if not isinstance(model, torch.nn.Module) or not hasattr(torch, 'compile'):
+        logger.warning("torch.compile غير متاح لهذه الواجهة الخلفية، الاستمرار دون ترجمة")
+        return model
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', cache_dir)
+        os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+        return torch.compile(model, dynamic=True)
+    except Exception as e:
+        logger.error(f"خطأ في ترجمة النموذج، الاستمرار دون ترجمة: {str(e)}")
+        return model
+
+
+def uncompiled(model):
+    """النموذج الأصلي من داخل غلاف torch.compile"""
+    return getattr(model, '_orig_mod', model)
+
+
+class StartupReport:
+    """توقيتات مراحل الإقلاع وحالة الجاهزية
+
+    لا تُعلن الجاهزية إلا بعد تحميل النموذج وإحمائه حتى لا يدفع أول طلب حقيقي
+    تكلفة تهيئة الأنوية ونمو الذاكرة والترجمة.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.ready_at: Optional[float] = None
+        self.status = "starting"
+        self.phases: "OrderedDict[str, float]" = OrderedDict()
+        self.warmup: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """قياس مدة مرحلة إقلاع وتسجيلها"""
+        with self.lock:
+            self.status = name
+        start = time.time()
+        try:
+            yield
+        finally:
+            duration_ms = (time.time() - start) * 1000
+            with self.lock:
+                self.phases[name] = round(duration_ms, 1)
+            logger.info(f"مرحلة الإقلاع {name}: {duration_ms:.0f}ms")
+
+    def mark_ready(self, error: Optional[str] = None):
+        """إعلان الجاهزية (حتى عند فشل الإحماء يُقدَّم الطلب بدون إحماء)"""
+        with self.lock:
+            self.ready_at = time.time()
+            self.status = "ready"
+            self.error = error
+        logger.info(f"الخادم جاهز بعد {self.ready_at - self.started_at:.2f} ثانية من الإقلاع")
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """الحصول على حالة الإقلاع وتوقيتاته"""
+        with self.lock:
+            return {
+                "ready": self.ready_at is not None,
+                "status": self.status,
+                "time_to_ready_seconds": round(self.ready_at - self.started_at, 2) if self.ready_at else None,
+                "phases_ms": dict(self.phases),
+                "warmup": dict(self.warmup),
+                "error": self.error
+            }
+
+
+class ModelWarmup:
+    """تشغيل طلبات تمثيلية لكل قالب خدمة قبل إعلان الجاهزية
+
+    تمر الطلبات بالمسار الكامل (التعبئة وذاكرة الترميز والنسخ ومعايير الإيقاف)
+    دون تخزين النتائج، وتُرسل بالتوازي بعدد النسخ حتى تُحمى كل نسخة.
+    """
+
+    def __init__(self, report: StartupReport, rounds: int = 2, deadline_ms: int = 3000):
+        self.report = report
+        self.rounds = rounds
+        self.deadline_ms = deadline_ms
+
+    def _services(self) -> Dict[str, Any]:
+        """خدمات التوليد (تُستورد عند الحاجة لتجنب الاستيراد الدائري)"""
+        from src.code_services import code_services
+        from src.enhanced_services import enhanced_services
+        return {
+            "complete_code": code_services.complete_code,
+            "explain_code": code_services.explain_code,
+            "convert_language": code_services.convert_language,
+            "refactor_code": code_services.refactor_code,
+            "explain_concept": enhanced_services.explain_concept,
+            "simplify_code": enhanced_services.simplify_code
+        }
+
+    def run(self, model_registry) -> Dict[str, Any]:
+        """إحماء كل خدمة وتسجيل زمن كل جولة"""
+        services = self._services()
+        results = {}
+
+        for endpoint, method, data in WARMUP_REQUESTS:
+            manager = model_registry.route(endpoint)
+            if not manager.model_loaded:
+                continue
+            if manager.inference_client is not None:
+                # النسخ والترجمة في عملية الاستدلال، وهي تحمي نفسها قبل قبول الاتصالات
+                results[endpoint] = {"skipped": "inference_server"}
+                continue
+            replicas = max(1, len(manager.replica_pool.replicas))
+            request_data = dict(data, cache=False, deadline_ms=self.deadline_ms)
+
+            timings = []
+            for _ in range(self.rounds):
+                start = time.time()
+                errors = self._run_parallel(services[method], request_data, replicas)
+                timings.append(round((time.time() - start) * 1000, 1))
+                if errors:
+                    results[endpoint] = {"error": errors[0], "rounds_ms": timings}
+                    break
+            else:
+                results[endpoint] = {"rounds_ms": timings, "replicas": replicas}
+
+            logger.info(f"إحماء {endpoint}: {timings}ms")
+            with self.report.lock:
+                self.report.warmup[endpoint] = results[endpoint]
+        return results
+
+    @staticmethod
+    def _run_parallel(service, data: Dict[str, Any], count: int) -> List[str]:
+        """تشغيل الطلب نفسه بالتوازي وإرجاع الأخطاء إن وجدت"""
+        errors = []
+
+        def call():
+            result = service(data)
+            if not result.get("success"):
+                errors.append(result.get("error", "فشل الإحماء"))
+
+        threads = [threading.Thread(target=call, daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+
+def warm_up(model_registry, report: StartupReport, rounds: int = 2) -> Dict[str, Any]:
+    """إحماء النماذج المحلية مع الرجوع للنموذج غير المترجم عند فشل الترجمة"""
+    warmup = ModelWarmup(report, rounds=rounds)
+    with report.phase("warmup"):
+        results = warmup.run(model_registry)
+
+    # فشل الترجمة يظهر مع أول استدعاء: الرجوع للنموذج غير المترجم وإعادة الإحماء
+    manager = model_registry.default
+    if (manager.optimization == 'compile' and manager.inference_client is None
+            and any('error' in r for r in results.values())):
+        manager.disable_compile()
+        with report.phase("warmup_uncompiled"):
+            results = warmup.run(model_registry)
+    return results
+
+
+# إنشاء مثيل عام لتقرير الإقلاع
+startup_report = StartupReport()
@@ -0,0 +1,63 @@
+"""اختبارات رفض المعاملات غير الصالحة برمز 400 قبل الوصول إلى النموذج"""
+
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+from src.auth import api_key_manager
+from src.code_services import MAX_COMPLETION_SAMPLES, code_services
+from src.routes.api_routes import api_bp
+from src.stopping import BATCH_WINDOW_MS
+
+TEST_KEY = "test-validation-key"
+
+
+@pytest.fixture
+def client():
+    api_key_manager.api_keys[TEST_KEY] = {
+        'user': 'tests', 'rate_limit': 1000, 'weight': None, 'created_at': datetime.now(),
+        'last_used': None, 'total_requests': 0, 'allowed_endpoints': ['*']
+    }
+    app = Flask(__name__)
+    app.register_blueprint(api_bp, url_prefix='/api')
+    yield app.test_client()
+    api_key_manager.api_keys.pop(TEST_KEY, None)
+
+
+def post(client, path, payload):
+    return client.post(path, json=payload, headers={"X-API-Key": TEST_KEY})
+
+
+@pytest.mark.parametrize("n", ["2", 2.0, True, 0, MAX_COMPLETION_SAMPLES + 1])
+def test_invalid_sample_count_is_rejected(client, n):
+    response = post(client, "/api/v1/completions", {"code": "def f():", "n": n})
+    assert response.status_code == 400
+    assert "n" in response.get_json()["error"]
+
+
+@pytest.mark.parametrize("path", ["/api/v1/completions", "/api/v1/explanations"])
+def test_deadline_within_batch_window_is_rejected(client, path):
+    response = post(client, path, {"code": "def f():", "deadline_ms": BATCH_WINDOW_MS})
+    assert response.status_code == 400
+    assert "deadline_ms" in response.get_json()["error"]
+
+
+def test_valid_sample_count_is_parsed():
+    assert code_services.parse_sample_count({}) == 1
+    assert code_services.parse_sample_count({"n": MAX_COMPLETION_SAMPLES}) == MAX_COMPLETION_SAMPLES
+
+
+def test_string_flags_are_coerced_for_samples(monkeypatch):
+    captured = {}
+
+    def fake_generate_samples(prompt, n, **kwargs):
+        captured.update(kwargs)
+        kwargs["usage"].update({"input_tokens": 1, "output_tokens": 1, "truncated": False})
+        return [{"text": "pass", "mean_logprob": 0.0, "tokens": 1}] * n
+
+    monkeypatch.setattr("src.code_services.model_registry.generate_samples", fake_generate_samples)
+    result = code_services.complete_code({"code": "def f():", "n": 2, "dedup": "false", "rank": "0"})
+    assert result["success"], result
+    assert captured["dedup"] is False
+    assert captured["rank"] is False
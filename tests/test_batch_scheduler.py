@@ -0,0 +1,184 @@
+"""اختبارات انحدار مجدول الدفعات المستمرة
+
+يُقارن الإخراج الجشع للدفعة المبطنة من اليسار (مع انضمام الطلبات ومغادرتها
+أثناء فك الترميز) بإخراج model.generate لكل prompt منفرداً رمزاً برمز.
+"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from src.batch_scheduler import BatchScheduler, GenerationRequest
+from src.prefix_cache import PrefixCache
+from src.stopping import Deadline, DeadlineExceeded
+
+PAD_ID = 0
+
+PROMPTS = [
+    [5, 17, 42, 8, 99, 23, 61],
+    [12, 3],
+    [77, 31, 64, 2, 90],
+    [40, 41, 42, 43, 44, 45, 46, 47, 48, 49, 50],
+]
+
+
+class SlowModel:
+    """تغليف النموذج بتأخير ثابت لكل تمرير حتى تنضم الطلبات أثناء فك الترميز"""
+
+    def __init__(self, model, delay):
+        self.model = model
+        self.delay = delay
+
+    def __call__(self, **kwargs):
+        time.sleep(self.delay)
+        return self.model(**kwargs)
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=128, n_positions=128, n_embd=32, n_layer=2, n_head=4,
+        initializer_range=0.5, bos_token_id=1000, eos_token_id=1000
+    )
+    return GPT2LMHeadModel(config).eval()
+
+
+def make_scheduler(model, delay=0.0, **kwargs):
+    manager = SimpleNamespace(
+        model=SlowModel(model, delay) if delay else model,
+        tokenizer=SimpleNamespace(pad_token_id=PAD_ID, eos_token_id=None),
+        model_lock=threading.Lock(),
+        prefix_cache=PrefixCache(max_memory_mb=8),
+        draft_model=None
+    )
+    return BatchScheduler(manager, **kwargs)
+
+
+def reference(model, prompt, max_new_tokens):
+    """الإخراج الجشع لـ HF generate لـ prompt منفرد دون تبطين (رمز النهاية خارج المفردات فلا يتوقف مبكراً)"""
+    with torch.no_grad():
+        output = model.generate(
+            torch.tensor([prompt]), attention_mask=torch.ones((1, len(prompt)), dtype=torch.long),
+            max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=PAD_ID
+        )
+    return output[0, len(prompt):].tolist()
+
+
+def greedy_request(prompt, max_new_tokens, deadline=None):
+    return GenerationRequest(
+        input_ids=list(prompt), max_new_tokens=max_new_tokens, temperature=0.7,
+        repetition_penalty=1.0, do_sample=False, deadline=deadline
+    )
+
+
+def wait_all(requests):
+    for request in requests:
+        assert request.done.wait(30)
+        assert request.error is None
+
+
+def test_padded_batch_matches_generate(model):
+    scheduler = make_scheduler(model, max_batch_size=4, batch_window_ms=200)
+    lengths = [12, 5, 20, 9]
+    try:
+        requests = [scheduler.submit(greedy_request(p, n)) for p, n in zip(PROMPTS, lengths)]
+        wait_all(requests)
+    finally:
+        scheduler.stop()
+
+    # أطوال مختلفة تعني مغادرة التسلسلات الدفعة في خطوات مختلفة
+    assert scheduler.get_stats()["max_observed_batch"] == 4
+    for request, prompt, length in zip(requests, PROMPTS, lengths):
+        assert request.generated_ids == reference(model, prompt, length)
+
+
+def test_requests_joining_mid_decode_match_generate(model):
+    scheduler = make_scheduler(model, delay=0.005, max_batch_size=4, batch_window_ms=1)
+    try:
+        first = scheduler.submit(greedy_request(PROMPTS[0], 30))
+        deadline = time.time() + 10
+        # التسلسل الجاري أطول من الطلبات المنضمة فتُبطن ذاكرتها من اليسار عند الدمج
+        while len(first.generated_ids) < 8 and time.time() < deadline:
+            time.sleep(0.001)
+        assert not first.done.is_set()
+
+        # الطلبات الجديدة تُرمز ثم تُدمج ذاكرة KV الخاصة بها مع الدفعة الجارية
+        joined = [scheduler.submit(greedy_request(p, 8)) for p in PROMPTS[1:]]
+        wait_all([first] + joined)
+    finally:
+        scheduler.stop()
+
+    assert scheduler.get_stats()["max_observed_batch"] == 4
+    assert first.generated_ids == reference(model, PROMPTS[0], 30)
+    for request, prompt in zip(joined, PROMPTS[1:]):
+        assert request.generated_ids == reference(model, prompt, 8)
+
+
+def test_prefix_cache_reuse_matches_generate(model):
+    scheduler = make_scheduler(model, max_batch_size=2, batch_window_ms=1)
+    prompt = PROMPTS[3]
+    try:
+        warm = scheduler.submit(greedy_request(prompt, 4))
+        wait_all([warm])
+        # الطلب التالي يشارك البادئة فيُرمز ذيله فقط فوق ذاكرة KV المخزنة
+        extended = scheduler.submit(greedy_request(prompt + [7, 8, 9], 10))
+        wait_all([extended])
+    finally:
+        scheduler.stop()
+
+    assert scheduler.model_manager.prefix_cache.get_stats()["hits"] >= 1
+    assert extended.generated_ids == reference(model, prompt + [7, 8, 9], 10)
+
+
+def test_expired_pending_request_is_dropped_before_prefill(model):
+    scheduler = make_scheduler(model, max_batch_size=4, batch_window_ms=50)
+    calls = []
+    real_model = scheduler.model_manager.model
+
+    def counting_model(**kwargs):
+        calls.append(kwargs["input_ids"].shape[0])
+        return real_model(**kwargs)
+
+    scheduler.model_manager.model = counting_model
+    try:
+        expired = greedy_request(PROMPTS[0], 5, deadline=Deadline(1))
+        time.sleep(0.01)
+        live = greedy_request(PROMPTS[1], 5)
+        scheduler.submit(expired)
+        scheduler.submit(live)
+        assert expired.done.wait(10) and live.done.wait(10)
+    finally:
+        scheduler.stop()
+
+    assert isinstance(expired.error, DeadlineExceeded)
+    assert expired.generated_ids == []
+    assert live.error is None
+    assert live.generated_ids == reference(model, PROMPTS[1], 5)
+    # الطلب المنتهي لم يدخل أي تمرير للنموذج
+    assert max(calls) == 1
+    assert scheduler.get_stats()["expired_requests"] == 1
+
+
+def test_cancelled_request_leaves_batch_early(model):
+    scheduler = make_scheduler(model, delay=0.005, max_batch_size=4, batch_window_ms=1)
+    try:
+        cancelled = scheduler.submit(greedy_request(PROMPTS[0], 100))
+        other = scheduler.submit(greedy_request(PROMPTS[1], 30))
+        deadline = time.time() + 10
+        while len(cancelled.generated_ids) < 5 and time.time() < deadline:
+            time.sleep(0.001)
+        cancelled.cancel()
+        assert cancelled.done.wait(10)
+        wait_all([other])
+    finally:
+        scheduler.stop()
+
+    # التسلسل الملغى خرج بعد خطوة واحدة على الأكثر دون التأثير في بقية الدفعة
+    assert len(cancelled.generated_ids) < 30
+    assert other.generated_ids == reference(model, PROMPTS[1], 30)
+    assert scheduler.get_stats()["cancelled_requests"] == 1
@@ -0,0 +1,26 @@
+"""اختبارات التحقق من deadline_ms مقابل نافذة تجميع الدفعة"""
+
+import pytest
+
+from src.stopping import BATCH_WINDOW_MS, Deadline
+
+
+def test_missing_deadline_is_none():
+    assert Deadline.from_data({}) is None
+
+
+@pytest.mark.parametrize("value", [-5, 0, 1, BATCH_WINDOW_MS])
+def test_deadline_within_batch_window_is_rejected(value):
+    with pytest.raises(ValueError, match="deadline_ms"):
+        Deadline.from_data({"deadline_ms": value})
+
+
+def test_non_numeric_deadline_is_rejected():
+    with pytest.raises(ValueError, match="deadline_ms"):
+        Deadline.from_data({"deadline_ms": "soon"})
+
+
+def test_deadline_above_batch_window_is_accepted():
+    deadline = Deadline.from_data({"deadline_ms": str(BATCH_WINDOW_MS + 1)})
+    assert deadline.deadline_ms == BATCH_WINDOW_MS + 1
+    assert not deadline.expired()
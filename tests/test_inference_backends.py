@@ -0,0 +1,102 @@
+"""اختبارات الواجهة الخلفية ONNX Runtime: بنية ذاكرة KV والتصدير مرة واحدة"""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel, GPTBigCodeConfig, GPTBigCodeForCausalLM
+
+pytest.importorskip("onnxruntime")
+
+import src.inference_backends as inference_backends
+from src.batch_scheduler import BatchScheduler, GenerationRequest
+from src.inference_backends import KVLayout, OnnxRuntimeBackend
+from src.prefix_cache import PrefixCache
+
+MODELS = {
+    "gpt2": lambda: GPT2LMHeadModel(GPT2Config(
+        vocab_size=128, n_positions=64, n_embd=32, n_layer=2, n_head=4, initializer_range=0.5
+    )),
+    "gpt_bigcode_mqa": lambda: GPTBigCodeForCausalLM(GPTBigCodeConfig(
+        vocab_size=128, n_positions=64, n_embd=32, n_layer=2, n_head=4, multi_query=True,
+        initializer_range=0.5, bos_token_id=1000, eos_token_id=1000
+    )),
+    "gpt_bigcode_mha": lambda: GPTBigCodeForCausalLM(GPTBigCodeConfig(
+        vocab_size=128, n_positions=64, n_embd=32, n_layer=2, n_head=4, multi_query=False,
+        initializer_range=0.5
+    )),
+}
+
+
+@pytest.fixture(scope="module", params=list(MODELS))
+def exported(request, tmp_path_factory):
+    torch.manual_seed(0)
+    model = MODELS[request.param]().eval()
+    model_dir = str(tmp_path_factory.mktemp(request.param))
+    model.save_pretrained(model_dir)
+    backend = OnnxRuntimeBackend(cache_dir=str(tmp_path_factory.mktemp("onnx")))
+    return model, model_dir, backend, backend.load_model(model_dir)
+
+
+def test_layout_from_config_matches_model_cache(exported):
+    model, _, _, onnx_model = exported
+    with torch.no_grad():
+        past = model(input_ids=torch.zeros((2, 3), dtype=torch.long), use_cache=True).past_key_values
+    layout = KVLayout.from_config(model.config)
+    layout.validate(past)
+    assert all(t.shape == layout.shape(2, 3) for t in layout.flatten(past))
+    assert onnx_model.layout.names("past") == layout.names("past")
+
+
+def test_prefill_and_decode_match_torch(exported):
+    model, _, _, onnx_model = exported
+    input_ids = torch.tensor([[5, 6, 7, 8], [9, 10, 11, 12]])
+    next_ids = torch.tensor([[3], [4]])
+    with torch.no_grad():
+        expected = model(input_ids=input_ids, use_cache=True)
+        expected_step = model(input_ids=next_ids, past_key_values=expected.past_key_values, use_cache=True)
+    actual = onnx_model(input_ids=input_ids)
+    actual_step = onnx_model(input_ids=next_ids, past_key_values=actual.past_key_values)
+
+    assert torch.allclose(actual.logits, expected.logits, atol=1e-4)
+    assert torch.allclose(actual_step.logits, expected_step.logits, atol=1e-4)
+
+
+def test_cached_export_skips_torch_load(exported, monkeypatch):
+    _, model_dir, backend, _ = exported
+
+    def fail(*args, **kwargs):
+        raise AssertionError("تحميل نموذج PyTorch رغم وجود ملف ONNX المخزن")
+
+    monkeypatch.setattr(inference_backends.AutoModelForCausalLM, "from_pretrained", fail)
+    OnnxRuntimeBackend(cache_dir=backend.cache_dir).load_model(model_dir)
+
+
+def test_batched_onnx_greedy_matches_generate(exported):
+    model, _, _, onnx_model = exported
+    manager = SimpleNamespace(
+        model=onnx_model,
+        tokenizer=SimpleNamespace(pad_token_id=0, eos_token_id=None),
+        model_lock=threading.Lock(),
+        prefix_cache=PrefixCache(max_memory_mb=8),
+        draft_model=None
+    )
+    scheduler = BatchScheduler(manager, max_batch_size=3, batch_window_ms=200)
+    prompts = [[5, 17, 42, 8, 99], [12, 3], [77, 31, 64, 2, 90, 11, 23]]
+    try:
+        requests = [
+            scheduler.submit(GenerationRequest(p, 8, 0.7, 1.0, do_sample=False)) for p in prompts
+        ]
+        for request in requests:
+            assert request.done.wait(30) and request.error is None
+    finally:
+        scheduler.stop()
+
+    for request, prompt in zip(requests, prompts):
+        with torch.no_grad():
+            output = model.generate(
+                torch.tensor([prompt]), attention_mask=torch.ones((1, len(prompt)), dtype=torch.long),
+                max_new_tokens=8, do_sample=False, pad_token_id=0, eos_token_id=1000
+            )
+        assert request.generated_ids == output[0, len(prompt):].tolist()
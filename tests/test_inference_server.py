@@ -0,0 +1,59 @@
+"""اختبارات أمان مقبس خادم الاستدلال: الصلاحيات ومفتاح المصادقة"""
+
+import os
+import stat
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+import pytest
+
+from src.inference_server import InferenceServer, ensure_authkey, load_authkey
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.delenv("INFERENCE_SERVER_AUTHKEY", raising=False)
+    socket_path = str(tmp_path / "private" / "inference.sock")
+    key = ensure_authkey(socket_path)
+    instance = InferenceServer(model_registry=None, socket_path=socket_path, authkey=key)
+    thread = threading.Thread(target=instance.serve_forever, daemon=True)
+    thread.start()
+    deadline = time.time() + 5
+    while not instance.running and time.time() < deadline:
+        time.sleep(0.01)
+    yield instance
+    instance.stop()
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_socket_and_key_are_private(server):
+    assert mode(os.path.dirname(server.socket_path)) == 0o700
+    assert mode(server.socket_path) & 0o077 == 0
+    assert mode(server.socket_path + ".key") == 0o600
+
+
+def test_generated_key_is_shared_through_key_file(server):
+    assert load_authkey(server.socket_path) == server.authkey
+    connection = Client(server.socket_path, family='AF_UNIX', authkey=server.authkey)
+    connection.close()
+
+
+def test_wrong_key_is_rejected(server):
+    with pytest.raises(AuthenticationError):
+        Client(server.socket_path, family='AF_UNIX', authkey=b"wrong")
+
+
+def test_server_requires_key(tmp_path):
+    with pytest.raises(ValueError):
+        InferenceServer(model_registry=None, socket_path=str(tmp_path / "inference.sock"), authkey=b"")
+
+
+def test_client_without_key_fails_clearly(tmp_path, monkeypatch):
+    monkeypatch.delenv("INFERENCE_SERVER_AUTHKEY", raising=False)
+    with pytest.raises(ConnectionError):
+        load_authkey(str(tmp_path / "inference.sock"))
@@ -0,0 +1,46 @@
+"""اختبارات اختيار الدقة للنموذج المحلي المربوط بالذاكرة"""
+
+import os
+
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from src.model_artifact import artifact_precision, load_mmap_model
+from src.model_manager import ModelManager
+
+
+def save_artifact(path, dtype):
+    model = GPT2LMHeadModel(GPT2Config(vocab_size=64, n_embd=16, n_layer=1, n_head=2, n_positions=32))
+    model.to(dtype).save_pretrained(path, safe_serialization=True)
+    with open(os.path.join(path, "tokenizer.json"), "w") as f:
+        f.write("{}")
+    return str(path)
+
+
+@pytest.mark.parametrize("dtype, precision", [(torch.float32, "fp32"), (torch.bfloat16, "bf16")])
+def test_auto_precision_uses_artifact_dtype_without_calibration(tmp_path, dtype, precision):
+    path = save_artifact(tmp_path, dtype)
+    assert artifact_precision(path) == precision
+
+    manager = ModelManager(model_name=path)
+    manager.precision_setting = "auto"
+    calls = []
+    manager.precision_calibrator.select = lambda *args: calls.append(args) or "int8"
+
+    assert manager._select_precision() == precision
+    assert calls == []
+
+
+def test_explicit_precision_overrides_artifact(tmp_path):
+    manager = ModelManager(model_name=save_artifact(tmp_path, torch.float32))
+    manager.precision_setting = "int8"
+    assert manager._select_precision() == "int8"
+
+
+def test_matching_precision_keeps_weights_mapped(tmp_path):
+    path = save_artifact(tmp_path, torch.float32)
+    model = load_mmap_model(path)
+    before = model.transformer.wte.weight.data_ptr()
+    # التحويل إلى دقة الملف نفسها لا ينسخ الأوزان المربوطة بالذاكرة
+    assert model.to(torch.float32).transformer.wte.weight.data_ptr() == before
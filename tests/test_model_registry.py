@@ -0,0 +1,115 @@
+"""اختبارات سجل النماذج: التفريغ لإفساح الذاكرة وذاكرة النتائج المشتركة"""
+
+import threading
+import time
+
+import pytest
+
+from src.generation_cache import RESPONSE_CACHE_FRACTION
+from src.model_manager import ModelRegistry
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setenv("MODEL_REGISTRY", "small=unused-small,large=unused-large")
+    monkeypatch.setenv("MAX_MEMORY_MB", "450")
+    monkeypatch.delenv("RESPONSE_CACHE_MB", raising=False)
+    registry = ModelRegistry()
+    for manager in registry.models.values():
+        install_fake_model(manager)
+    return registry
+
+
+def install_fake_model(manager, footprint_mb=300.0):
+    """تحميل وتفريغ وهميان: التفريغ ينتظر إشارة حتى يُختبر ما يصل أثناءه"""
+    manager.unload_started = threading.Event()
+    manager.unload_gate = threading.Event()
+    manager.unload_gate.set()
+    manager.loads = 0
+
+    def load():
+        manager.loads += 1
+        manager.tokenizer = object()
+        manager.footprint_mb = footprint_mb
+        manager.model_loaded = True
+        return True
+
+    def cleanup():
+        manager.unload_started.set()
+        manager.unload_gate.wait(5)
+        manager.tokenizer = None
+        manager.model_loaded = False
+        manager.lifecycle.on_unloaded()
+
+    manager._load_model = load
+    manager.cleanup_model = cleanup
+
+
+def test_request_arriving_during_eviction_parks_and_reloads(registry):
+    small, large = registry.models["small"], registry.models["large"]
+    assert small.load_model()
+    # الحجم المقاس في تحميل سابق
+    large.footprint_mb = 300.0
+    small.unload_gate.clear()
+
+    # النموذج الكبير لا يتسع مع الصغير فيُفرَّغ الصغير الخامل
+    evictor = threading.Thread(target=registry._make_room, args=(large,))
+    evictor.start()
+    assert small.unload_started.wait(5)
+
+    # طلب موجه إلى الصغير يصل أثناء التفريغ وما زال model_loaded صحيحاً
+    outcome = {}
+
+    def routed_request():
+        with small.lifecycle.request():
+            outcome["tokenizer"] = small.tokenizer
+            outcome["loaded"] = small.model_loaded
+
+    requester = threading.Thread(target=routed_request)
+    requester.start()
+    time.sleep(0.1)
+    assert "tokenizer" not in outcome
+
+    small.unload_gate.set()
+    evictor.join(5)
+    requester.join(5)
+
+    assert outcome["tokenizer"] is not None and outcome["loaded"]
+    assert small.loads == 2
+    assert registry.evictions == 1
+    stats = small.lifecycle.get_stats()
+    assert stats["parked_waiters"] == 1
+    assert stats["cold_starts"] == 1
+
+
+def test_busy_model_is_not_evicted(registry):
+    small, large = registry.models["small"], registry.models["large"]
+    assert small.load_model()
+    large.footprint_mb = 300.0
+    with small.lifecycle.request():
+        registry._make_room(large)
+        assert small.model_loaded
+    assert registry.evictions == 0
+
+
+def test_response_cache_budget_is_split_and_aggregated(registry):
+    small, large = registry.models["small"], registry.models["large"]
+    total_mb = 450 * RESPONSE_CACHE_FRACTION
+    assert small.response_cache.max_bytes + large.response_cache.max_bytes == pytest.approx(
+        total_mb * 1024 * 1024, abs=2
+    )
+
+    small.response_cache.put("a", "x")
+    small.response_cache.get("a")
+    large.response_cache.get("missing")
+    stats = registry.response_cache_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+    assert stats["memory_limit_mb"] == pytest.approx(total_mb, abs=0.02)
+    assert set(stats["models"]) == {"small", "large"}
+
+
+def test_footprint_counts_response_caches(registry):
+    caches_mb = sum(m.response_cache.max_bytes for m in registry.models.values()) / 1024 / 1024
+    assert registry._loaded_footprint_mb() == pytest.approx(caches_mb)
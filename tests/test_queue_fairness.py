@@ -0,0 +1,70 @@
+"""اختبارات عدالة الطابور بين المفاتيح: جدولة العجز الدوري (DRR) بالأوزان"""
+
+import pytest
+
+import src.queue_manager as queue_module
+from src.auth import APIKeyManager
+from src.queue_manager import QueueManager, QueueFullError
+
+
+@pytest.fixture
+def key_manager(monkeypatch):
+    # الوزن الرابع اختياري: noisy بوزن 1 صريح، و heavy بوزن 3، و premium يأخذ وزن مستواه
+    monkeypatch.setenv("API_KEYS", "noisy:alice:10:1,heavy:bob:10:3,premium:carol:100")
+    manager = APIKeyManager()
+    monkeypatch.setattr(queue_module, "api_key_manager", manager)
+    return manager
+
+
+def run_order(queue, submissions):
+    """تشغيل المهام المرسلة بعامل واحد وإرجاع المفاتيح بترتيب التنفيذ"""
+    order = []
+    task_ids = [
+        queue.submit_task("explanations", {"key": api_key}, lambda data: order.append(data["key"]), api_key=api_key)
+        for api_key in submissions
+    ]
+    queue.start_worker()
+    try:
+        for task_id in task_ids:
+            assert queue.wait_for_task(task_id, timeout=5)["status"] == "completed"
+    finally:
+        queue.stop_worker()
+    return order
+
+
+def test_api_keys_weight_field(key_manager):
+    assert key_manager.get_tier("noisy") == {"tier": "free", "priority": 2, "weight": 1.0}
+    assert key_manager.get_tier("heavy") == {"tier": "free", "priority": 2, "weight": 3.0}
+    assert key_manager.get_tier("premium") == {"tier": "premium", "priority": 0, "weight": 4.0}
+    assert key_manager.get_tier("unknown")["weight"] == 1.0
+
+
+def test_second_key_interleaves_by_weight(key_manager):
+    queue = QueueManager(max_concurrent_tasks=1, max_queue_size=50, max_tenant_queue_size=20)
+    order = run_order(queue, ["noisy"] * 12 + ["heavy"] * 12)
+
+    # المفتاح المزدحم ملأ الطابور أولاً، ومع ذلك يُخدم الثاني بنسبة وزنه 1:3
+    assert order[:8] == ["noisy", "heavy", "heavy", "heavy"] * 2
+    assert order[:16].count("noisy") == 4
+    assert order[:16].count("heavy") == 12
+    assert order[16:] == ["noisy"] * 8
+
+
+def test_tier_weight_applies_without_weight_field(key_manager):
+    queue = QueueManager(max_concurrent_tasks=1, max_queue_size=50, max_tenant_queue_size=20)
+    order = run_order(queue, ["noisy"] * 10 + ["premium"] * 8)
+    assert order[:10] == ["noisy"] + ["premium"] * 4 + ["noisy"] + ["premium"] * 4
+
+
+def test_tenant_cap_does_not_block_other_keys(key_manager):
+    queue = QueueManager(max_concurrent_tasks=1, max_queue_size=50, max_tenant_queue_size=3)
+    for _ in range(3):
+        queue.submit_task("explanations", {}, lambda data: None, api_key="noisy")
+
+    with pytest.raises(QueueFullError) as excinfo:
+        queue.submit_task("explanations", {}, lambda data: None, api_key="noisy")
+    assert excinfo.value.tenant is True
+
+    queue.submit_task("explanations", {}, lambda data: None, api_key="heavy")
+    tenants = queue.get_queue_status()["tenants"]
+    assert [stats["waiting"] for stats in tenants.values()] == [3, 1]
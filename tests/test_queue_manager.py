@@ -0,0 +1,176 @@
+"""اختبارات مدير الطابور: العمال المحدودون وحد الطابور والإيقاف مع التصريف"""
+
+import threading
+import time
+
+import pytest
+
+from src.queue_manager import QueueManager, QueueFullError, TaskStatus
+from src.stopping import BATCH_WINDOW_MS
+
+
+def make_queue(**kwargs):
+    kwargs.setdefault("max_concurrent_tasks", 2)
+    kwargs.setdefault("max_queue_size", 50)
+    kwargs.setdefault("max_tenant_queue_size", 50)
+    return QueueManager(**kwargs)
+
+
+def test_worker_pool_bounds_concurrency():
+    queue = make_queue(max_concurrent_tasks=2)
+    lock = threading.Lock()
+    release = threading.Event()
+    running = {"now": 0, "peak": 0}
+
+    def callback(data):
+        with lock:
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+        release.wait(5)
+        with lock:
+            running["now"] -= 1
+        return data["index"]
+
+    queue.start_worker()
+    try:
+        task_ids = [queue.submit_task("explanations", {"index": index}, callback) for index in range(6)]
+        deadline = time.time() + 5
+        while queue.get_queue_status()["active_tasks"] < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+
+        status = queue.get_queue_status()
+        assert status["active_tasks"] == 2
+        assert status["waiting_tasks"] == 4
+
+        release.set()
+        results = [queue.wait_for_task(task_id, timeout=5) for task_id in task_ids]
+    finally:
+        release.set()
+        queue.stop_worker()
+
+    assert running["peak"] == 2
+    assert [result["status"] for result in results] == ["completed"] * 6
+    assert sorted(result["result"] for result in results) == list(range(6))
+
+
+def test_failed_task_keeps_worker_alive():
+    queue = make_queue(max_concurrent_tasks=1)
+
+    def failing(data):
+        raise ValueError("boom")
+
+    queue.start_worker()
+    try:
+        failed = queue.wait_for_task(queue.submit_task("explanations", {}, failing), timeout=5)
+        completed = queue.wait_for_task(queue.submit_task("explanations", {}, lambda data: "ok"), timeout=5)
+    finally:
+        queue.stop_worker()
+
+    assert failed["status"] == "failed"
+    assert failed["error"] == "boom"
+    assert completed["result"] == "ok"
+
+
+def test_submit_raises_when_queue_full():
+    queue = make_queue(max_queue_size=3)
+    for _ in range(3):
+        queue.submit_task("explanations", {}, lambda data: None)
+
+    with pytest.raises(QueueFullError) as excinfo:
+        queue.submit_task("explanations", {}, lambda data: None)
+    assert excinfo.value.tenant is False
+    assert queue.get_queue_status()["waiting_tasks"] == 3
+
+
+def test_cancelled_task_frees_queue_slot():
+    queue = make_queue(max_queue_size=1)
+    task_id = queue.submit_task("explanations", {}, lambda data: None)
+    with pytest.raises(QueueFullError):
+        queue.submit_task("explanations", {}, lambda data: None)
+
+    assert queue.cancel_task(task_id)
+    assert queue.get_task_status(task_id)["status"] == "cancelled"
+    queue.submit_task("explanations", {}, lambda data: None)
+
+
+def test_stop_worker_drains_waiting_tasks():
+    queue = make_queue(max_concurrent_tasks=1)
+    gate = threading.Event()
+
+    def callback(data):
+        gate.wait(5)
+        time.sleep(0.01)
+        return data["index"]
+
+    queue.start_worker()
+    task_ids = [queue.submit_task("explanations", {"index": index}, callback) for index in range(5)]
+    workers = list(queue.worker_threads)
+
+    stopper = threading.Thread(target=queue.stop_worker)
+    stopper.start()
+    deadline = time.time() + 5
+    while not queue.draining and time.time() < deadline:
+        time.sleep(0.01)
+
+    # لا تُقبل مهام جديدة أثناء التصريف
+    with pytest.raises(QueueFullError):
+        queue.submit_task("explanations", {}, callback)
+
+    gate.set()
+    stopper.join(10)
+
+    assert not stopper.is_alive()
+    assert not any(worker.is_alive() for worker in workers)
+    assert [queue.tasks[task_id].status for task_id in task_ids] == [TaskStatus.COMPLETED] * 5
+    assert queue.get_queue_status()["waiting_tasks"] == 0
+
+
+def test_stop_worker_without_drain_leaves_tasks_pending():
+    queue = make_queue(max_concurrent_tasks=1)
+    release = threading.Event()
+
+    queue.start_worker()
+    first = queue.submit_task("explanations", {}, lambda data: release.wait(5))
+    deadline = time.time() + 5
+    while queue.get_task_status(first)["status"] != "processing" and time.time() < deadline:
+        time.sleep(0.01)
+    waiting = queue.submit_task("explanations", {}, lambda data: None)
+
+    release.set()
+    queue.stop_worker(drain=False)
+
+    assert queue.get_task_status(first)["status"] == "completed"
+    assert queue.get_task_status(waiting)["status"] == "pending"
+
+
+def test_task_with_deadline_inside_batch_window_expires_in_queue():
+    queue = make_queue(max_concurrent_tasks=1)
+    gate = threading.Event()
+    started = []
+
+    def blocking(data):
+        gate.wait(5)
+
+    def callback(data):
+        started.append(data["deadline_ms"])
+        return "ok"
+
+    queue.start_worker()
+    try:
+        queue.submit_task("explanations", {}, blocking)
+        short = queue.submit_task("explanations", {"deadline_ms": BATCH_WINDOW_MS + 30}, callback)
+        long = queue.submit_task("explanations", {"deadline_ms": 5000}, callback)
+        # المهمة القصيرة تنتظر حتى لا يتبقى من مهلتها أكثر من نافذة تجميع الدفعة
+        time.sleep(0.04)
+        gate.set()
+        short_result = queue.wait_for_task(short, timeout=5)
+        long_result = queue.wait_for_task(long, timeout=5)
+    finally:
+        gate.set()
+        queue.stop_worker()
+
+    assert short_result["status"] == "expired"
+    assert long_result["status"] == "completed"
+    # المهلة الممررة للخدمة هي المتبقي بعد الانتظار وتتجاوز النافذة
+    assert len(started) == 1 and BATCH_WINDOW_MS < started[0] < 5000
@@ -0,0 +1,84 @@
+"""اختبارات ترتيب الطابور بالأولوية مع الشيخوخة"""
+
+import time
+
+import pytest
+
+import src.queue_manager as queue_module
+from src.queue_manager import QueueManager
+
+
+def run_order(queue, submissions):
+    """تشغيل المهام المرسلة بعامل واحد وإرجاع ترتيب تنفيذها"""
+    order = []
+    task_ids = []
+    for label, endpoint, pause in submissions:
+        task_ids.append(queue.submit_task(endpoint, {"label": label}, lambda data: order.append(data["label"])))
+        if pause:
+            time.sleep(pause)
+
+    queue.start_worker()
+    try:
+        for task_id in task_ids:
+            assert queue.wait_for_task(task_id, timeout=5)["status"] == "completed"
+    finally:
+        queue.stop_worker()
+    return order
+
+
+@pytest.fixture
+def queue():
+    return QueueManager(max_concurrent_tasks=1, max_queue_size=50, max_tenant_queue_size=50)
+
+
+def test_completions_overtake_earlier_lower_priority_tasks(queue, monkeypatch):
+    monkeypatch.setattr(queue_module, "PRIORITY_AGING_SECONDS", 5.0)
+    order = run_order(queue, [
+        ("explain", "explanations", 0),
+        ("complete-1", "completions", 0),
+        ("complete-2", "completions", 0),
+    ])
+    assert order == ["complete-1", "complete-2", "explain"]
+
+
+def test_aged_low_priority_task_overtakes_newer_high_priority_tasks(queue, monkeypatch):
+    monkeypatch.setattr(queue_module, "PRIORITY_AGING_SECONDS", 0.05)
+    order = run_order(queue, [
+        # انتظار أطول من مستوى أولوية واحد يرفع المهمة فوق المهام الأحدث
+        ("explain", "explanations", 0.15),
+        ("complete-1", "completions", 0),
+        ("complete-2", "completions", 0),
+    ])
+    assert order == ["explain", "complete-1", "complete-2"]
+
+
+def test_low_priority_task_waits_within_aging_interval(queue, monkeypatch):
+    monkeypatch.setattr(queue_module, "PRIORITY_AGING_SECONDS", 5.0)
+    order = run_order(queue, [
+        ("explain", "explanations", 0.15),
+        ("complete", "completions", 0),
+    ])
+    assert order == ["complete", "explain"]
+
+
+def test_equal_priority_tasks_run_first_in_first_out(queue, monkeypatch):
+    monkeypatch.setattr(queue_module, "PRIORITY_AGING_SECONDS", 5.0)
+    submissions = [(f"task-{index}", "explanations", 0) for index in range(8)]
+    assert run_order(queue, submissions) == [label for label, _, _ in submissions]
+
+
+def test_cancelled_task_is_skipped(queue):
+    order = []
+    keep = queue.submit_task("explanations", {"label": "keep"}, lambda data: order.append(data["label"]))
+    dropped = queue.submit_task("explanations", {"label": "dropped"}, lambda data: order.append(data["label"]))
+    assert queue.cancel_task(dropped)
+
+    queue.start_worker()
+    try:
+        assert queue.wait_for_task(keep, timeout=5)["status"] == "completed"
+    finally:
+        queue.stop_worker()
+
+    assert order == ["keep"]
+    assert queue.get_task_status(dropped)["status"] == "cancelled"
+    assert queue.get_queue_status()["waiting_by_priority"] == {}
@@ -0,0 +1,116 @@
+"""اختبارات دمج طلبات التوليد المتطابقة المتزامنة"""
+
+import threading
+import time
+
+import pytest
+
+from src.model_manager import ModelManager
+from src.single_flight import SingleFlight
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def call(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    threads, results, errors = run_concurrently(4, lambda: flight.do("key", compute))
+    deadline = time.time() + 5
+    while flight.get_stats()["generations_saved"] < 3 and time.time() < deadline:
+        time.sleep(0.005)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == ["result"] * 4
+    assert flight.get_stats()["in_flight"] == 0
+
+
+def test_error_propagates_to_waiters_and_key_is_released():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise ValueError("boom")
+
+    threads, _, errors = run_concurrently(3, lambda: flight.do("key", failing))
+    deadline = time.time() + 5
+    while flight.get_stats()["generations_saved"] < 2 and time.time() < deadline:
+        time.sleep(0.005)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert flight.get_stats()["failed"] == 1
+    # المفتاح يُحرر بعد الفشل فيبدأ الطلب التالي تنفيذاً جديداً
+    assert flight.do("key", lambda: "retry") == "retry"
+
+
+@pytest.fixture
+def manager():
+    manager = ModelManager(model_name="unused")
+    release = threading.Event()
+    calls = []
+
+    def fake_generate(prompt, max_length, temperature, *args):
+        calls.append(temperature)
+        sample = f"sample-{len(calls)}"
+        release.wait(5)
+        return sample, {"input_tokens": 1, "output_tokens": 1, "truncated": False}
+
+    manager._generate = fake_generate
+    manager.release = release
+    manager.calls = calls
+    return manager
+
+
+def generate_concurrently(manager, count, **kwargs):
+    threads, results, errors = run_concurrently(count, lambda: manager.generate_text("same prompt", **kwargs))
+    time.sleep(0.1)
+    manager.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert errors == [None] * count
+    return results
+
+
+def test_deterministic_requests_are_shared(manager):
+    results = generate_concurrently(manager, 3, temperature=0.4, deterministic=True)
+    assert len(manager.calls) == 1
+    assert len(set(results)) == 1
+
+
+def test_greedy_temperature_requests_are_shared(manager):
+    generate_concurrently(manager, 3, temperature=0)
+    assert len(manager.calls) == 1
+
+
+def test_sampled_requests_each_get_their_own_sample(manager):
+    results = generate_concurrently(manager, 3, temperature=0.7)
+    assert len(manager.calls) == 3
+    assert len(set(results)) == 3
+    assert manager.single_flight.get_stats()["generations_saved"] == 0
@@ -0,0 +1,71 @@
+"""اختبارات ذاكرة ترميز الـ prompts: ترميز الكتل يطابق الترميز الكامل رمزاً برمز"""
+
+import pytest
+from tokenizers import Tokenizer, decoders, models, normalizers, pre_tokenizers, trainers
+from transformers import PreTrainedTokenizerFast
+
+from src.token_cache import TokenCache
+
+CORPUS = [
+    "import os\nimport sys\n\n\ndef main(argv):\n    return 0\n",
+    "class Point:\n    def __init__(self, x, y):\n        self.x = x\n\n    def norm(self):\n        return 1\n",
+    "# comment 12345\nvalue = [1, 2, 3]\nif value:\n    print(value)\nelse:\n    pass\n",
+]
+
+TEXTS = [
+    "import os\n\ndef f():\n    return os.sep\n",
+    "import os\nimport sys\n\n\nclass A:\n    pass\n\n\n\ndef g(x):\n    return x\n",
+    "def f():\n    x = 1\n    \n    return x\n  \n\ndef g():\n    pass\n",
+    "x = 1  \ny = 2\t\nz = 3\n\n# 2024\nprint(x)",
+    "# Complete this python code:\ndef fibonacci(n):\n    if n < 2:\n        return n\n\nresult = fibonacci(10)\n",
+]
+
+
+def byte_level_tokenizer(pre_tokenizer, normalizer=None):
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizer
+    if normalizer is not None:
+        tokenizer.normalizer = normalizer
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator(CORPUS * 10, trainers.BpeTrainer(
+        vocab_size=400, initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    ))
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer)
+
+
+TOKENIZERS = {
+    # بأسلوب GPT-2
+    "byte_level": lambda: byte_level_tokenizer(pre_tokenizers.ByteLevel(add_prefix_space=False)),
+    # بأسلوب StarCoder: فصل الأرقام ثم ByteLevel
+    "digits_byte_level": lambda: byte_level_tokenizer(pre_tokenizers.Sequence([
+        pre_tokenizers.Digits(individual_digits=True), pre_tokenizers.ByteLevel(add_prefix_space=False)
+    ])),
+    # مقسم لا يفصل عند الأسطر (بأسلوب SentencePiece) فيجب الرجوع إلى الترميز الكامل
+    "metaspace": lambda: byte_level_tokenizer(
+        pre_tokenizers.Metaspace(), normalizer=normalizers.Replace("\n", " ")
+    ),
+}
+
+
+@pytest.fixture(params=list(TOKENIZERS))
+def tokenizer(request):
+    return TOKENIZERS[request.param]()
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_encode_prompt_matches_full_encode(tokenizer, text):
+    cache = TokenCache()
+    assert cache.encode_prompt(tokenizer, text) == tokenizer.encode(text)
+    # المرة الثانية من الذاكرة المؤقتة تعطي الرموز نفسها
+    assert cache.encode_prompt(tokenizer, text) == tokenizer.encode(text)
+
+
+def test_shared_blocks_hit_the_cache():
+    tokenizer = TOKENIZERS["byte_level"]()
+    cache = TokenCache()
+    cache.encode_prompt(tokenizer, "import os\nx = 1\n")
+    misses = cache.get_stats()["misses"]
+    cache.encode_prompt(tokenizer, "import os\ny = 2\n")
+    stats = cache.get_stats()
+    assert stats["hits"] >= 1
+    assert stats["misses"] == misses + 1